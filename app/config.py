@@ -31,6 +31,66 @@ class Settings(BaseSettings):
 
     DS_API_KEY: str
 
+    REDIS_MAX_CONNECTIONS: int = 50 # соединений на клиент; сверх этого команда ждет свободное
+    REDIS_POOL_TIMEOUT: float = 1.0 # сколько команда ждет свободное соединение, секунды
+    REDIS_SOCKET_TIMEOUT: float = 1.0 # таймаут ответа Redis на команду, секунды
+    REDIS_CONNECT_TIMEOUT: float = 1.0 # таймаут установки соединения, секунды
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30 # соединение, простоявшее дольше, проверяется PING перед командой
+
+    DB_POOL_SIZE: int = 5 # постоянные соединения на воркер: воркеры * DB_POOL_SIZE < max_connections Postgres
+    DB_MAX_OVERFLOW: int = 10 # временные соединения сверх DB_POOL_SIZE под пиковую нагрузку
+    DB_POOL_TIMEOUT: float = 30 # сколько запрос ждет свободное соединение, потом ошибка
+    DB_POOL_RECYCLE: int = 1800 # пересоздавать соединения старше, секунды
+    DB_POOL_PRE_PING: bool = True # проверять соединение перед выдачей из пула
+    DB_STATEMENT_CACHE_SIZE: int = 100 # prepared statements asyncpg на соединение
+
+    CACHE_TTL: int = 180 # базовый TTL кеша выборок, секунды
+    CACHE_TTL_JITTER: float = 0.1 # TTL случайно растягивается до +10%, чтобы ключи не истекали разом
+    CACHE_EARLY_REFRESH_BETA: float = 1.0 # агрессивность раннего пересчета (XFetch), 0 — выключен
+    CACHE_LOCK_TTL: float = 5 # lock перестройки ключа между воркерами, секунды
+    CACHE_COMPRESS_MIN_BYTES: int = 4096 # значения кеша больше этого сжимаются zlib
+    CACHE_COMPRESS_LEVEL: int = 1 # уровень zlib: 1 — быстрее всего, выигрыш по размеру почти тот же
+
+    AGGREGATE_TOTALS_IN_DB: bool = True # суммы по валютам считает Postgres, в RPC уходят только итоги
+    USE_MONTHLY_ROLLUPS: bool = True # итоги за все время и за период читаются из месячных rollup-таблиц
+
+    HASH_WORKERS: int = 2 # процессы для Argon2, каждый может занять ~256 MiB
+    HASH_MAX_BACKLOG: int = 32 # сверх этого хеширование отвечает 503
+
+    JWT_CLAIMS_CACHE_SIZE: int = 4096 # сколько проверенных токенов держим в памяти воркера
+    USER_CLAIMS_TTL: int = 60 * 60 * 24 # claims юзера в Redis для /auth/refresh; при изменении юзера снимаются явно
+
+    CURRENCY_CONVERSION: str = 'local' # 'local' — по таблице курсов в приложении, 'rpc' — через currency_aggregator
+    CURRENCY_RATES_REFRESH: int = 3600 # период обновления курсов из URL_RATE_API, секунды
+    CURRENCY_RATES_RETRY: float = 5.0 # пауза после неудачной загрузки курсов, дальше удваивается
+    CURRENCY_RATES_RETRY_MAX: float = 300.0 # потолок этой паузы
+    RPC_BATCHING: bool = False # запросы конвертации уходят пачками; currency_aggregator должен понимать {"batch": [...]}
+    RPC_BATCH_WINDOW: float = 0.005 # сколько первый запрос пачки ждет остальных, секунды
+    RPC_BATCH_MAX: int = 64 # пачка такого размера отправляется сразу, не дожидаясь окна
+
+    RABBITMQ_CHANNEL_POOL_SIZE: int = 8 # каналов для публикации на воркер; сверх этого публикации ждут
+    RABBITMQ_PUBLISHER_CONFIRMS: bool = True # публикация ждет подтверждения брокера
+    RABBITMQ_PREFETCH: dict[str, int] = {'currency_aggregator': 200, 'report_builder': 16} # неподтвержденных ответов на канал
+    RABBITMQ_DEFAULT_PREFETCH: int = 100 # prefetch каналов, которых нет в RABBITMQ_PREFETCH
+
+    REPORT_CACHE_DIR: str = '/tmp/nmnh_report_cache' # готовые PDF отчеты
+    REPORT_CACHE_MAX_BYTES: int = 256 * 1024 * 1024 # сверх этого старые отчеты вытесняются (LRU)
+    REPORT_JOB_TTL: int = 60 * 60 # сколько живут статус и PDF асинхронной задачи на отчет
+    REPORT_RPC_TIMEOUT: float = 60 # сколько ждем PDF от report_builder
+
+    IMPORT_BATCH_SIZE: int = 5000 # строк CSV проверяется за раз перед отправкой в COPY
+
+    WARMUP_TIMEOUT: float = 10 # сколько ждем одну зависимость при прогреве на старте, секунды
+    WARMUP_RETRY_MAX: float = 30 # потолок паузы между попытками прогрева, секунды
+    SHUTDOWN_DRAIN_TIMEOUT: float = 10 # сколько на остановке ждем ответы на уже отправленные RPC
+
+    EMAIL_VALIDATION_TIMEOUT: float = 2.0 # общий таймаут запроса в Abstract API, секунды
+    EMAIL_DNS_TIMEOUT: float = 2.0 # таймаут проверки MX/A записей домена, секунды
+    EMAIL_ADDRESS_CACHE_TTL: int = 60 * 60 * 24 * 7 # вердикт по адресу в Redis
+    EMAIL_DOMAIN_CACHE_TTL: int = 60 * 60 * 24 # принимает ли домен почту — в Redis
+    EMAIL_BREAKER_FAILURES: int = 5 # столько сбоев подряд — и Abstract API перестаем спрашивать
+    EMAIL_BREAKER_RESET: float = 30 # через столько секунд пробуем провайдера снова
+
 
     @property
     def database_url(self) -> str:
@@ -0,0 +1,31 @@
+'''Сверка месячных rollup с сырыми таблицами:
+python -m app.database.check_rollups [--repair]'''
+import asyncio
+import sys
+from app.database.engine import session_factory
+from app.database.db_functions.db_rollups import ROLLUPS, find_rollup_mismatches, rebuild_rollup
+from app.database.db_functions.db_cache import bump_generation
+
+
+async def check_rollups(repair: bool = False) -> int:
+    found = 0
+    async with session_factory() as db:
+        for entity in ROLLUPS:
+            mismatches = await find_rollup_mismatches(db, entity)
+            found += len(mismatches)
+            for mismatch in mismatches:
+                print(entity, mismatch)
+            if repair and mismatches:
+                owners = {mismatch['owner_id'] for mismatch in mismatches}
+                for owner_id in owners:
+                    await rebuild_rollup(db, entity, owner_id)
+                await db.commit()
+                for owner_id in owners:  # закешированные итоги посчитаны по битому rollup
+                    await bump_generation(owner_id, entity)
+                print(f'{entity}: rebuilt rollups of {len(owners)} users')
+    return found
+
+
+if __name__ == '__main__':
+    mismatches = asyncio.run(check_rollups('--repair' in sys.argv))
+    sys.exit(1 if mismatches and '--repair' not in sys.argv else 0)
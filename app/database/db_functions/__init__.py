@@ -1,8 +1,15 @@
-from .db_user import create_user_in_db, get_user
+from .db_user import (create_user_in_db, get_user, get_user_claims, store_user_claims,
+                      user_claims, invalidate_user_claims)
 from .db_category import create_category_in_db, get_all_categories_from_db, delete_categories_from_db
 from .db_income import (create_income_in_db, get_all_incomes_from_db,
                         get_incomes_current_from_db, get_incomes_last_month_from_db,
-                        get_incomes_in_time_limits_from_db, delete_incomes_form_db)
-from .db_purchases import (create_purchases_list_in_db, get_all_purchases_from_db,
+                        get_incomes_in_time_limits_from_db, get_incomes_in_period_from_db,
+                        get_incomes_totals_from_db,
+                        get_incomes_page_from_db, stream_incomes_from_db,
+                        delete_incomes_form_db)
+from .db_purchases import (create_purchases_list_in_db, copy_purchases_to_db, get_all_purchases_from_db,
                            get_purchases_current_week_from_db, get_purchases_in_limits_from_db,
-                           delete_purchases_from_db)
\ No newline at end of file
+                           get_purchases_in_period_from_db,
+                           get_purchases_totals_from_db, get_purchases_page_from_db,
+                           stream_purchases_from_db, delete_purchases_from_db)
+from .db_report import get_report_rows_from_db
\ No newline at end of file
@@ -0,0 +1,292 @@
+import asyncio
+import math
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from app.config import settings
+from app.redis import Redis
+from app.database.read_models import to_columns
+from .db_codec import encode, decode
+
+
+GENERATION_TTL = 60 * 60 * 24  # сутки: заведомо дольше жизни любого ключа кеша
+LOCK_POLL = 0.05  # как часто ждущий воркер проверяет, не появилось ли значение
+
+
+def user_key(owner_id, *parts) -> str:
+    '''Все ключи юзера с hash tag {owner_id}: в Redis Cluster они в одном слоте и MGET/pipeline по ним работают'''
+    return ': '.join((f'{{{owner_id}}}', *map(str, parts)))
+
+
+def generation_key(owner_id, entity: str) -> str:
+    return user_key(owner_id, entity, 'generation')
+
+
+async def versioned_key(redis, owner_id, entity: str, suffix: str) -> str:
+    '''Ключ кеша с номером поколения: после bump_generation старые ключи недостижимы и умирают по TTL'''
+    generation = await redis.get(generation_key(owner_id, entity)) or 0
+    return user_key(owner_id, entity, f'v{generation}', suffix)
+
+
+async def versioned_keys(redis, owner_id, items: list[tuple[str, str]]) -> list[str]:
+    '''То же для нескольких (entity, suffix) одного юзера — поколения одним MGET'''
+    generations = await redis.mget([generation_key(owner_id, entity) for entity, _ in items])
+    return [user_key(owner_id, entity, f'v{generation or 0}', suffix)
+            for (entity, suffix), generation in zip(items, generations)]
+
+
+async def bump_generation(owner_id, entity: str) -> None:
+    '''Инвалидация всего кеша сущности юзера за один INCR вместо SCAN + UNLINK'''
+    redis = await Redis.get_redis()
+    key = generation_key(owner_id, entity)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.incr(key)
+        pipe.expire(key, GENERATION_TTL)
+        await pipe.execute()
+
+
+def consume_result(future: asyncio.Future) -> None:
+    if not future.cancelled():
+        future.exception()  # без ждущих ошибка лидера не должна сыпаться в лог "never retrieved"
+
+
+class SingleFlight:
+    '''Одна перестройка ключа на воркер: остальные запросы ждут ее результат, а не идут в Postgres'''
+    _inflight: dict[str, asyncio.Future] = {}
+
+
+    @classmethod
+    async def run(cls, key: str, rebuild, future: asyncio.Future | None = None):
+        '''future — перестройка, замеченная раньше: ее результат берем, даже если она уже закончилась'''
+        future = future or cls._inflight.get(key)
+        while future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():  # отменили нас самих
+                    raise
+                # отменили лидера — перестраиваем сами
+            future = cls._inflight.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(consume_result)
+        cls._inflight[key] = future
+        try:
+            result = await rebuild()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            cls._inflight.pop(key, None)
+
+
+    @classmethod
+    @contextmanager
+    def claim(cls, keys: list[str]):
+        '''Ключи, которые перестраивает rebuild_many: другие запросы воркера ждут их здесь, а не опрашивают Redis.
+        Вызывать без await между проверкой _inflight и claim; результаты проставляет вызывающий'''
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for key in keys:
+            future = loop.create_future()
+            future.add_done_callback(consume_result)
+            cls._inflight[key] = futures[key] = future
+        try:
+            yield futures
+        except asyncio.CancelledError:
+            for future in futures.values():
+                future.cancel()
+            raise
+        except Exception as error:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(error)
+            raise
+        finally:
+            for key, future in futures.items():
+                future.cancel()  # не дошли до перестройки — ждущие перестроят сами
+                if cls._inflight.get(key) is future:
+                    del cls._inflight[key]
+
+
+def cache_ttl() -> float:
+    '''TTL с джиттером: ключи, записанные одновременно, истекают вразнобой'''
+    return settings.CACHE_TTL * (1 + random.uniform(0, settings.CACHE_TTL_JITTER))
+
+
+def should_refresh(entry: dict) -> bool:
+    '''Вероятностный ранний пересчет (XFetch): чем ближе истечение и дороже пересчет, тем вероятнее.
+    Один запрос перестраивает значение заранее, остальные продолжают читать старое'''
+    jump = -entry['delta'] * settings.CACHE_EARLY_REFRESH_BETA * math.log(1 - random.random())
+    return time.time() + jump >= entry['expiry']
+
+
+async def timed_load(load) -> tuple:
+    start = time.monotonic()
+    value = await load()
+    return value, time.monotonic() - start
+
+
+def make_entry(value, delta: float) -> tuple[bytes, float]:
+    ttl = cache_ttl()
+    return encode({'value': value, 'delta': delta, 'expiry': time.time() + ttl}), ttl
+
+
+async def store(key: str, load):
+    value, delta = await timed_load(load)
+    data, ttl = make_entry(value, delta)
+    binary_redis = await Redis.get_binary_redis()
+    await binary_redis.set(key, data, px=int(ttl * 1000))
+    return value
+
+
+async def read_entry(key: str) -> dict | None:
+    binary_redis = await Redis.get_binary_redis()
+    return decode(await binary_redis.get(key))
+
+
+async def read_entries(keys: list[str]) -> list[dict | None]:
+    binary_redis = await Redis.get_binary_redis()
+    return [decode(data) for data in await binary_redis.mget(keys)]
+
+
+async def wait_for_value(key: str):
+    deadline = time.monotonic() + settings.CACHE_LOCK_TTL
+    while time.monotonic() < deadline:
+        await asyncio.sleep(LOCK_POLL)
+        entry = await read_entry(key)
+        if entry is not None:
+            return entry['value']
+    return None
+
+
+async def rebuild(redis, key: str, load, stale=None):
+    '''Между воркерами перестройку координирует короткий lock в Redis'''
+    lock_key = f'{key}: lock'
+    token = uuid.uuid4().hex
+    if not await redis.set(lock_key, token, nx=True, px=int(settings.CACHE_LOCK_TTL * 1000)):
+        if stale is not None:  # ранний пересчет уже делает другой воркер, старое значение еще живо
+            return stale
+        value = await wait_for_value(key)
+        if value is not None:
+            return value
+        return await store(key, load)  # держатель lock не успел — не ждем дольше его TTL
+    try:
+        return await store(key, load)
+    finally:
+        # get + delete не атомарны: в худшем случае снимем чужой lock и будет одна лишняя перестройка
+        if await redis.get(lock_key) == token:
+            await redis.delete(lock_key)
+
+
+async def resolve(redis, key: str, entry: dict | None, load, future: asyncio.Future | None = None):
+    if entry is not None:
+        if not should_refresh(entry):
+            return entry['value']
+        return await SingleFlight.run(key, lambda: rebuild(redis, key, load, entry['value']), future)
+    return await SingleFlight.run(key, lambda: rebuild(redis, key, load), future)
+
+
+async def cached(owner_id, entity: str, suffix: str, load):
+    '''Значение из кеша или от load(): промах на популярном ключе перестраивается одним запросом'''
+    redis = await Redis.get_redis()
+    key = await versioned_key(redis, owner_id, entity, suffix)
+    entry = await read_entry(key)  # записи старого формата decode считает промахом
+    return await resolve(redis, key, entry, load)
+
+
+async def run_all(calls, concurrent: bool) -> list:
+    '''Вызовы параллельно, если у каждого своя сессия БД, иначе по очереди — сессия одна на всех'''
+    if concurrent:
+        return list(await asyncio.gather(*(call() for call in calls)))
+    return [await call() for call in calls]
+
+
+async def rebuild_many(redis, items: list[tuple[str, object]], concurrent: bool = False) -> list:
+    '''Промахи одного юзера пачкой: lock, запись значений и снятие lock — по pipeline на все ключи'''
+    token = uuid.uuid4().hex
+    lock_keys = [f'{key}: lock' for key, _ in items]
+    px = int(settings.CACHE_LOCK_TTL * 1000)
+    async with redis.pipeline(transaction=False) as pipe:
+        for lock_key in lock_keys:
+            pipe.set(lock_key, token, nx=True, px=px)
+        locked = await pipe.execute()
+    writes = []
+
+    async def fetch(key, load, is_ours):
+        value = None if is_ours else await wait_for_value(key)  # lock у другого воркера — ждем его
+        if value is None:
+            value, delta = await timed_load(load)
+            writes.append((key, *make_entry(value, delta)))
+        return value
+
+    try:
+        values = await run_all([lambda key=key, load=load, is_ours=is_ours: fetch(key, load, is_ours)
+                                for (key, load), is_ours in zip(items, locked)], concurrent)
+        if writes:
+            binary_redis = await Redis.get_binary_redis()
+            async with binary_redis.pipeline(transaction=False) as pipe:
+                for key, data, ttl in writes:
+                    pipe.set(key, data, px=int(ttl * 1000))
+                await pipe.execute()
+    finally:
+        ours = [lock_key for lock_key, is_ours in zip(lock_keys, locked) if is_ours]
+        if ours:
+            # как и в rebuild: между GET и DEL lock может смениться — худший случай, лишняя перестройка
+            holders = await redis.mget(ours)
+            released = [lock_key for lock_key, holder in zip(ours, holders) if holder == token]
+            if released:
+                await redis.delete(*released)
+    return values
+
+
+async def cached_many(owner_id, items: list[tuple[str, str, object]], concurrent: bool = False) -> list:
+    '''Несколько значений юзера, (entity, suffix, load) на каждое: при попадании — два round trip
+    (MGET поколений и MGET значений) вместо двух на каждое значение.
+    concurrent=True — load() не делят сессию БД и промахи грузятся параллельно'''
+    redis = await Redis.get_redis()
+    keys = await versioned_keys(redis, owner_id, [(entity, suffix) for entity, suffix, _ in items])
+    entries = await read_entries(keys)
+    values = [None] * len(items)
+    misses, others = [], []
+    inflight = {}  # перестройки, замеченные сейчас: при последовательном ожидании они могут успеть закончиться
+    for index, (key, entry) in enumerate(zip(keys, entries)):
+        if entry is not None and not should_refresh(entry):
+            values[index] = entry['value']
+        elif entry is None and key not in SingleFlight._inflight:
+            misses.append(index)
+        else:  # ранний пересчет или ключ уже перестраивается в этом воркере — как в cached
+            others.append(index)
+            inflight[index] = SingleFlight._inflight.get(key)
+
+    with SingleFlight.claim([keys[index] for index in misses]) as batch:
+        async def rebuild_misses():
+            rebuilt = await rebuild_many(redis, [(keys[index], items[index][2]) for index in misses], concurrent)
+            for index, value in zip(misses, rebuilt):
+                batch[keys[index]].set_result(value)
+            return rebuilt
+
+        calls = [lambda index=index: resolve(redis, keys[index], entries[index], items[index][2], inflight[index])
+                 for index in others]
+        if misses:
+            calls.append(rebuild_misses)
+        results = await run_all(calls, concurrent)
+    for index, value in zip(others, results):
+        values[index] = value
+    if misses:
+        for index, value in zip(misses, results[-1]):
+            values[index] = value
+    return values
+
+
+async def load_rows(db, query, model) -> dict[str, list]:
+    '''Выборка в колоночном виде — так она и лежит в кеше'''
+    answer = await db.execute(query)
+    return to_columns([item.to_dict() for item in answer.scalars().all()], model)
@@ -0,0 +1,27 @@
+import zlib
+import orjson
+from app.config import settings
+
+
+PLAIN = b'J'  # orjson как есть
+COMPRESSED = b'Z'  # orjson + zlib
+
+
+def encode(entry) -> bytes:
+    '''Значение кеша -> байты для Redis; большие значения сжимаются'''
+    raw = orjson.dumps(entry)
+    if len(raw) >= settings.CACHE_COMPRESS_MIN_BYTES:
+        return COMPRESSED + zlib.compress(raw, settings.CACHE_COMPRESS_LEVEL)
+    return PLAIN + raw
+
+
+def decode(data: bytes | None):
+    '''None — промах: ключа нет или он записан старым форматом'''
+    if not data:
+        return None
+    kind, body = data[:1], data[1:]
+    if kind == PLAIN:
+        return orjson.loads(body)
+    if kind == COMPRESSED:
+        return orjson.loads(zlib.decompress(body))
+    return None
@@ -1,102 +1,103 @@
-from sqlalchemy import insert, select, func, extract, delete
-from app.database.models import User, Purchase, Income, Category
-from app.redis import Redis
-import json
+from sqlalchemy import insert, select, delete, tuple_
+from app.database.models import User, Purchase, Income, Category, MonthlyIncomeTotal
+from app.database.engine import session_factory
+from app.database.read_models import IncomeRead, from_columns
+from .db_cache import cached, load_rows, bump_generation
+from app.config import settings
+from app.functions.periods import Period, resolve_period, period_key
+from .db_totals import get_currency_totals, totals_query
+from .db_rollups import (INCOME_KEYS, INCOME_RETURNING, apply_rollup, income_delta,
+                         rollup_totals_query, period_totals_query)
+
+
+def incomes_conditions(user_id, period: Period | None = None) -> tuple:
+    '''Фильтры выборки доходов, общие для строк и для сумм по валютам'''
+    conditions = (Income.owner_id == user_id,)
+    return conditions if period is None else conditions + period.conditions(Income.created_at)
 
 
 async def create_income_in_db(db, owner, discription, quantity, currency) -> None:
     '''Добавление доходов сносит весь кеш доходв юзера'''
-    redis = await Redis.get_redis()
-    pattern = f'{owner}: incomes:*'
-    async for key in redis.scan_iter(pattern):
-        await redis.unlink(key)
     data = insert(Income).values(
         owner_id=int(owner),
         description=discription,
         quantity=quantity,
-        currency=currency)
-    await db.execute(data)
+        currency=currency).returning(*INCOME_RETURNING)
+    answer = await db.execute(data)
+    await apply_rollup(db, MonthlyIncomeTotal, INCOME_KEYS, income_delta(answer.all()))
     await db.commit()
+    await bump_generation(owner, 'incomes')
 
 
-async def get_all_incomes_from_db(db, user_id) -> list[Income]:
-    redis = await Redis.get_redis()
-    cache_key = f'{user_id}: incomes: all'
-    cache = await redis.get(cache_key)
-    if cache:
-        data = json.loads(cache)
-        return [Income.from_json(item) for item in data]
-    query = select(Income).where(Income.owner_id==user_id)
-    answer = await db.execute(query)
-    data = answer.scalars().all()
-    await redis.set(cache_key, json.dumps([item.to_dict() for item in data]), ex=180)
-    return data
-
-
-async def get_incomes_current_from_db(db, user_id) -> list[Income]:
-    redis = await Redis.get_redis()
-    cache_key = f'{user_id}: incomes: current'
-    cache = await redis.get(cache_key)
-    if cache:
-        data = json.loads(cache)
-        return [Income.from_json(item) for item in data]
-    query = (
-        select(Income)
-        .where(
-            Income.owner_id == user_id,
-            extract("month", Income.created_at) == extract("month", func.current_date())
-        )
-    )
-    answer = await db.execute(query)
-    data = answer.scalars().all()
-    await redis.set(cache_key, json.dumps([item.to_dict() for item in data]), ex=180)
-    return data
-
-
-async def get_incomes_last_month_from_db(db, user_id) -> list[Income]:
-    redis = await Redis.get_redis()
-    cache_key = f'{user_id}: incomes: last month'
-    cache = await redis.get(cache_key)
-    if cache:
-        data = json.loads(cache)
-        return [Income.from_json(item) for item in data]
-    query = (
-        select(Income)
-        .where(
-            Income.owner_id == user_id,
-            extract("month", Income.created_at) == extract("month", func.current_date()) - 1
-        )
-    )
-    answer = await db.execute(query)
-    data = answer.scalars().all()
-    await redis.set(cache_key, json.dumps([item.to_dict() for item in data]), ex=180)
-    return data
-
-
-async def get_incomes_in_time_limits_from_db(db, user_id, start_date, end_date) -> list[Income]:
-    redis = await Redis.get_redis()
-    cache_key = f'{user_id}: incomes: {start_date}-{end_date}'
-    cache = await redis.get(cache_key)
-    if cache:
-        data = json.loads(cache)
-        return [Income.from_json(item) for item in data]
-    query = (select(Income).where(Income.owner_id == user_id,
-                                  Income.created_at >= start_date,
-                                  Income.created_at <= end_date))
+def incomes_cache_item(db, user_id, period: Period | None) -> tuple:
+    '''(entity, suffix, load) выборки доходов — для cached и cached_many'''
+    query = select(Income).where(*incomes_conditions(user_id, period))
+    return 'incomes', period_key(period), lambda: load_rows(db, query, IncomeRead)
+
+
+async def get_incomes_in_period_from_db(db, user_id, period: Period | None) -> list[IncomeRead]:
+    data = await cached(user_id, *incomes_cache_item(db, user_id, period))
+    return from_columns(data, IncomeRead)
+
+
+async def get_all_incomes_from_db(db, user_id) -> list[IncomeRead]:
+    return await get_incomes_in_period_from_db(db, user_id, None)
+
+
+async def get_incomes_current_from_db(db, user_id) -> list[IncomeRead]:
+    return await get_incomes_in_period_from_db(db, user_id, resolve_period('current'))
+
+
+async def get_incomes_last_month_from_db(db, user_id) -> list[IncomeRead]:
+    return await get_incomes_in_period_from_db(db, user_id, resolve_period('last month'))
+
+
+async def get_incomes_in_time_limits_from_db(db, user_id, start_date, end_date) -> list[IncomeRead]:
+    return await get_incomes_in_period_from_db(db, user_id, resolve_period('limits', start_date=start_date,
+                                                                           end_date=end_date))
+
+
+async def get_incomes_page_from_db(db, user_id, after_date=None, after_id=None, limit=100) -> list[Income]:
+    '''Keyset-пагинация по (created_at, id): без OFFSET, идет по индексу (owner_id, created_at)'''
+    query = select(Income).where(*incomes_conditions(user_id))
+    if after_date is not None:
+        query = query.where(tuple_(Income.created_at, Income.id) > tuple_(after_date, after_id))
+    query = query.order_by(Income.created_at, Income.id).limit(limit)
     answer = await db.execute(query)
-    data = answer.scalars().all()
-    await redis.set(cache_key, json.dumps([item.to_dict() for item in data]), ex=180)
-    return data
+    return answer.scalars().all()
+
+
+async def stream_incomes_from_db(user_id):
+    '''Построчное чтение через серверный курсор: память не зависит от длины истории.
+    Сессия своя — сессия из Depends закрывается раньше, чем отдается StreamingResponse'''
+    query = (select(Income).where(*incomes_conditions(user_id))
+             .order_by(Income.created_at, Income.id)
+             .execution_options(yield_per=500))
+    async with session_factory() as session:
+        result = await session.stream_scalars(query)
+        async for income in result:
+            yield income
+
+
+async def get_incomes_totals_from_db(db, user_id, period='all', start_date=None, end_date=None) -> dict[str, float]:
+    '''Суммы доходов по валютам за тот же период, что и у списка'''
+    window = resolve_period(period, start_date=start_date, end_date=end_date)
+    if not settings.USE_MONTHLY_ROLLUPS:
+        query = totals_query(Income.quantity, Income.currency, *incomes_conditions(user_id, window))
+    elif window is None:
+        query = rollup_totals_query(MonthlyIncomeTotal, user_id)
+    else:
+        query = period_totals_query(MonthlyIncomeTotal, user_id, Income.quantity, Income.currency,
+                                    Income.created_at, incomes_conditions(user_id), window)
+    return await get_currency_totals(db, user_id, 'incomes', f'{period_key(window)}: totals', query)
 
 
 async def delete_incomes_form_db(db, owner_id, incomes_id) -> None:
     '''Удаление сносит весь кеш доходов юзера'''
-    redis = await Redis.get_redis()
-    pattern = f'{owner_id}: incomes:*'
-    async for key in redis.scan_iter(pattern):
-        await redis.unlink(key)
     query = delete(Income).where(Income.owner_id==owner_id,
-                                   Income.id.in_(incomes_id))
-    await db.execute(query)
+                                   Income.id.in_(incomes_id)).returning(*INCOME_RETURNING)
+    answer = await db.execute(query)
+    await apply_rollup(db, MonthlyIncomeTotal, INCOME_KEYS, income_delta(answer.all(), sign=-1))
     await db.commit()
+    await bump_generation(owner_id, 'incomes')
 
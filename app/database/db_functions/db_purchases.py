@@ -1,74 +1,118 @@
-from app.database.models import User, Purchase, Income, Category
-from sqlalchemy import insert, select, func, delete
-from datetime import timedelta
-from app.redis import Redis
-import json
+from app.database.models import User, Purchase, Income, Category, MonthlyPurchaseTotal
+from sqlalchemy import insert, select, delete, tuple_
+from app.database.engine import session_factory
+from app.database.read_models import PurchaseRead, from_columns
+from .db_cache import cached, load_rows, bump_generation
+from app.config import settings
+from app.functions.periods import Period, resolve_period, period_key
+from .db_totals import get_currency_totals, totals_query
+from .db_rollups import (RollupDelta, PURCHASE_KEYS, PURCHASE_RETURNING, apply_rollup, purchase_delta,
+                         month_of, rollup_totals_query, period_totals_query)
+
+
+PURCHASE_COPY_COLUMNS = ('name', 'description', 'price', 'currency', 'owner_id', 'category_id', 'created_at')
+
+
+def purchases_conditions(owner_id, period: Period | None = None) -> tuple:
+    '''Фильтры выборки покупок, общие для строк и для сумм по валютам'''
+    conditions = (Purchase.owner_id == owner_id,)
+    return conditions if period is None else conditions + period.conditions(Purchase.created_at)
 
 
 async def create_purchases_list_in_db(db, purchases, owner_id) -> None:
     '''Созданеие новых доходов сносит весь кеш доходов'''
-    redis = await Redis.get_redis()
-    pattern = f'{owner_id}: purchases:*'
-    async for key in redis.scan_iter(pattern):
-        await redis.unlink(key)
     data = [{**dict(item), 'owner_id': owner_id} for item in purchases.purchases]
-    query = insert(Purchase).values(data)
-    await db.execute(query)
+    query = insert(Purchase).values(data).returning(*PURCHASE_RETURNING)
+    answer = await db.execute(query)
+    await apply_rollup(db, MonthlyPurchaseTotal, PURCHASE_KEYS, purchase_delta(answer.all()))
     await db.commit()
+    await bump_generation(owner_id, 'purchases')
+
+
+async def copy_purchases_to_db(db, owner_id, records) -> None:
+    '''Массовая загрузка через COPY: records — асинхронный итератор кортежей в порядке PURCHASE_COPY_COLUMNS.
+    Весь файл — одна транзакция вместе с rollup, кеш покупок сносится один раз в конце'''
+    delta = RollupDelta()
+
+    async def tracked():
+        async for record in records:
+            name, description, price, currency, owner, category_id, created_at = record
+            delta.add((owner, month_of(created_at), category_id or 0, currency or 'EUR'), price)
+            yield record
+
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        Purchase.__tablename__, records=tracked(), columns=PURCHASE_COPY_COLUMNS)
+    await apply_rollup(db, MonthlyPurchaseTotal, PURCHASE_KEYS, delta)
+    await db.commit()
+    await bump_generation(owner_id, 'purchases')
+
+
+def purchases_cache_item(db, owner_id, period: Period | None) -> tuple:
+    '''(entity, suffix, load) выборки покупок — для cached и cached_many'''
+    query = select(Purchase).where(*purchases_conditions(owner_id, period))
+    return 'purchases', period_key(period), lambda: load_rows(db, query, PurchaseRead)
+
 
+async def get_purchases_in_period_from_db(db, owner_id, period: Period | None) -> list[PurchaseRead]:
+    data = await cached(owner_id, *purchases_cache_item(db, owner_id, period))
+    return from_columns(data, PurchaseRead)
 
-async def get_all_purchases_from_db(db, owner_id) -> list[Purchase]:
-    redis = await Redis.get_redis()
-    cache_key = f'{owner_id}: purchases: all'
-    cache = await redis.get(cache_key)
-    if cache:
-        data = json.loads(cache)
-        return [Purchase.from_json(item) for item in data]
-    querry = select(Purchase).where(Purchase.owner_id==owner_id)
-    answer = await db.execute(querry)
-    data = answer.scalars().all()
-    await redis.set(cache_key, json.dumps([item.to_dict() for item in data]), ex=180)
-    return data
-
-
-async def get_purchases_current_week_from_db(db, owner_id) -> list[Purchase]:
-    redis = await Redis.get_redis()
-    cache_key = f'{owner_id}: purchases: {timedelta(days=7)}-{func.current_date()}'
-    cache = await redis.get(cache_key)
-    if cache:
-        data = json.loads(cache)
-        return [Purchase.from_json(item) for item in data]
-    querry = select(Purchase).where(Purchase.owner_id==owner_id,
-                                    Purchase.created_at >= func.current_date() - timedelta(days=7))
-    answer = await db.execute(querry)
-    data = answer.scalars().all()
-    await redis.set(cache_key, json.dumps([item.to_dict() for item in data]), ex=180)
-    return data
-
-
-async def get_purchases_in_limits_from_db(db, owner_id, start_date, end_date) -> list[Purchase]:
-    redis = await Redis.get_redis()
-    cache_key = f'{owner_id}: purchases: {start_date}-{end_date}'
-    cache = await redis.get(cache_key)
-    if cache:
-        data = json.loads(cache)
-        return [Purchase.from_json(item) for item in data]
-    query = select(Purchase).where(Purchase.owner_id==owner_id,
-                                    Purchase.created_at >= start_date,
-                                    Purchase.created_at <= end_date)
+
+async def get_all_purchases_from_db(db, owner_id) -> list[PurchaseRead]:
+    return await get_purchases_in_period_from_db(db, owner_id, None)
+
+
+async def get_purchases_current_week_from_db(db, owner_id) -> list[PurchaseRead]:
+    return await get_purchases_in_period_from_db(db, owner_id, resolve_period('week'))
+
+
+async def get_purchases_in_limits_from_db(db, owner_id, start_date, end_date) -> list[PurchaseRead]:
+    return await get_purchases_in_period_from_db(db, owner_id, resolve_period('limits', start_date=start_date,
+                                                                              end_date=end_date))
+
+
+async def get_purchases_page_from_db(db, owner_id, after_date=None, after_id=None, limit=100) -> list[Purchase]:
+    '''Keyset-пагинация по (created_at, id): без OFFSET, идет по индексу (owner_id, created_at)'''
+    query = select(Purchase).where(*purchases_conditions(owner_id))
+    if after_date is not None:
+        query = query.where(tuple_(Purchase.created_at, Purchase.id) > tuple_(after_date, after_id))
+    query = query.order_by(Purchase.created_at, Purchase.id).limit(limit)
     answer = await db.execute(query)
-    data = answer.scalars().all()
-    await redis.set(cache_key, json.dumps([item.to_dict() for item in data]), ex=180)
-    return data
+    return answer.scalars().all()
+
+
+async def stream_purchases_from_db(owner_id):
+    '''Построчное чтение через серверный курсор: память не зависит от длины истории.
+    Сессия своя — сессия из Depends закрывается раньше, чем отдается StreamingResponse'''
+    query = (select(Purchase).where(*purchases_conditions(owner_id))
+             .order_by(Purchase.created_at, Purchase.id)
+             .execution_options(yield_per=500))
+    async with session_factory() as session:
+        result = await session.stream_scalars(query)
+        async for purchase in result:
+            yield purchase
+
+
+async def get_purchases_totals_from_db(db, owner_id, period='all', start_date=None, end_date=None) -> dict[str, float]:
+    '''Суммы покупок по валютам за тот же период, что и у списка'''
+    window = resolve_period(period, start_date=start_date, end_date=end_date)
+    if not settings.USE_MONTHLY_ROLLUPS:
+        query = totals_query(Purchase.price, Purchase.currency, *purchases_conditions(owner_id, window))
+    elif window is None:
+        query = rollup_totals_query(MonthlyPurchaseTotal, owner_id)
+    else:
+        query = period_totals_query(MonthlyPurchaseTotal, owner_id, Purchase.price, Purchase.currency,
+                                    Purchase.created_at, purchases_conditions(owner_id), window)
+    return await get_currency_totals(db, owner_id, 'purchases', f'{period_key(window)}: totals', query)
 
 
 async def delete_purchases_from_db(db, owner_id, purchases_id) -> None:
     '''Удаление сносит весь кеш покупок юзера'''
-    redis = await Redis.get_redis()
-    pattern = f'{owner_id}: purchases:*'
-    async for key in redis.scan_iter(pattern):
-        await redis.unlink(key)
     query = delete(Purchase).where(Purchase.owner_id==owner_id,
-                                   Purchase.id.in_(purchases_id))
-    await db.execute(query)
+                                   Purchase.id.in_(purchases_id)).returning(*PURCHASE_RETURNING)
+    answer = await db.execute(query)
+    await apply_rollup(db, MonthlyPurchaseTotal, PURCHASE_KEYS, purchase_delta(answer.all(), sign=-1))
     await db.commit()
+    await bump_generation(owner_id, 'purchases')
@@ -0,0 +1,148 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from sqlalchemy import select, func, delete, and_, or_, Date, cast
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.database.models import Purchase, Income, MonthlyPurchaseTotal, MonthlyIncomeTotal
+from .db_totals import currency_or_euro
+
+
+PURCHASE_KEYS = ('owner_id', 'month', 'category_id', 'currency')
+INCOME_KEYS = ('owner_id', 'month', 'currency')
+UPSERT_CHUNK = 1000  # групп за один INSERT: 6 параметров на группу, лимит Postgres — 32767
+
+
+def month_of(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(month: date) -> date:
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+class RollupDelta:
+    '''Изменения месячных сумм, накопленные по вставленным или удаленным строкам'''
+    def __init__(self):
+        self.groups = defaultdict(lambda: [0.0, 0])
+
+    def add(self, key: tuple, amount: float, sign: int = 1) -> None:
+        group = self.groups[key]
+        group[0] += sign * (amount or 0)
+        group[1] += sign
+
+
+def purchase_delta(rows, sign: int = 1) -> RollupDelta:
+    '''rows — (owner_id, created_at, category_id, currency, price), например из RETURNING'''
+    delta = RollupDelta()
+    for owner_id, created_at, category_id, currency, price in rows:
+        delta.add((owner_id, month_of(created_at), category_id or 0, currency or 'EUR'), price, sign)
+    return delta
+
+
+def income_delta(rows, sign: int = 1) -> RollupDelta:
+    '''rows — (owner_id, created_at, currency, quantity)'''
+    delta = RollupDelta()
+    for owner_id, created_at, currency, quantity in rows:
+        delta.add((owner_id, month_of(created_at), currency or 'EUR'), quantity, sign)
+    return delta
+
+
+PURCHASE_RETURNING = (Purchase.owner_id, Purchase.created_at, Purchase.category_id,
+                      Purchase.currency, Purchase.price)
+INCOME_RETURNING = (Income.owner_id, Income.created_at, Income.currency, Income.quantity)
+
+
+async def apply_rollup(db, model, keys: tuple[str, ...], delta: RollupDelta) -> None:
+    '''Upsert изменений в rollup в текущей транзакции; группы, где не осталось строк, удаляются.
+    Строки идут в порядке ключа: две транзакции с общими группами блокируют их в одном порядке, без deadlock'''
+    rows = [dict(zip(keys, key)) | {'sum': total, 'count': count}
+            for key, (total, count) in sorted(delta.groups.items()) if count]
+    for start in range(0, len(rows), UPSERT_CHUNK):
+        query = pg_insert(model).values(rows[start:start + UPSERT_CHUNK])
+        query = query.on_conflict_do_update(index_elements=keys,
+                                            set_={'sum': model.sum + query.excluded.sum,
+                                                  'count': model.count + query.excluded.count})
+        await db.execute(query)
+    emptied = {row['owner_id'] for row in rows if row['count'] < 0}
+    if emptied:
+        await db.execute(delete(model).where(model.owner_id.in_(emptied), model.count <= 0))
+
+
+def rollup_totals_query(model, owner_id):
+    '''Суммы по валютам за всю историю из rollup: не больше 12 строк на год истории юзера'''
+    return (select(model.currency, func.sum(model.sum))
+            .where(model.owner_id == owner_id)
+            .group_by(model.currency))
+
+
+def period_totals_query(model, owner_id, amount_column, currency_column, date_column,
+                        conditions, period):
+    '''Период [start, end): целые месяцы из rollup, неполные края — из сырых строк'''
+    full_from = period.start if period.start.day == 1 else next_month(period.start)
+    full_to = month_of(period.end)
+    currency = currency_or_euro(currency_column)  # как в *_rollup_source: NULL в краях и в месяцах — один EUR
+    raw = select(currency.label('currency'), func.sum(amount_column).label('total'))
+    if full_from >= full_to:  # нет ни одного целого месяца
+        return raw.where(*conditions, *period.conditions(date_column)).group_by(currency)
+    edges = (raw.where(*conditions, or_(and_(date_column >= period.start, date_column < full_from),
+                                        and_(date_column >= full_to, date_column < period.end)))
+             .group_by(currency))
+    months = (select(model.currency.label('currency'), func.sum(model.sum).label('total'))
+              .where(model.owner_id == owner_id, model.month >= full_from, model.month < full_to)
+              .group_by(model.currency))
+    parts = edges.union_all(months).subquery()
+    return select(parts.c.currency, func.sum(parts.c.total)).group_by(parts.c.currency)
+
+
+def purchase_rollup_source(owner_id=None):
+    '''Rollup покупок, посчитанный заново по сырой таблице'''
+    month = cast(func.date_trunc('month', Purchase.created_at), Date)
+    category = func.coalesce(Purchase.category_id, 0)
+    currency = currency_or_euro(Purchase.currency)
+    query = (select(Purchase.owner_id.label('owner_id'), month.label('month'),
+                    category.label('category_id'), currency.label('currency'),
+                    func.sum(Purchase.price).label('sum'), func.count().label('count'))
+             .where(Purchase.owner_id.is_not(None), Purchase.created_at.is_not(None))
+             .group_by(Purchase.owner_id, month, category, currency))
+    return query.where(Purchase.owner_id == owner_id) if owner_id is not None else query
+
+
+def income_rollup_source(owner_id=None):
+    month = cast(func.date_trunc('month', Income.created_at), Date)
+    currency = currency_or_euro(Income.currency)
+    query = (select(Income.owner_id.label('owner_id'), month.label('month'),
+                    currency.label('currency'),
+                    func.sum(Income.quantity).label('sum'), func.count().label('count'))
+             .where(Income.owner_id.is_not(None), Income.created_at.is_not(None))
+             .group_by(Income.owner_id, month, currency))
+    return query.where(Income.owner_id == owner_id) if owner_id is not None else query
+
+
+ROLLUPS = {'purchases': (MonthlyPurchaseTotal, PURCHASE_KEYS, purchase_rollup_source),
+           'incomes': (MonthlyIncomeTotal, INCOME_KEYS, income_rollup_source)}
+
+
+async def find_rollup_mismatches(db, entity: str, owner_id=None, tolerance: float = 0.01) -> list[dict]:
+    '''Сверка rollup с сырой таблицей: группы, где расходится количество строк или сумма'''
+    model, keys, source = ROLLUPS[entity]
+    raw = source(owner_id).subquery()
+    joined = raw.join(model.__table__, and_(*(raw.c[key] == model.__table__.c[key] for key in keys)),
+                      full=True)
+    query = (select(*(func.coalesce(raw.c[key], model.__table__.c[key]).label(key) for key in keys),
+                    raw.c['sum'].label('raw_sum'), raw.c['count'].label('raw_count'),
+                    model.__table__.c['sum'].label('rollup_sum'),
+                    model.__table__.c['count'].label('rollup_count'))
+             .select_from(joined)
+             .where(or_(func.coalesce(raw.c['count'], 0) != func.coalesce(model.__table__.c['count'], 0),
+                        func.abs(func.coalesce(raw.c['sum'], 0) - func.coalesce(model.__table__.c['sum'], 0))
+                        > tolerance)))
+    if owner_id is not None:
+        query = query.where(func.coalesce(raw.c['owner_id'], model.__table__.c['owner_id']) == owner_id)
+    answer = await db.execute(query)
+    return [dict(row._mapping) for row in answer]
+
+
+async def rebuild_rollup(db, entity: str, owner_id) -> None:
+    '''Пересчет rollup юзера с нуля по сырой таблице (в транзакции вызывающего)'''
+    model, keys, source = ROLLUPS[entity]
+    await db.execute(delete(model).where(model.owner_id == owner_id))
+    await db.execute(pg_insert(model).from_select([*keys, 'sum', 'count'], source(owner_id)))
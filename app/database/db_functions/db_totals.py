@@ -0,0 +1,28 @@
+from sqlalchemy import select, func
+from app.functions.currency import CURRENCY_FIELDS
+from .db_cache import cached
+
+
+def currency_or_euro(currency_column):
+    '''Валюта NULL считается EUR — как в rollup и как раньше в агрегаторе'''
+    return func.coalesce(currency_column, 'EUR')
+
+
+def totals_query(amount_column, currency_column, *conditions):
+    '''SUM(amount) GROUP BY currency прямо в Postgres — агрегатору уходят три числа вместо всех строк'''
+    currency = currency_or_euro(currency_column)
+    return (select(currency, func.sum(amount_column))
+            .where(*conditions)
+            .group_by(currency))
+
+
+async def get_currency_totals(db, owner_id, entity, suffix, query) -> dict[str, float]:
+    '''query отдает пары (валюта, сумма): по сырым строкам или по месячным rollup'''
+    async def load():
+        answer = await db.execute(query)
+        totals = dict.fromkeys(CURRENCY_FIELDS, 0.0)
+        for currency, total in answer.all():
+            if currency in totals:  # валюты вне EUR/RUB/RSD не конвертируются и в итоги не входят
+                totals[currency] += float(total or 0)
+        return totals
+    return await cached(owner_id, entity, suffix, load)
@@ -1,7 +1,9 @@
 import json
 
+from app.config import settings
 from app.database.models import User, Purchase, Income, Category
 from app.redis import Redis
+from .db_cache import user_key
 from app.schemas import CreateUser
 from sqlalchemy import insert, select
 
@@ -15,10 +17,49 @@ async def create_user_in_db(db, user_data: CreateUser, hashed_password: str) ->
         hashed_password=hashed_password)
     await db.execute(data)
     await db.commit()
+    await invalidate_user_claims(user_data.username)  # на случай claims, оставшихся от удаленного юзера
 
 
 async def get_user(db, username: str):
+    '''Логин: одно чтение по уникальному индексу ix_users_username'''
     query = select(User).where(User.username == username)
     result = await db.execute(query)
     user = result.scalars().first()
     return user
+
+
+def user_claims_key(username: str) -> str:
+    return user_key(username, 'user_claims')
+
+
+def user_claims(user) -> dict:
+    '''То, что идет в access token: ради этого /auth/refresh больше не ходит в Postgres'''
+    return {'user_id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'is_admin': user.is_admin}
+
+
+async def store_user_claims(claims: dict) -> None:
+    redis = await Redis.get_redis()
+    await redis.set(user_claims_key(claims['username']), json.dumps(claims), ex=settings.USER_CLAIMS_TTL)
+
+
+async def get_user_claims(db, username: str) -> dict | None:
+    '''Claims из Redis, при промахе — из Postgres с записью обратно в кеш'''
+    redis = await Redis.get_redis()
+    data = await redis.get(user_claims_key(username))
+    if data:
+        return json.loads(data)
+    user = await get_user(db, username)
+    if user is None:
+        return None
+    claims = user_claims(user)
+    await store_user_claims(claims)
+    return claims
+
+
+async def invalidate_user_claims(username: str) -> None:
+    '''Вызывать после любого изменения username, email или is_admin юзера'''
+    redis = await Redis.get_redis()
+    await redis.delete(user_claims_key(username))
@@ -1,10 +1,25 @@
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from app.config import settings
+from app.database.pool import InstrumentedPool, observe_pool
 
-engine = create_async_engine(settings.database_url)
+
+def make_engine(url: str = settings.database_url, **kwargs):
+    options = {'poolclass': InstrumentedPool,
+               'pool_size': settings.DB_POOL_SIZE,
+               'max_overflow': settings.DB_MAX_OVERFLOW,
+               'pool_timeout': settings.DB_POOL_TIMEOUT,
+               'pool_recycle': settings.DB_POOL_RECYCLE,
+               'pool_pre_ping': settings.DB_POOL_PRE_PING,
+               'connect_args': {'prepared_statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE}}
+    engine = create_async_engine(url, **(options | kwargs))
+    observe_pool(engine.sync_engine.pool)
+    return engine
+
+
+engine = make_engine()
 
 session_factory = async_sessionmaker(engine)
 
 class Base(DeclarativeBase):
-    pass
\ No newline at end of file
+    pass
@@ -2,3 +2,4 @@ from .user import User
 from .purchase import Purchase
 from .income import Income
 from .category import Category
+from .rollup import MonthlyPurchaseTotal, MonthlyIncomeTotal
@@ -1,11 +1,13 @@
 from app.database.engine import Base
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Index, text
 from sqlalchemy.orm import relationship
 
 
 class Category(Base):
     __tablename__ = 'categories'
-    __table_args__ = {'extend_existing': True} #если таблица уже объявленна в метаданных, мы используем ее
+    __table_args__ = (Index('ix_categories_owner_id', 'owner_id'),
+                      Index('ix_categories_is_root', 'is_root', postgresql_where=text('is_root IS true')),
+                      {'extend_existing': True}) #если таблица уже объявленна в метаданных, мы используем ее
 
     id = Column(Integer, primary_key=True, index=True)
     owner_id = Column(Integer, ForeignKey('users.id'), nullable=True)
@@ -1,11 +1,13 @@
 from app.database.engine import Base
-from sqlalchemy import ForeignKey, Column, Integer, String, Boolean, Float, Date, func
+from sqlalchemy import ForeignKey, Column, Integer, String, Boolean, Float, Date, Index, func
 from sqlalchemy.orm import relationship
 from datetime import date
 
 
 class Income(Base):
     __tablename__ = 'incomes'
+    __table_args__ = (Index('ix_incomes_owner_id_created_at', 'owner_id', 'created_at',
+                            postgresql_include=['quantity', 'currency']),)
 
     id = Column(Integer, primary_key=True, index=True)
     owner_id = Column(Integer, ForeignKey('users.id'))
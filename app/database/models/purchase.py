@@ -1,11 +1,13 @@
 from app.database.engine import Base
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, Date, func
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, Date, Index, func
 from sqlalchemy.orm import relationship
 from datetime import date
 
 
 class Purchase(Base):
     __tablename__ = 'purchases'
+    __table_args__ = (Index('ix_purchases_owner_id_created_at', 'owner_id', 'created_at',
+                            postgresql_include=['price', 'currency']),)
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
@@ -0,0 +1,25 @@
+from app.database.engine import Base
+from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey
+
+
+class MonthlyPurchaseTotal(Base):
+    '''Суммы покупок юзера за месяц по категории и валюте, обновляются в одной транзакции с покупками'''
+    __tablename__ = 'monthly_purchase_totals'
+
+    owner_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    month = Column(Date, primary_key=True)  # первое число месяца
+    category_id = Column(Integer, primary_key=True)  # 0 — покупки без категории
+    currency = Column(String, primary_key=True)
+    sum = Column(Float, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class MonthlyIncomeTotal(Base):
+    '''Суммы доходов юзера за месяц по валюте'''
+    __tablename__ = 'monthly_income_totals'
+
+    owner_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    month = Column(Date, primary_key=True)
+    currency = Column(String, primary_key=True)
+    sum = Column(Float, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
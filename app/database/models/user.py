@@ -9,7 +9,7 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     firstname = Column(String, nullable=False)
     lastname = Column(String, nullable=False)
-    username = Column(String, nullable=False)
+    username = Column(String, nullable=False, unique=True, index=True)
     email = Column(String, unique=True)
     hashed_password = Column(String, nullable=False)
     is_activate = Column(Boolean, default=True)
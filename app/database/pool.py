@@ -0,0 +1,63 @@
+import time
+from prometheus_client import Gauge, Histogram
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out",
+    "Connections currently checked out of the SQLAlchemy pool"
+)
+
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow",
+    "Connections open above pool_size (negative while the pool is not full yet)"
+)
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time a request waits for a connection from the pool",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+DB_POOL_CONNECTION_LIFETIME = Histogram(
+    "db_pool_connection_lifetime_seconds",
+    "Lifetime of a database connection from connect to close",
+    buckets=(1, 10, 60, 300, 900, 1800, 3600, 7200, 21600)
+)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    '''QueuePool, который меряет ожидание соединения: у пула нет события "до checkout"'''
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+def observe_pool(pool) -> None:
+    '''Остальная телеметрия пула — через события SQLAlchemy. Overflow читается при сборе метрик:
+    события checkin/close приходят раньше, чем пул обновит свои счетчики'''
+    DB_POOL_OVERFLOW.set_function(pool.overflow)
+
+    def on_checkout(dbapi_connection, record, proxy):
+        DB_POOL_CHECKED_OUT.inc()
+
+    def on_checkin(dbapi_connection, record):
+        DB_POOL_CHECKED_OUT.dec()
+
+    def on_connect(dbapi_connection, record):
+        record.info['connected_at'] = time.monotonic()
+
+    def on_close(dbapi_connection, record):
+        connected_at = record.info.pop('connected_at', None)
+        if connected_at is not None:
+            DB_POOL_CONNECTION_LIFETIME.observe(time.monotonic() - connected_at)
+
+    event.listen(pool, 'checkout', on_checkout)
+    event.listen(pool, 'checkin', on_checkin)
+    event.listen(pool, 'connect', on_connect)
+    event.listen(pool, 'close', on_close)
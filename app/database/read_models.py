@@ -0,0 +1,52 @@
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class ReadModel:
+    '''Строка выборки из кеша: обычный объект вместо ORM-сущности, даты остаются ISO-строками'''
+
+    @classmethod
+    def field_names(cls) -> tuple[str, ...]:
+        return cls.__match_args__  # dataclass кладет сюда имена полей по порядку
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.field_names()}
+
+
+@dataclass(slots=True)
+class IncomeRead(ReadModel):
+    id: int
+    owner_id: int
+    description: str
+    quantity: float
+    currency: str
+    created_at: str
+
+
+@dataclass(slots=True)
+class PurchaseRead(ReadModel):
+    id: int
+    name: str
+    description: str
+    price: float
+    currency: str
+    owner_id: int
+    category_id: int
+    created_at: str
+
+
+@dataclass(slots=True)
+class CategoryRead(ReadModel):
+    id: int
+    owner_id: int | None
+    category_name: str
+    is_root: bool
+
+
+def to_columns(rows: list[dict], model: type[ReadModel]) -> dict[str, list]:
+    '''Колоночная раскладка: имена полей один раз на весь список, а не в каждой строке'''
+    return {name: [row[name] for row in rows] for name in model.field_names()}
+
+
+def from_columns(columns: dict[str, list], model: type[ReadModel]) -> list[ReadModel]:
+    return list(map(model, *(columns[name] for name in model.field_names())))
@@ -1,15 +1,63 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
+import hashlib
+import json
 import jwt
 from app.config import settings
-from fastapi import Depends
+from fastapi import Depends, HTTPException, status
 from typing import Annotated
 from fastapi.security import OAuth2PasswordBearer
+from prometheus_client import Counter
 from app.redis import Redis
+from app.metrics import stage
+from app.database.db_functions.db_cache import user_key
+from app.database.db_functions.db_user import user_claims_key
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/auth/token')
 
 
+JWT_CLAIMS_CACHE = Counter(
+    "jwt_claims_cache_total",
+    "Lookups in the in-process cache of verified JWT claims",
+    ["result"]
+)
+
+
+class ClaimsCache:
+    '''LRU проверенных claims по sha256 токена: повторный запрос с тем же токеном не делает jwt.decode'''
+    _claims: OrderedDict[bytes, tuple[int, dict]] = OrderedDict()
+
+
+    @classmethod
+    def get(cls, digest: bytes, now: float) -> dict | None:
+        entry = cls._claims.get(digest)
+        if entry is None:
+            JWT_CLAIMS_CACHE.labels('miss').inc()
+            return None
+        expire, claims = entry
+        if expire <= now:  # токен протух — дальше решает jwt.decode
+            del cls._claims[digest]
+            JWT_CLAIMS_CACHE.labels('miss').inc()
+            return None
+        cls._claims.move_to_end(digest)
+        JWT_CLAIMS_CACHE.labels('hit').inc()
+        return claims
+
+
+    @classmethod
+    def put(cls, digest: bytes, expire: int, claims: dict) -> None:
+        cls._claims[digest] = (expire, claims)
+        cls._claims.move_to_end(digest)
+        if len(cls._claims) > settings.JWT_CLAIMS_CACHE_SIZE:
+            cls._claims.popitem(last=False)
+
+
+    @classmethod
+    def clear(cls) -> None:
+        cls._claims.clear()
+
+
 async def create_access_token(user_id: int, username: str, email: str, is_admin: bool, expires_delta: timedelta):
     payload = {'user_id': user_id,
                'username': username,
@@ -21,20 +69,32 @@ async def create_access_token(user_id: int, username: str, email: str, is_admin:
 
 
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
-    payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm]) #Декодирование токена
-    user_id: int | None = payload.get('user_id')
-    username: str | None = payload.get('username')
-    email: str | None = payload.get('email')
-    is_admin: bool | None = payload.get('is_admin')
-    expire: int | None = payload.get('exp')
+    with stage('auth'):
+        return decode_token(token)
+
 
+def decode_token(token: str) -> dict:
     current_time = datetime.now(timezone.utc).timestamp()
+    digest = hashlib.sha256(token.encode()).digest()
+    claims = ClaimsCache.get(digest, current_time)
+    if claims is None:
+        try:
+            payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm]) #Декодирование токена
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                detail='Token expired')
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                detail='Invalid token')
+        claims = {'user_id': payload.get('user_id'),
+                  'username': payload.get('username'),
+                  'email': payload.get('email'),
+                  'is_admin': payload.get('is_admin'),
+                  'expire': True}  # просроченный токен до сюда не доходит
+        if payload.get('exp') is not None:
+            ClaimsCache.put(digest, payload['exp'], claims)
 
-    return {'user_id': user_id,
-            'username': username,
-            'email': email,
-            'is_admin': is_admin,
-            'expire': expire > current_time}
+    return dict(claims)
 
 
 async def create_refresh_token(username: str) -> str:
@@ -42,15 +102,28 @@ async def create_refresh_token(username: str) -> str:
                'exp': datetime.now(timezone.utc) + timedelta(weeks=1)}
     token = jwt.encode(payload, settings.secret_key, algorithm=settings.algorithm)
     redis = await Redis.get_redis()
-    await redis.set(f'refresh_token: {token}', username, ex=60*60*24*7) # Это одна неделя
+    await redis.set(refresh_token_key(username, token), username, ex=60*60*24*7) # Это одна неделя
     return token
 
 
-async def verify_refresh_token(token: str) -> str | None:
-    redis = await Redis.get_redis()
-    username = await redis.get(f'refresh_token: {token}')
-    if username:
-        return username
-    else:
-        return None
+def refresh_token_key(username: str, token: str) -> str:
+    '''Hash tag {username}, как у user_claims_key: в Redis Cluster оба ключа в одном слоте и MGET по ним работает'''
+    return user_key(username, 'refresh_token', token)
+
 
+async def verify_refresh_token(token: str) -> tuple[str | None, dict | None]:
+    '''(username, claims или None при промахе кеша): username берем из подписи самого токена,
+    поэтому сам refresh token и claims юзера читаются одним MGET'''
+    try:
+        username = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm]).get('username')
+    except jwt.InvalidTokenError:
+        return None, None
+    if not username:
+        return None, None
+    redis = await Redis.get_redis()
+    stored, claims = await redis.mget([refresh_token_key(username, token), user_claims_key(username)])
+    if stored is None:  # токен выдан до hash tag в ключе; уйдет через неделю вместе с такими токенами
+        stored = await redis.get(f'refresh_token: {token}')
+    if stored != username:  # токен отозван или истек в Redis
+        return None, None
+    return username, json.loads(claims) if claims else None
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+import time
+import httpx
+from app.config import settings
+from app.redis import Redis
+from app.metrics import stage
+
+
+logger = logging.getLogger("NMNH")
+
+RATES_KEY = 'currency: rates'
+CURRENCY_FIELDS = {'EUR': 'euro', 'RUB': 'rub', 'RSD': 'rsd'}
+
+
+def parse_rates(data: dict) -> dict[str, float]:
+    '''Ответ URL_RATE_API -> сколько единиц валюты дают за 1 EUR.
+    Неполный ответ — ValueError: таблица в памяти и в Redis остается прежней'''
+    if not isinstance(data.get('rates'), dict):
+        raise ValueError('Rate API response has no rates')
+    rates = {currency: float(rate) for currency, rate in data['rates'].items()}
+    rates[data.get('base', 'EUR')] = 1.0
+    missing = [currency for currency in CURRENCY_FIELDS if rates.get(currency, 0) <= 0]
+    if missing:
+        raise ValueError(f'Rate API response has no rate for {", ".join(missing)}')
+    euro = rates['EUR']
+    return {currency: rates[currency] / euro for currency in CURRENCY_FIELDS}
+
+
+class CurrencyRates:
+    '''Таблица курсов в памяти воркера, общая копия в Redis, обновление фоновой задачей'''
+    _rates: dict[str, float] = {}
+    _loading: asyncio.Task | None = None
+    _refresher: asyncio.Task | None = None
+    _failures: int = 0
+    _retry_at: float = 0.0
+
+
+    @classmethod
+    async def fetch(cls) -> dict[str, float]:
+        async with httpx.AsyncClient(timeout=5) as client:
+            response = await client.get(settings.URL_RATE_API)
+            response.raise_for_status()
+        return parse_rates(response.json())
+
+
+    @classmethod
+    async def load(cls) -> None:
+        '''Берем курсы из Redis, а если их там нет — из внешнего API и кладем в Redis для остальных воркеров'''
+        redis = await Redis.get_redis()
+        cache = await redis.get(RATES_KEY)
+        if cache:
+            cls._rates = json.loads(cache)
+            return
+        rates = await cls.fetch()
+        await redis.set(RATES_KEY, json.dumps(rates), ex=settings.CURRENCY_RATES_REFRESH)
+        cls._rates = rates
+
+
+    @classmethod
+    async def try_load(cls) -> None:
+        '''После неудачи следующая попытка не раньше чем через растущую паузу'''
+        try:
+            await cls.load()
+        except Exception:
+            cls._failures += 1
+            backoff = settings.CURRENCY_RATES_RETRY * 2 ** (cls._failures - 1)
+            cls._retry_at = time.monotonic() + min(backoff, settings.CURRENCY_RATES_RETRY_MAX)
+            raise
+        cls._failures = 0
+        cls._retry_at = 0.0
+
+
+    @classmethod
+    async def get_rates(cls) -> dict[str, float]:
+        cls.start()
+        if not cls._rates:
+            # холодный старт: все запросы ждут одну загрузку, а не идут в API каждый
+            if cls._loading is None or cls._loading.done():
+                if time.monotonic() < cls._retry_at:  # API недавно упал — не дергаем его каждым запросом
+                    raise RuntimeError('Currency rates are unavailable, next attempt is backed off')
+                cls._loading = asyncio.create_task(cls.try_load())
+            await asyncio.shield(cls._loading)
+        return cls._rates
+
+
+    @classmethod
+    async def run_refresher(cls) -> None:
+        while True:
+            await asyncio.sleep(settings.CURRENCY_RATES_REFRESH)
+            try:
+                await cls.load()
+            except Exception:  # старые курсы остаются в силе до следующей попытки
+                logger.exception('Currency rates refresh failed')
+
+
+    @classmethod
+    def start(cls) -> None:
+        if cls._refresher is None or cls._refresher.done():
+            cls._refresher = asyncio.create_task(cls.run_refresher())
+
+
+    @classmethod
+    async def stop(cls) -> None:
+        for task in (cls._refresher, cls._loading):
+            if task is not None and not task.done():
+                task.cancel()
+        cls._refresher = cls._loading = None
+        cls._failures = 0
+        cls._retry_at = 0.0
+
+
+def sum_by_currency(rows, amount_field: str) -> dict[str, float]:
+    '''Пакетная свертка строк: дальше конвертируются три суммы, а не каждая строка.
+    Валюта NULL считается EUR, как в rollup; прочие валюты в итоги не входят'''
+    totals = dict.fromkeys(CURRENCY_FIELDS, 0.0)
+    for row in rows:
+        currency = row.currency or 'EUR'
+        if currency in totals:
+            totals[currency] += getattr(row, amount_field) or 0
+    return totals
+
+
+def convert_totals(totals: dict[str, float], rates: dict[str, float], current: str | None) -> dict:
+    euro = 0.0
+    for currency, amount in totals.items():
+        currency = currency or 'EUR'
+        if currency in rates:  # для других валют курса нет — пропускаем, а не падаем с KeyError
+            euro += (amount or 0) / rates[currency]
+    summary = {field: round(euro * rates[currency], 2) for currency, field in CURRENCY_FIELDS.items()}
+    summary['answer'] = summary[CURRENCY_FIELDS[current or 'EUR']]
+    return summary
+
+
+def conversion_unavailable(reason: str) -> dict:
+    return {'euro': reason,
+            'rub': reason,
+            'rsd': reason,
+            'answer': reason}
+
+
+async def currency_summary(rows, totals, current, amount_field: str, rpc_request) -> dict:
+    '''Итоги в EUR/RUB/RSD: локально по таблице курсов, либо через currency_aggregator (RPC)'''
+    if settings.CURRENCY_CONVERSION == 'rpc':
+        future = asyncio.get_running_loop().create_future()
+        await rpc_request(future, rows, current, totals)
+        try:
+            with stage('rpc'):
+                answer = await asyncio.wait_for(future, timeout=10)  # ждем ответа
+            return json.loads(answer)
+        except asyncio.TimeoutError:
+            return conversion_unavailable("CurrentAggregator doesn't response")
+    try:
+        rates = await CurrencyRates.get_rates()
+    except Exception:
+        logger.exception('Currency rates are unavailable')
+        return conversion_unavailable('Currency rates are unavailable')
+    if totals is None:
+        totals = sum_by_currency(rows, amount_field)
+    return convert_totals(totals, rates, current)
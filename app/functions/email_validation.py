@@ -1,16 +1,142 @@
+import asyncio
+import logging
+import time
 import httpx
+from email_validator import validate_email, EmailNotValidError, EmailUndeliverableError
+from email_validator.deliverability import validate_email_deliverability
+from prometheus_client import Counter
 from app.config import settings
+from app.redis import Redis
 
 
-async def email_validation(email):
-    url = 'https://emailvalidation.abstractapi.com/v1/'
-    params = {
-        'api_key': settings.abstract_key,
-        'email': email
-    }
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, params=params)
-    if response.json()['deliverability'] == 'DELIVERABLE':
-        return True
+logger = logging.getLogger("NMNH")
+
+ABSTRACT_API_URL = 'https://emailvalidation.abstractapi.com/v1/'
+
+EMAIL_VALIDATION = Counter(
+    "email_validation_total",
+    "Signup email checks by the step that decided the result",
+    ["result"]
+)
+
+
+def address_key(email: str) -> str:
+    return f'email: address: {email}'
+
+
+def domain_key(domain: str) -> str:
+    return f'email: domain: {domain}'
+
+
+class EmailProvider:
+    '''Abstract API через один клиент на все время жизни приложения и circuit breaker над ним'''
+    _client: httpx.AsyncClient | None = None
+    _failures: int = 0
+    _open_until: float = 0.0
+
+
+    @classmethod
+    def get_client(cls) -> httpx.AsyncClient:
+        if cls._client is None or cls._client.is_closed:
+            # keep-alive соединения переживают запрос: TCP и TLS рукопожатие не на каждую регистрацию
+            cls._client = httpx.AsyncClient(timeout=httpx.Timeout(settings.EMAIL_VALIDATION_TIMEOUT),
+                                            limits=httpx.Limits(max_connections=20,
+                                                                max_keepalive_connections=10))
+        return cls._client
+
+
+    @classmethod
+    def is_open(cls) -> bool:
+        return time.monotonic() < cls._open_until
+
+
+    @classmethod
+    def failure(cls) -> None:
+        # счетчик не обнуляется при размыкании: после паузы хватит одного сбоя, чтобы разомкнуть снова
+        cls._failures += 1
+        if cls._failures >= settings.EMAIL_BREAKER_FAILURES:
+            cls._open_until = time.monotonic() + settings.EMAIL_BREAKER_RESET
+
+
+    @classmethod
+    def success(cls) -> None:
+        cls._failures = 0
+        cls._open_until = 0.0
+
+
+    @classmethod
+    async def deliverability(cls, email: str) -> str | None:
+        '''DELIVERABLE/UNDELIVERABLE/... от провайдера; None — провайдер недоступен или ответил мусором'''
+        if cls.is_open():
+            return None
+        try:
+            # таймаут httpx — на каждую фазу запроса, wait_for ограничивает запрос целиком
+            response = await asyncio.wait_for(
+                cls.get_client().get(ABSTRACT_API_URL, params={'api_key': settings.abstract_key, 'email': email}),
+                timeout=settings.EMAIL_VALIDATION_TIMEOUT)
+            response.raise_for_status()
+            deliverability = response.json()['deliverability']
+        except (asyncio.TimeoutError, httpx.HTTPError, ValueError, KeyError, TypeError) as error:
+            logger.warning('Email validation provider failed: %r', error)
+            cls.failure()
+            return None
+        cls.success()
+        return deliverability
+
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+
+
+async def domain_accepts_mail(domain: str) -> bool:
+    '''MX (или A/AAAA) запись домена; результат общий для всех адресов домена и лежит в Redis'''
+    redis = await Redis.get_redis()
+    cached = await redis.get(domain_key(domain))
+    if cached is not None:
+        return cached == '1'
+    try:
+        # dnspython синхронный — в поток, чтобы не держать event loop
+        info = await asyncio.to_thread(validate_email_deliverability, domain, domain,
+                                       settings.EMAIL_DNS_TIMEOUT)
+    except EmailUndeliverableError:
+        accepts = False
     else:
+        if 'unknown-deliverability' in info:  # таймаут DNS — не повод отказать и не повод кешировать
+            return True
+        accepts = True
+    await redis.set(domain_key(domain), '1' if accepts else '0', ex=settings.EMAIL_DOMAIN_CACHE_TTL)
+    return accepts
+
+
+async def email_validation(email):
+    '''Синтаксис и домен проверяются локально, адрес — у провайдера с кешем в Redis.
+    Недоступный или медленный провайдер не блокирует регистрацию: проверка пропускает адрес'''
+    try:
+        validated = validate_email(email, check_deliverability=False)
+    except EmailNotValidError:
+        EMAIL_VALIDATION.labels('invalid_syntax').inc()
+        return False
+    address = validated.normalized
+
+    redis = await Redis.get_redis()
+    cached = await redis.get(address_key(address))
+    if cached is not None:
+        EMAIL_VALIDATION.labels('cached').inc()
+        return cached == '1'
+
+    if not await domain_accepts_mail(validated.ascii_domain):
+        EMAIL_VALIDATION.labels('bad_domain').inc()
         return False
+
+    deliverability = await EmailProvider.deliverability(address)
+    if deliverability is None:
+        EMAIL_VALIDATION.labels('fail_open').inc()
+        return True
+    valid = deliverability == 'DELIVERABLE'
+    EMAIL_VALIDATION.labels('deliverable' if valid else 'undeliverable').inc()
+    if deliverability in ('DELIVERABLE', 'UNDELIVERABLE'):  # UNKNOWN/RISKY завтра может стать другим
+        await redis.set(address_key(address), '1' if valid else '0', ex=settings.EMAIL_ADDRESS_CACHE_TTL)
+    return valid
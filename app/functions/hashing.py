@@ -1,18 +1,79 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
+from fastapi import HTTPException, status
+from prometheus_client import Counter, Gauge
+from app.config import settings
 
 
 ph = PasswordHasher(time_cost=3, memory_cost=256*1024, parallelism=2)  # ~256 MiB
 
 
-async def pass_hasher(password: str) -> str:
-    hash_str = ph.hash(password)          # храните hash_str
-    return hash_str
+HASH_QUEUE_DEPTH = Gauge(
+    "password_hash_queue_depth",
+    "Argon2 jobs running or waiting in the hashing pool"
+)
 
+HASH_REJECTED = Counter(
+    "password_hash_rejected_total",
+    "Argon2 jobs rejected with 503 because the backlog is full"
+)
 
-async def pass_verify(hash_str: str, password_input: str) -> bool:
+
+def _hash(password: str) -> str:
+    return ph.hash(password)
+
+
+def _verify(hash_str: str, password_input: str) -> bool:
     try:
         ph.verify(hash_str, password_input)   # True/исключение
         return True
     except VerifyMismatchError:
-        return False
\ No newline at end of file
+        return False
+
+
+class HashingPool:
+    '''Argon2 в отдельных процессах: event loop не блокируется, пик памяти ~ HASH_WORKERS * 256 MiB'''
+    _executor: ProcessPoolExecutor | None = None
+    _backlog: int = 0
+
+
+    @classmethod
+    def get_executor(cls) -> ProcessPoolExecutor:
+        if cls._executor is None:
+            cls._executor = ProcessPoolExecutor(max_workers=settings.HASH_WORKERS)
+        return cls._executor
+
+
+    @classmethod
+    async def run(cls, func, *args):
+        if cls._backlog >= settings.HASH_MAX_BACKLOG:
+            # шторм логинов: лучше быстрый 503, чем зависший API или OOM
+            HASH_REJECTED.inc()
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail='Too many password operations, try again later',
+                                headers={'Retry-After': '1'})
+        cls._backlog += 1
+        HASH_QUEUE_DEPTH.inc()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(cls.get_executor(), func, *args)
+        finally:
+            cls._backlog -= 1
+            HASH_QUEUE_DEPTH.dec()
+
+
+    @classmethod
+    def shutdown(cls) -> None:
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=True, cancel_futures=True)
+            cls._executor = None
+
+
+async def pass_hasher(password: str) -> str:
+    hash_str = await HashingPool.run(_hash, password)          # храните hash_str
+    return hash_str
+
+
+async def pass_verify(hash_str: str, password_input: str) -> bool:
+    return await HashingPool.run(_verify, hash_str, password_input)
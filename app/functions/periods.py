@@ -0,0 +1,93 @@
+import re
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+
+@dataclass(frozen=True)
+class Period:
+    '''Полуоткрытый диапазон дат [start, end): соседние периоды стыкуются без дыр и пересечений'''
+    start: date
+    end: date
+
+    @property
+    def key(self) -> str:
+        '''Ключ кеша из самих дат: в новом месяце ключ другой, старый просто умирает по TTL'''
+        return f'{self.start.isoformat()}..{self.end.isoformat()}'
+
+    def conditions(self, column) -> tuple:
+        '''Условия по голой колонке — их может использовать индекс (owner_id, created_at)'''
+        return (column >= self.start, column < self.end)
+
+    @property
+    def last_day(self) -> date:
+        return self.end - timedelta(days=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_period(today: date, offset: int = 0) -> Period:
+    start = add_months(today.replace(day=1), offset)
+    return Period(start, add_months(start, 1))
+
+
+def quarter_period(today: date, offset: int = 0) -> Period:
+    start = add_months(date(today.year, (today.month - 1) // 3 * 3 + 1, 1), 3 * offset)
+    return Period(start, add_months(start, 3))
+
+
+def year_period(today: date, offset: int = 0) -> Period:
+    return Period(date(today.year + offset, 1, 1), date(today.year + offset + 1, 1, 1))
+
+
+def week_period(today: date, offset: int = 0) -> Period:
+    '''Календарная неделя с понедельника'''
+    start = today - timedelta(days=today.weekday()) + timedelta(weeks=offset)
+    return Period(start, start + timedelta(weeks=1))
+
+
+def rolling_days(today: date, days: int) -> Period:
+    '''Последние days дней и сегодня: как прежнее created_at >= current_date - days'''
+    return Period(today - timedelta(days=days), today + timedelta(days=1))
+
+
+def date_limits(start_date: date, end_date: date) -> Period:
+    '''Границы из запроса юзера включительно -> [start_date, end_date + 1 день)'''
+    return Period(start_date, end_date + timedelta(days=1))
+
+
+NAMED_PERIODS = {
+    'current': lambda today: month_period(today),
+    'month': lambda today: month_period(today),
+    'last month': lambda today: month_period(today, -1),
+    'week': lambda today: rolling_days(today, 7),
+    'calendar week': lambda today: week_period(today),
+    'last week': lambda today: week_period(today, -1),
+    'quarter': lambda today: quarter_period(today),
+    'last quarter': lambda today: quarter_period(today, -1),
+    'year': lambda today: year_period(today),
+    'last year': lambda today: year_period(today, -1),
+}
+ROLLING_DAYS = re.compile(r'last (\d+) days')
+
+
+def resolve_period(spec: str, today: date | None = None,
+                   start_date: date | None = None, end_date: date | None = None) -> Period | None:
+    '''Имя периода -> Period; None — вся история без ограничений по дате'''
+    if spec == 'all':
+        return None
+    if spec == 'limits':
+        return date_limits(start_date, end_date)
+    today = today or date.today()
+    if spec in NAMED_PERIODS:
+        return NAMED_PERIODS[spec](today)
+    match = ROLLING_DAYS.fullmatch(spec)
+    if match:
+        return rolling_days(today, int(match.group(1)))
+    raise ValueError(f'Unknown period: {spec}')
+
+
+def period_key(period: Period | None) -> str:
+    return 'all' if period is None else period.key
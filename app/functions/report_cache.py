@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from prometheus_client import Counter, Gauge
+from app.config import settings
+from app.metrics import stage
+
+
+REPORT_CACHE = Counter(
+    "report_cache_total",
+    "Lookups in the content-addressed PDF report cache",
+    ["result"]
+)
+
+REPORT_CACHE_BYTES = Gauge(
+    "report_cache_bytes",
+    "Bytes of PDF reports stored in the local report cache"
+)
+
+
+def report_key(payload: dict) -> str:
+    '''Ключ — хеш ровно того payload, что уходит в report_builder: те же данные дают тот же PDF'''
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+class ReportCache:
+    '''Готовые PDF на локальном диске с LRU-вытеснением по суммарному размеру'''
+
+    @classmethod
+    def path(cls, key: str) -> Path:
+        return Path(settings.REPORT_CACHE_DIR) / f'{key}.pdf'
+
+
+    @classmethod
+    def _read(cls, key: str) -> bytes | None:
+        path = cls.path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        os.utime(path)  # mtime — метка последнего обращения для LRU
+        return data
+
+
+    @classmethod
+    def _write(cls, key: str, data: bytes) -> None:
+        directory = Path(settings.REPORT_CACHE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        # имя уникально и для двух одновременных записей одного отчета в одном воркере
+        with tempfile.NamedTemporaryFile(dir=directory, prefix=f'{key}.', suffix='.tmp', delete=False) as tmp:
+            tmp.write(data)
+        try:
+            os.replace(tmp.name, cls.path(key))  # атомарно: параллельный читатель не увидит половину файла
+        except BaseException:
+            Path(tmp.name).unlink(missing_ok=True)
+            raise
+        cls._evict(directory)
+
+
+    @classmethod
+    def _evict(cls, directory: Path) -> None:
+        files = []
+        for path in directory.glob('*.pdf'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:  # уже удалил другой воркер
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= settings.REPORT_CACHE_MAX_BYTES:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        REPORT_CACHE_BYTES.set(total)
+
+
+    @classmethod
+    async def get(cls, key: str) -> bytes | None:
+        with stage('cache'):
+            data = await asyncio.to_thread(cls._read, key)
+        REPORT_CACHE.labels('hit' if data is not None else 'miss').inc()
+        return data
+
+
+    @classmethod
+    async def put(cls, key: str, data: bytes) -> None:
+        await asyncio.to_thread(cls._write, key, data)
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import logging
+import uuid
+from app.config import settings
+from app.redis import Redis
+from app.rabbitmq import rpc_report_request
+from app.functions.report_cache import ReportCache, report_key
+
+
+logger = logging.getLogger("NMNH")
+
+def job_key(job_id: str) -> str:
+    return f'report_job: {job_id}'
+
+
+def job_pdf_key(job_id: str) -> str:
+    return f'report_job: {job_id}: pdf'
+
+
+class ReportJobs:
+    '''Задачи на отчеты: состояние и PDF живут в Redis, поэтому опрос и скачивание обслужит любой воркер'''
+    _tasks: set[asyncio.Task] = set()
+
+
+    @classmethod
+    async def save(cls, job_id: str, owner_id: int, status: str) -> None:
+        redis = await Redis.get_redis()
+        await redis.set(job_key(job_id), json.dumps({'owner_id': owner_id, 'status': status}),
+                        ex=settings.REPORT_JOB_TTL)
+
+
+    @classmethod
+    async def finish(cls, job_id: str, owner_id: int, pdf: bytes) -> None:
+        binary_redis = await Redis.get_binary_redis()
+        await binary_redis.set(job_pdf_key(job_id), pdf, ex=settings.REPORT_JOB_TTL)
+        await cls.save(job_id, owner_id, 'done')  # статус после PDF: done всегда означает, что файл есть
+
+
+    @classmethod
+    async def fail(cls, job_id: str, owner_id: int) -> None:
+        try:
+            await cls.save(job_id, owner_id, 'failed')
+        except Exception:
+            logger.exception('Report job %s: failed status was not saved', job_id)
+
+
+    @classmethod
+    async def wait_report(cls, job_id: str, owner_id: int, key: str, future: asyncio.Future) -> None:
+        '''Любой исход, кроме done, пишется как failed: иначе задача висела бы в pending до REPORT_JOB_TTL'''
+        try:
+            pdf = await asyncio.wait_for(future, timeout=settings.REPORT_RPC_TIMEOUT)
+            await ReportCache.put(key, pdf)
+            await cls.finish(job_id, owner_id, pdf)
+        except asyncio.TimeoutError:
+            logger.warning('Report job %s: report_builder did not answer in %s s', job_id, settings.REPORT_RPC_TIMEOUT)
+            await cls.fail(job_id, owner_id)
+        except (Exception, asyncio.CancelledError):  # ReportJobs.stop() при остановке или отмененный future ответа
+            logger.exception('Report job %s failed', job_id)
+            await cls.fail(job_id, owner_id)
+            if asyncio.current_task().cancelling():  # отменили саму задачу — отмену не глотаем
+                raise
+
+
+    @classmethod
+    async def stop(cls) -> None:
+        '''Остановка: недождавшиеся задачи успевают записать failed, пока Redis еще открыт'''
+        tasks = list(cls._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+    @classmethod
+    async def submit(cls, owner_id: int, payload: dict, current: str | None) -> dict:
+        job_id = uuid.uuid4().hex
+        key = report_key(payload)
+        pdf = await ReportCache.get(key)
+        if pdf is not None:
+            await cls.finish(job_id, owner_id, pdf)
+            return {'job_id': job_id, 'status': 'done'}
+
+        await cls.save(job_id, owner_id, 'pending')
+        future = asyncio.get_running_loop().create_future()
+        await rpc_report_request(future, payload, current)
+        # ответ report_builder дожидается фоновая задача, обработчик запроса свободен сразу
+        task = asyncio.create_task(cls.wait_report(job_id, owner_id, key, future))
+        cls._tasks.add(task)
+        task.add_done_callback(cls._tasks.discard)
+        return {'job_id': job_id, 'status': 'pending'}
+
+
+    @classmethod
+    async def status(cls, job_id: str, owner_id: int) -> str | None:
+        redis = await Redis.get_redis()
+        job = await redis.get(job_key(job_id))
+        if not job:
+            return None
+        job = json.loads(job)
+        if job['owner_id'] != owner_id:  # чужие задачи для юзера не существуют
+            return None
+        return job['status']
+
+
+    @classmethod
+    async def pdf(cls, job_id: str) -> bytes | None:
+        binary_redis = await Redis.get_binary_redis()
+        return await binary_redis.get(job_pdf_key(job_id))
@@ -0,0 +1,133 @@
+import codecs
+import csv
+import math
+from datetime import date, datetime
+from app.config import settings
+
+
+CURRENCIES = ('EUR', 'RUB', 'RSD')
+CSV_COLUMNS = ('name', 'description', 'price', 'currency', 'category_id')
+BANK_COLUMNS = ('date', 'description', 'amount', 'currency')
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportStats:
+    '''Счетчики одного импорта: сколько строк загружено, пропущено и почему'''
+    def __init__(self):
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+        self.errors_total = 0
+
+    def error(self, line: int, reason: str) -> None:
+        self.errors_total += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:  # на битом файле ответ не должен расти без предела
+            self.errors.append({'line': line, 'error': reason})
+
+    def to_dict(self) -> dict:
+        return {'imported': self.imported,
+                'skipped': self.skipped,
+                'errors_total': self.errors_total,
+                'errors': self.errors}
+
+
+async def iter_line_batches(chunks):
+    '''Байтовые куски тела запроса -> пачки целых строк; в памяти только хвост незаконченной строки.
+    Поля с переводом строки внутри кавычек не поддерживаются — в выписках их нет'''
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    tail = ''
+    async for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).split('\n')
+        tail = lines.pop()
+        if lines:
+            yield lines
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield [tail]
+
+
+def parse_price(value: str) -> float:
+    price = float(value.strip().replace(' ', '').replace(',', '.'))
+    if not math.isfinite(price):
+        raise ValueError('price must be a number')
+    return price
+
+
+def parse_currency(value: str) -> str:
+    currency = value.strip().upper()
+    if currency not in CURRENCIES:
+        raise ValueError('Currency error: choose only EUR/RUB/RSD')
+    return currency
+
+
+def parse_category(value, categories: set[int]) -> int:
+    category_id = int(value)
+    if category_id not in categories:  # иначе COPY упадет на внешнем ключе и откатит весь файл
+        raise ValueError(f'unknown category {category_id}')
+    return category_id
+
+
+def csv_record(row: dict, owner_id: int, categories: set[int], today: date) -> tuple:
+    '''Строка нашего CSV: name,description,price,currency,category_id[,created_at]'''
+    price = parse_price(row['price'])
+    if price <= 0:
+        raise ValueError('price must be positive')
+    created_at = date.fromisoformat(row['created_at']) if row.get('created_at') else today
+    return (row['name'], row['description'], price, parse_currency(row['currency']),
+            owner_id, parse_category(row['category_id'], categories), created_at)
+
+
+def bank_record(row: dict, owner_id: int, categories: set[int], category_id: int) -> tuple | None:
+    '''Строка банковской выписки: Date;Description;Amount;Currency, даты DD.MM.YYYY, десятичная запятая.
+    Покупки — списания (отрицательные суммы), поступления пропускаются'''
+    amount = parse_price(row['amount'])
+    if amount >= 0:
+        return None
+    created_at = datetime.strptime(row['date'].strip(), '%d.%m.%Y').date()
+    description = row['description'].strip()
+    return (description, description, -amount, parse_currency(row['currency']),
+            owner_id, parse_category(category_id, categories), created_at)
+
+
+async def purchase_records(chunks, owner_id: int, categories: set[int], stats: ImportStats,
+                           fmt: str = 'csv', category_id: int | None = None):
+    '''Поток кортежей для COPY: строки проверяются пачками по мере чтения тела, битые попадают в stats'''
+    delimiter, required = (';', BANK_COLUMNS) if fmt == 'bank' else (',', CSV_COLUMNS)
+    today = date.today()
+    header = None
+    line_no = 0
+    batch = []
+    async for lines in iter_line_batches(chunks):
+        for row in csv.reader(lines, delimiter=delimiter):
+            line_no += 1
+            if not row or not any(field.strip() for field in row):
+                continue
+            if header is None:
+                header = [field.strip().lower() for field in row]
+                missing = [column for column in required if column not in header]
+                if missing:
+                    raise ValueError(f'Missing columns: {", ".join(missing)}')
+                continue
+            try:
+                if len(row) != len(header):
+                    raise ValueError(f'expected {len(header)} fields, got {len(row)}')
+                fields = dict(zip(header, row))
+                if fmt == 'bank':
+                    record = bank_record(fields, owner_id, categories, category_id)
+                else:
+                    record = csv_record(fields, owner_id, categories, today)
+            except (ValueError, KeyError) as error:
+                stats.error(line_no, str(error))
+                continue
+            if record is None:
+                stats.skipped += 1
+                continue
+            batch.append(record)
+            if len(batch) >= settings.IMPORT_BATCH_SIZE:
+                stats.imported += len(batch)
+                for record in batch:
+                    yield record
+                batch = []
+    stats.imported += len(batch)
+    for record in batch:
+        yield record
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from prometheus_client import Gauge
+from sqlalchemy import text
+from app.config import settings
+from app.database.engine import engine
+from app.functions.currency import CurrencyRates
+from app.functions.email_validation import EmailProvider
+from app.functions.hashing import HashingPool
+from app.functions.report_jobs import ReportJobs
+from app.rabbitmq import RabbitMQConnectionManager, RPCReplyConsumer, RPCQueues, declare_topology
+from app.redis import Redis
+
+
+logger = logging.getLogger("NMNH")
+
+# импорт приложения — самая ранняя точка холодного старта, доступная без внешних библиотек
+STARTED_AT = time.monotonic()
+
+WARMUP_DURATION = Gauge(
+    "app_warmup_seconds",
+    "Time from application import until all backing services were warmed up"
+)
+
+COLD_START = Gauge(
+    "app_cold_start_seconds",
+    "Time from application import until the first successful (2xx) response"
+)
+
+DEPENDENCY_READY = Gauge(
+    "app_dependency_ready",
+    "Whether the backing service passed warm-up",
+    ["dependency"]
+)
+
+
+async def warm_database() -> None:
+    '''Открываем сразу DB_POOL_SIZE соединений и проверяем каждое'''
+    connections = await asyncio.gather(*(engine.connect() for _ in range(settings.DB_POOL_SIZE)))
+    try:
+        for connection in connections:
+            await connection.execute(text('SELECT 1'))
+    finally:
+        for connection in connections:
+            await connection.close()
+
+
+async def warm_redis() -> None:
+    for client in (await Redis.get_redis(), await Redis.get_binary_redis()):
+        await client.ping()
+
+
+WARMUP_STEPS = {'database': warm_database,
+                'redis': warm_redis,
+                'rabbitmq': declare_topology}
+
+
+class Readiness:
+    '''Готов ли воркер принимать трафик: все зависимости прогреты и он не останавливается'''
+    _components: dict[str, bool] = {}
+    _ready: bool = False
+    _first_response: bool = False
+
+
+    @classmethod
+    def reset(cls) -> None:
+        cls._components = dict.fromkeys(WARMUP_STEPS, False)
+        cls._ready = False
+        for name in WARMUP_STEPS:
+            DEPENDENCY_READY.labels(name).set(0)
+
+
+    @classmethod
+    def mark(cls, name: str) -> None:
+        cls._components[name] = True
+        DEPENDENCY_READY.labels(name).set(1)
+        if all(cls._components.values()):
+            cls._ready = True
+            WARMUP_DURATION.set(time.monotonic() - STARTED_AT)
+
+
+    @classmethod
+    def is_ready(cls) -> bool:
+        return cls._ready
+
+
+    @classmethod
+    def status(cls) -> dict:
+        return {'ready': cls._ready,
+                'dependencies': {name: 'ok' if ok else 'pending' for name, ok in cls._components.items()}}
+
+
+    @classmethod
+    def stop(cls) -> None:
+        cls._ready = False  # балансировщик перестает слать трафик, пока закрываемся
+
+
+    @classmethod
+    def response(cls, status_code: int) -> None:
+        '''Первый 2xx воркера фиксирует время холодного старта; дальше — одна проверка флага'''
+        if cls._first_response or status_code >= 300:
+            return
+        cls._first_response = True
+        COLD_START.set(time.monotonic() - STARTED_AT)
+        logger.info('Cold start to first 2xx: %.3f s', time.monotonic() - STARTED_AT)
+
+
+async def warm_step(name: str, step) -> None:
+    '''Одна зависимость: пробуем до успеха с экспоненциальной паузой — лежащая база не роняет старт'''
+    delay = 0.5
+    while True:
+        try:
+            await asyncio.wait_for(step(), timeout=settings.WARMUP_TIMEOUT)
+        except Exception as error:
+            logger.warning('Warm-up of %s failed, retry in %.1f s: %r', name, delay, error)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, settings.WARMUP_RETRY_MAX)
+        else:
+            Readiness.mark(name)
+            return
+
+
+async def warm_up() -> None:
+    await asyncio.gather(*(warm_step(name, step) for name, step in WARMUP_STEPS.items()))
+    logger.info('Warm-up finished in %.3f s', time.monotonic() - STARTED_AT)
+
+
+async def drain_rpc() -> None:
+    '''Ответы на уже отправленные RPC успевают прийти до закрытия каналов'''
+    deadline = time.monotonic() + settings.SHUTDOWN_DRAIN_TIMEOUT
+    while RPCReplyConsumer.pending() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+
+async def close_rabbitmq() -> None:
+    await RabbitMQConnectionManager.close_all()
+    RPCReplyConsumer.reset()
+    RPCQueues.reset()
+
+
+async def shutdown_hashing() -> None:
+    await asyncio.to_thread(HashingPool.shutdown)  # shutdown(wait=True) ждет процессы — не в event loop
+
+
+# порядок важен: сначала фоновые задачи, которые еще могут ходить в Redis и API, потом соединения
+SHUTDOWN_STEPS = (('currency rates', CurrencyRates.stop),
+                  ('rpc drain', drain_rpc),
+                  ('report jobs', ReportJobs.stop),
+                  ('rabbitmq', close_rabbitmq),
+                  ('email provider', EmailProvider.close),
+                  ('hashing pool', shutdown_hashing),
+                  ('redis', Redis.close),
+                  ('database', engine.dispose))
+
+
+async def shutdown() -> None:
+    for name, step in SHUTDOWN_STEPS:
+        try:
+            await step()
+        except Exception:  # одна упавшая зависимость не должна оставить открытыми остальные
+            logger.exception('Shutdown of %s failed', name)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    '''Прогрев зависимостей в фоне на старте, готовность через /ready, аккуратная остановка'''
+    Readiness.reset()
+    warmup = asyncio.create_task(warm_up())
+    try:
+        yield
+    finally:
+        Readiness.stop()
+        warmup.cancel()
+        await asyncio.gather(warmup, return_exceptions=True)
+        await shutdown()
@@ -1,10 +1,15 @@
-from fastapi import FastAPI, Depends, Response
+from fastapi import FastAPI, Depends, Response, status
+from fastapi.responses import JSONResponse
 from app.routers.auth import router as auth_router
 from app.routers.categories import router as categories_router
 from app.routers.incomes import router as incomes_router
 from app.routers.purchases import router as purchases_router
 from app.routers.reports import router as reports_router
 from app.database.db_depends import get_db
+from app.database.engine import engine
+from app.lifespan import lifespan, Readiness
+from app.metrics import (TimedJSONResponse, request_stages, route_template,
+                         observe_stages, observe_db_stage)
 from typing import Annotated
 from sqlalchemy.ext.asyncio import AsyncSession
 from prometheus_client import Counter, Histogram, generate_latest
@@ -18,7 +23,8 @@ logger = logging.getLogger("NMNH")  # свой логгер
 # logging.getLogger("uvicorn.access").setLevel(logging.INFO)
 
 
-app = FastAPI()
+app = FastAPI(default_response_class=TimedJSONResponse, lifespan=lifespan)
+observe_db_stage(engine)
 
 
 REQUEST_COUNT = Counter(
@@ -37,17 +43,25 @@ REQUEST_LATENCY = Histogram(
 @app.middleware("http")
 async def metrics_middleware(request, call_next):
     start = time.time()
-    response = await call_next(request)
+    stages = {}
+    token = request_stages.set(stages)
+    try:
+        response = await call_next(request)
+    finally:
+        request_stages.reset(token)
 
     duration = time.time() - start
+    path = route_template(request)
 
     REQUEST_COUNT.labels(
         request.method,
-        request.url.path,
+        path,
         response.status_code
     ).inc()
 
-    REQUEST_LATENCY.labels(request.url.path).observe(duration)
+    REQUEST_LATENCY.labels(path).observe(duration)
+    observe_stages(path, stages)
+    Readiness.response(response.status_code)
     return response
 
 
@@ -62,6 +76,13 @@ async def work_check(db: Annotated[AsyncSession, Depends(get_db)]):
             "db": f"{'ok' if db.is_alive() else 'dead'}"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    '''Проба готовности: 503, пока зависимости не прогреты или воркер останавливается'''
+    code = status.HTTP_200_OK if Readiness.is_ready() else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(Readiness.status(), status_code=code)
+
+
 @app.get("/metrics")
 async def metrics():
     return Response(generate_latest(), media_type="text/plain")
@@ -0,0 +1,60 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import Histogram
+from sqlalchemy import event
+from starlette.responses import JSONResponse
+
+
+REQUEST_STAGE_LATENCY = Histogram(
+    "http_request_stage_duration_seconds",
+    "Time a request spent in one stage: auth, cache, db, rpc, serialize",
+    ["path", "stage"]
+)
+
+# стадии текущего запроса: middleware кладет сюда dict, stage() копит в нем секунды
+request_stages: ContextVar[dict[str, float] | None] = ContextVar('request_stages', default=None)
+
+
+def route_template(request) -> str:
+    '''Шаблон маршрута вместо сырого пути: /reports/jobs/{job_id}, а не каждый id отдельной серией'''
+    route = request.scope.get('route')
+    return getattr(route, 'path', 'unmatched')
+
+
+@contextmanager
+def stage(name: str):
+    stages = request_stages.get()
+    if stages is None:  # вне HTTP-запроса (фоновая задача, тесты) не меряем
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def observe_stages(path: str, stages: dict[str, float]) -> None:
+    for name, seconds in stages.items():
+        REQUEST_STAGE_LATENCY.labels(path, name).observe(seconds)
+
+
+def observe_db_stage(engine) -> None:
+    '''Время SQL-запросов считается через события движка, без правок в db_functions'''
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        context._stage_start = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        stages = request_stages.get()
+        if stages is not None:
+            stages['db'] = stages.get('db', 0.0) + time.perf_counter() - context._stage_start
+
+
+class TimedJSONResponse(JSONResponse):
+    '''JSONResponse, который записывает рендеринг тела в стадию serialize'''
+    def render(self, content) -> bytes:
+        with stage('serialize'):
+            return super().render(content)
@@ -1,4 +1,5 @@
 from .connection import RabbitMQConnectionManager
-from .rabbit_functions import (consume_response, send_message,
+from .rabbit_functions import (RPCReplyConsumer, RPCQueues, RPCBatcher, RPC_TOPOLOGY,
+                               declare_topology, send_message, rpc_request,
                                rpc_incomes_request, rpc_purchases_request,
                                rpc_report_request)
@@ -1,13 +1,31 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
 import aio_pika
 from aio_pika.abc import AbstractRobustConnection, AbstractRobustChannel
+from prometheus_client import Gauge, Histogram
 from typing import Optional
 from app.config import settings
 
 
+CHANNEL_WAIT = Histogram(
+    "rabbitmq_channel_wait_seconds",
+    "Time spent waiting for a free channel in the publishing pool",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+)
+
+CHANNELS_IN_USE = Gauge(
+    "rabbitmq_channels_in_use",
+    "Publishing channels currently acquired from the pool"
+)
+
+
 class RabbitMQConnectionManager:
     _connection: Optional[AbstractRobustConnection] = None
     _channels: Optional[AbstractRobustChannel] = {}
     _url: str = settings.rabbitmq_url
+    _pool: list[AbstractRobustChannel] = []  # свободные каналы для публикации
+    _pool_slots: asyncio.Semaphore | None = None
 
 
     @classmethod
@@ -19,19 +37,67 @@ class RabbitMQConnectionManager:
 
     @classmethod
     async def get_channel(cls, name: str = "default") -> AbstractRobustChannel:
+        '''Именованный канал под консьюмер ответов и объявление очередей; публикация — через acquire'''
         if name not in cls._channels or cls._channels[name].is_closed:
             connection = await cls.get_connection()
-            cls._channels[name] = await connection.channel()
+            channel = await connection.channel()
+            # сколько неподтвержденных ответов брокер отдает консьюмеру канала разом
+            prefetch = settings.RABBITMQ_PREFETCH.get(name, settings.RABBITMQ_DEFAULT_PREFETCH)
+            await channel.set_qos(prefetch_count=prefetch)
+            cls._channels[name] = channel
         return cls._channels[name]
 
 
+    @classmethod
+    async def open_channel(cls) -> AbstractRobustChannel:
+        connection = await cls.get_connection()
+        return await connection.channel(publisher_confirms=settings.RABBITMQ_PUBLISHER_CONFIRMS)
+
+
+    @classmethod
+    def slots(cls) -> asyncio.Semaphore:
+        if cls._pool_slots is None:
+            cls._pool_slots = asyncio.Semaphore(settings.RABBITMQ_CHANNEL_POOL_SIZE)
+        return cls._pool_slots
+
+
+    @classmethod
+    @asynccontextmanager
+    async def acquire(cls):
+        '''Канал из пула в монопольное пользование: публикации из сотен корутин идут параллельно
+        по RABBITMQ_CHANNEL_POOL_SIZE каналам, а не в очередь на одном'''
+        slots = cls.slots()
+        start = time.monotonic()
+        await slots.acquire()
+        CHANNEL_WAIT.observe(time.monotonic() - start)
+        channel = None
+        try:
+            while cls._pool and channel is None:
+                channel = cls._pool.pop()
+                if channel.is_closed:  # закрытый брокером канал просто выбрасываем
+                    channel = None
+            if channel is None:
+                channel = await cls.open_channel()
+            CHANNELS_IN_USE.inc()
+            try:
+                yield channel
+            finally:
+                CHANNELS_IN_USE.dec()
+        finally:
+            if channel is not None and not channel.is_closed:
+                cls._pool.append(channel)
+            slots.release()
+
+
     @classmethod
     async def close_all(cls):
         """Закрывает все каналы и соединение"""
-        for name, channel in cls._channels.items():
+        for channel in [*cls._channels.values(), *cls._pool]:
             if channel and not channel.is_closed:
                 await channel.close()
         cls._channels.clear()
+        cls._pool.clear()
+        cls._pool_slots = None
 
         if cls._connection and not cls._connection.is_closed:
             await cls._connection.close()
@@ -1,58 +1,244 @@
-from typing import Any
-
-import aio_pika, asyncio, uuid, json
+import aio_pika, asyncio, uuid, json, time
 from aio_pika.abc import AbstractRobustQueue
+from prometheus_client import Histogram
 
+from app.config import settings
+from app.functions.currency import conversion_unavailable
 from app.rabbitmq import RabbitMQConnectionManager
 
 
-async def consume_response(reply_queue, correlation_id: str, future: asyncio.Future):
-    async def on_message(message: aio_pika.IncomingMessage) -> None:
-        if message.correlation_id == correlation_id and not future.done():
+PUBLISH_LATENCY = Histogram(
+    "rabbitmq_publish_seconds",
+    "Time to publish an RPC request, including the broker confirm when enabled",
+    ["queue"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+)
+
+
+class RPCReplyConsumer:
+    '''Один долгоживущий консьюмер на канал: ответы раскладываются по футурам через correlation_id'''
+    _reply_queues: dict[str, AbstractRobustQueue] = {}
+    _futures: dict[str, asyncio.Future] = {}
+    _lock: asyncio.Lock = asyncio.Lock()
+
+
+    @classmethod
+    async def get_reply_queue(cls, channel_name: str) -> AbstractRobustQueue:
+        queue = cls._reply_queues.get(channel_name)
+        if queue is not None and not queue.channel.is_closed:
+            return queue
+        async with cls._lock:
+            queue = cls._reply_queues.get(channel_name)
+            if queue is None or queue.channel.is_closed:
+                channel = await RabbitMQConnectionManager.get_channel(channel_name)
+                # эксклюзивная очередь воркера: чужие ответы сюда не попадают, nack/requeue не нужен
+                queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+                await queue.consume(cls.on_message)
+                cls._reply_queues[channel_name] = queue
+        return queue
+
+
+    @classmethod
+    def register(cls, correlation_id: str, future: asyncio.Future) -> None:
+        cls._futures[correlation_id] = future
+        # футура отменяется по таймауту в wait_for — тогда же убираем ее из реестра
+        future.add_done_callback(lambda _: cls._futures.pop(correlation_id, None))
+
+
+    @classmethod
+    async def on_message(cls, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        await message.ack()
+        future = cls._futures.pop(message.correlation_id, None)
+        if future is not None and not future.done():
             future.set_result(message.body)
-            await message.ack()
-        else:
-            # сообщение не то — возвращаем обратно в очередь
-            await message.nack(requeue=True)
+        # ответ без ожидающей футуры (опоздал после таймаута) просто выбрасываем
+
+
+    @classmethod
+    def pending(cls) -> int:
+        return len(cls._futures)
+
 
-    consumer_tag = await reply_queue.consume(on_message)
-    return consumer_tag
+    @classmethod
+    def reset(cls) -> None:
+        cls._reply_queues.clear()
+        cls._futures.clear()
+        cls._lock = asyncio.Lock()
+
+
+class RPCQueues:
+    '''Очереди запросов объявляются один раз на канал: дальше публикация без лишнего round trip в брокер'''
+    _declared: dict[tuple[str, str], AbstractRobustQueue] = {}
+
+
+    @classmethod
+    async def get_queue(cls, channel, channel_name: str, queue_name: str) -> AbstractRobustQueue:
+        queue = cls._declared.get((channel_name, queue_name))
+        # новый канал (старый закрылся) — объявляем заново; robust-канал после реконнекта делает это сам
+        if queue is None or queue.channel is not channel:
+            queue = await channel.declare_queue(queue_name, durable=True)
+            cls._declared[(channel_name, queue_name)] = queue
+        return queue
+
+
+    @classmethod
+    def reset(cls) -> None:
+        cls._declared.clear()
+
+
+# канал -> очередь запросов; reply-очередь у каждого канала своя, ее объявляет RPCReplyConsumer
+RPC_TOPOLOGY = {'currency_aggregator': 'api_aggregation_queue',
+                'report_builder': 'report_queue'}
+
+
+async def declare_topology() -> None:
+    '''Все каналы, reply-консьюмеры и очереди RPC заранее — первый запрос не платит за них'''
+    for channel_name, queue_name in RPC_TOPOLOGY.items():
+        await RPCReplyConsumer.get_reply_queue(channel_name)
+        channel = await RabbitMQConnectionManager.get_channel(channel_name)
+        await RPCQueues.get_queue(channel, channel_name, queue_name)
 
 
 async def send_message(channel, data, queue, reply_queue, correlation_id):
-    await channel.default_exchange.publish(
-        aio_pika.Message(body=data, reply_to=reply_queue.name,
-                         correlation_id=correlation_id),
-        routing_key=queue.name)
+    # с publisher confirms время включает подтверждение от брокера
+    with PUBLISH_LATENCY.labels(queue.name).time():
+        await channel.default_exchange.publish(
+            aio_pika.Message(body=data, reply_to=reply_queue.name,
+                             correlation_id=correlation_id),
+            routing_key=queue.name)
 
 
-async def rpc_incomes_request(future, data, current):
+async def rpc_request(future: asyncio.Future, channel_name: str, queue_name: str, data: bytes) -> str:
     correlation_id = str(uuid.uuid4())  # создаем уникальный id для сообщения
-    channel = await RabbitMQConnectionManager.get_channel('currency_aggregator')
-    queue = await channel.declare_queue('api_aggregation_queue', durable=True)
-    reply_queue = await channel.declare_queue('reply_api_aggregation_queue', durable=True)
-    consumer_tag = await consume_response(reply_queue, correlation_id, future)
-    data = {'incomes': [item.to_dict() for item in data], 'current_currency': current, 'content': 'Incomes'}
-    await send_message(channel, json.dumps(data).encode(), queue, reply_queue, correlation_id)
-    return reply_queue, consumer_tag
-
-
-async def rpc_purchases_request(future: object, data: object, current: object) -> tuple[AbstractRobustQueue, Any]:
-    correlation_id = str(uuid.uuid4())
-    channel = await RabbitMQConnectionManager.get_channel('currency_aggregator')
-    queue = await channel.declare_queue('api_aggregation_queue', durable=True)
-    reply_queue = await channel.declare_queue('reply_api_aggregation_queue', durable=True)
-    consumer_tag = await consume_response(reply_queue, correlation_id, future)
-    data = {'purchases': [item.to_dict() for item in data], 'current_currency': current, 'content': 'Purchases'}
-    await send_message(channel, json.dumps(data).encode(), queue, reply_queue, correlation_id)
-    return reply_queue, consumer_tag
+    reply_queue = await RPCReplyConsumer.get_reply_queue(channel_name)
+    channel = await RabbitMQConnectionManager.get_channel(channel_name)
+    queue = await RPCQueues.get_queue(channel, channel_name, queue_name)
+    RPCReplyConsumer.register(correlation_id, future)
+    try:
+        # ответ придет в reply-очередь именованного канала, публиковать можно с любого канала соединения
+        async with RabbitMQConnectionManager.acquire() as publisher:
+            await send_message(publisher, data, queue, reply_queue, correlation_id)
+    except Exception:
+        future.cancel()  # ответа на неотправленное сообщение не будет — убираем футуру из реестра
+        raise
+    return correlation_id
+
+
+def totals_to_rows(totals: dict[str, float], amount_field: str) -> list[dict]:
+    '''Итоги по валютам в виде строк того же формата, что агрегатор получает сейчас'''
+    return [{amount_field: total, 'currency': currency} for currency, total in totals.items()]
+
+
+RPC_BATCH_SIZE = Histogram(
+    "rpc_batch_size",
+    "Conversion requests sent to currency_aggregator in one batched message",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+
+RPC_BATCH_WAIT = Histogram(
+    "rpc_batch_wait_seconds",
+    "Time a conversion request waits in the batch before it is published",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+)
+
+BATCH_REPLY_TIMEOUT = 10  # как ожидание ответа в currency_summary: дальше футура пачки не нужна
+
+
+class RPCBatcher:
+    '''Запросы конвертации копятся RPC_BATCH_WINDOW секунд или до RPC_BATCH_MAX штук
+    и уходят в currency_aggregator одним сообщением; ответ пачки раскладывается по футурам через id'''
+    _pending: list[tuple[str, dict, asyncio.Future, float]] = []
+    _timer: asyncio.Task | None = None
+
+
+    @classmethod
+    async def submit(cls, future: asyncio.Future, payload: dict) -> str:
+        item_id = uuid.uuid4().hex
+        cls._pending.append((item_id, payload, future, time.monotonic()))
+        if len(cls._pending) >= settings.RPC_BATCH_MAX:
+            await cls.flush()
+        elif cls._timer is None:
+            cls._timer = asyncio.create_task(cls.flush_later())
+        return item_id
+
+
+    @classmethod
+    async def flush_later(cls) -> None:
+        await asyncio.sleep(settings.RPC_BATCH_WINDOW)
+        cls._timer = None
+        await cls.flush()
+
+
+    @classmethod
+    async def flush(cls) -> None:
+        if cls._timer is not None:  # пачку отправляем сейчас — окно больше не нужно
+            cls._timer.cancel()
+            cls._timer = None
+        batch, cls._pending = cls._pending, []
+        if not batch:
+            return
+        now = time.monotonic()
+        RPC_BATCH_SIZE.observe(len(batch))
+        for _, _, _, queued_at in batch:
+            RPC_BATCH_WAIT.observe(now - queued_at)
+
+        loop = asyncio.get_running_loop()
+        reply = loop.create_future()
+        reply.add_done_callback(lambda done: cls.split(done, batch))
+        # ответ может не прийти вовсе: без этого футура пачки навсегда осталась бы в RPCReplyConsumer
+        loop.call_later(BATCH_REPLY_TIMEOUT, lambda: reply.done() or reply.cancel())
+        data = {'batch': [{'id': item_id, **payload} for item_id, payload, _, _ in batch]}
+        try:
+            await rpc_request(reply, 'currency_aggregator', 'api_aggregation_queue', json.dumps(data).encode())
+        except Exception as error:
+            # ошибку публикации получает каждый ждущий запрос, а не тот, кому выпало отправлять пачку
+            reply.cancel()
+            for _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+
+    @classmethod
+    def split(cls, reply: asyncio.Future, batch: list) -> None:
+        '''{"results": {id: {euro, rub, rsd, answer}}} -> ответы в том же виде, что без пачек'''
+        if reply.cancelled():
+            return  # ждущие запросы получат свой таймаут
+        try:
+            results = json.loads(reply.result())['results']
+        except (ValueError, KeyError, TypeError):
+            results = {}
+        for item_id, _, future, _ in batch:
+            if future.done():  # запрос уже отвалился по таймауту
+                continue
+            answer = results.get(item_id, conversion_unavailable('CurrentAggregator lost the request'))
+            future.set_result(json.dumps(answer).encode())
+
+
+    @classmethod
+    def reset(cls) -> None:
+        if cls._timer is not None:
+            cls._timer.cancel()
+        cls._pending = []
+        cls._timer = None
+
+
+async def conversion_request(future, data: dict) -> str:
+    if settings.RPC_BATCHING:
+        return await RPCBatcher.submit(future, data)
+    return await rpc_request(future, 'currency_aggregator', 'api_aggregation_queue', json.dumps(data).encode())
+
+
+async def rpc_incomes_request(future, data, current, totals=None):
+    incomes = totals_to_rows(totals, 'quantity') if totals is not None else [item.to_dict() for item in data]
+    data = {'incomes': incomes, 'current_currency': current, 'content': 'Incomes'}
+    return await conversion_request(future, data)
+
+
+async def rpc_purchases_request(future, data, current, totals=None):
+    purchases = totals_to_rows(totals, 'price') if totals is not None else [item.to_dict() for item in data]
+    data = {'purchases': purchases, 'current_currency': current, 'content': 'Purchases'}
+    return await conversion_request(future, data)
 
 
 async def rpc_report_request(future, data, current):
-    correlation_id = str(uuid.uuid4())
-    channel = await RabbitMQConnectionManager.get_channel('report_builder')
-    queue = await channel.declare_queue('report_queue', durable=True)
-    reply_queue = await channel.declare_queue('reply_report_queue', durable=True)
-    consumer_tag = await consume_response(reply_queue, correlation_id, future)
-    await send_message(channel, json.dumps(data).encode(), queue, reply_queue, correlation_id)
-    return reply_queue, consumer_tag
+    return await rpc_request(future, 'report_builder', 'report_queue', json.dumps(data).encode())
@@ -1,12 +1,60 @@
 import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
 from app.config import settings
+from app.metrics import stage
+
+
+class TimedPipeline(Pipeline):
+    '''Pipeline идет мимо execute_command: round trip меряем на execute'''
+    async def execute(self, raise_on_error: bool = True):
+        with stage('cache'):
+            return await super().execute(raise_on_error)
+
+
+class TimedRedis(redis.Redis):
+    '''Клиент, который записывает каждую команду и каждый pipeline в стадию cache текущего запроса'''
+    async def execute_command(self, *args, **options):
+        with stage('cache'):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> TimedPipeline:
+        return TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def make_client(**kwargs) -> TimedRedis:
+    '''Клиент с ограниченным пулом: при пике команды ждут соединение до REDIS_POOL_TIMEOUT,
+    а не открывают новые без предела; зависший Redis дает ошибку через REDIS_SOCKET_TIMEOUT'''
+    pool = redis.BlockingConnectionPool.from_url(
+        settings.redis_url,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        **kwargs)
+    return TimedRedis.from_pool(pool)  # пул принадлежит клиенту и закрывается вместе с ним
 
 
 class Redis:
     _redis = None
+    _binary_redis = None
 
     @classmethod
     async def get_redis(cls):
         if cls._redis is None:
-            cls._redis = redis.from_url(settings.redis_url, decode_responses=True)
-        return cls._redis
\ No newline at end of file
+            cls._redis = make_client(decode_responses=True)
+        return cls._redis
+
+    @classmethod
+    async def get_binary_redis(cls):
+        '''Клиент без декодирования ответов — для бинарных значений вроде PDF'''
+        if cls._binary_redis is None:
+            cls._binary_redis = make_client()
+        return cls._binary_redis
+
+    @classmethod
+    async def close(cls):
+        for client in (cls._redis, cls._binary_redis):
+            if client is not None:
+                await client.aclose()
+        cls._redis = cls._binary_redis = None
@@ -2,8 +2,9 @@ from fastapi import APIRouter, Depends, status, HTTPException
 from typing import Annotated
 from app.database.db_depends import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
 from app.schemas import CreateUser
-from app.database.db_functions import create_user_in_db, get_user
+from app.database.db_functions import create_user_in_db, get_user, get_user_claims, store_user_claims, user_claims
 from app.functions.email_validation import email_validation
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from app.functions.hashing import pass_hasher, pass_verify
@@ -30,7 +31,11 @@ async def create_user(db: Annotated[AsyncSession, Depends(get_db)], create_user:
         return {'status_code':status.HTTP_422_UNPROCESSABLE_ENTITY,
                 'transaction': 'Email address is not valid'}
     hashed_password = await pass_hasher(create_user.password)
-    await create_user_in_db(db, create_user, hashed_password)
+    try:
+        await create_user_in_db(db, create_user, hashed_password)
+    except IntegrityError:  # username и email уникальны
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail='Username or email already exists')
     return {'status_code':status.HTTP_201_CREATED,
             'transaction': 'User created successfully'}
 
@@ -49,6 +54,7 @@ async def login(db: Annotated[AsyncSession, Depends(get_db)],
                                       user.email, user.is_admin,
                                       expires_delta=timedelta(minutes=20))
     refresh_token = await create_refresh_token(user.username)
+    await store_user_claims(user_claims(user))  # следующий /auth/refresh обойдется без Postgres
     return {'access_token': token,
             'refresh_token': refresh_token,
             'token_type': 'bearer'}
@@ -57,15 +63,19 @@ async def login(db: Annotated[AsyncSession, Depends(get_db)],
 @router.post('/refresh')
 async def refresh_tokens(db: Annotated[AsyncSession, Depends(get_db)],
                         refresh_token: str):
-    username = await verify_refresh_token(refresh_token)
+    username, claims = await verify_refresh_token(refresh_token)
     if not username:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail='Invalid refresh token')
-    user = await get_user(db, username)
-    access_token = await create_access_token(user.id, user.username,
-                                             user.email, user.is_admin,
+    if claims is None:  # claims выпали из кеша или сняты invalidate_user_claims
+        claims = await get_user_claims(db, username)
+    if claims is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail='User is not exist')
+    access_token = await create_access_token(claims['user_id'], claims['username'],
+                                             claims['email'], claims['is_admin'],
                                              expires_delta=timedelta(minutes=20))
-    new_refresh_token = await create_refresh_token(user.username)
+    new_refresh_token = await create_refresh_token(claims['username'])
     return {'access_token': access_token,
             'refresh_token': new_refresh_token,
             'token_type': 'bearer'}
\ No newline at end of file
@@ -2,13 +2,18 @@ from fastapi import APIRouter, Depends, status, HTTPException
 from typing import Annotated
 from app.database.db_depends import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.schemas import CreateIncome, IncomeTimeLimits
+from app.schemas import CreateIncome, IncomeTimeLimits, KeysetPage
 from app.database.db_functions import (create_income_in_db, get_all_incomes_from_db,
                                        get_incomes_current_from_db, get_incomes_last_month_from_db,
-                                       get_incomes_in_time_limits_from_db, delete_incomes_form_db)
+                                       get_incomes_in_time_limits_from_db, get_incomes_totals_from_db,
+                                       get_incomes_page_from_db, stream_incomes_from_db,
+                                       delete_incomes_form_db)
 from app.functions.auth_functions import get_current_user
 from app.rabbitmq import rpc_incomes_request
-import asyncio, json
+from app.config import settings
+from app.functions.currency import currency_summary
+from starlette.responses import StreamingResponse
+import json
 
 
 router = APIRouter(prefix='/incomes', tags=['incomes'])
@@ -30,22 +35,11 @@ async def get_all_incomes(db: Annotated[AsyncSession, Depends(get_db)],
                           current: str | None = None):
     if current not in ('EUR', 'RUB', 'RSD', None):
         raise HTTPException(status_code=422, detail="Currency error: choose only EUR/RUB/RSD or leave this field blank")
-    future = asyncio.get_running_loop().create_future()
     raw_data = await get_all_incomes_from_db(db, user.get('user_id'))
-    reply_queue, consumer_tag = await rpc_incomes_request(future, raw_data, current)
-
-    try:
-        response = json.loads(await asyncio.wait_for(future, timeout=10))  # ждем ответа
-        # возвращаем ответ юзеру
-        return {'incomes': raw_data} | response
-    except asyncio.TimeoutError:
-        return {'incomes': raw_data,
-                'euro': "CurrentAggregator doesn't response",
-                'rub': "CurrentAggregator doesn't response",
-                'rsd': "CurrentAggregator doesn't response",
-                'answer': "CurrentAggregator doesn't response"}
-    finally:
-        await reply_queue.cancel(consumer_tag)  # сворачиваем канал
+    totals = (await get_incomes_totals_from_db(db, user.get('user_id'))
+              if settings.AGGREGATE_TOTALS_IN_DB else None)
+    summary = await currency_summary(raw_data, totals, current, 'quantity', rpc_incomes_request)
+    return {'incomes': raw_data} | summary
 
 
 @router.get('/incomes_current_month')
@@ -54,21 +48,11 @@ async def get_incomes_current_month(db: Annotated[AsyncSession, Depends(get_db)]
                                     current: str | None = None):
     if current not in ('EUR', 'RUB', 'RSD', None):
         raise HTTPException(status_code=422, detail="Currency error: choose only EUR/RUB/RSD or leave this field blank")
-    future = asyncio.get_running_loop().create_future()
     raw_data = await get_incomes_current_from_db(db, user.get('user_id'))
-    reply_queue, consumer_tag = await rpc_incomes_request(future, raw_data, current)
-
-    try:
-        response = json.loads(await asyncio.wait_for(future, timeout=10))
-        return {'incomes': raw_data} | response
-    except asyncio.TimeoutError:
-        return {'incomes': raw_data,
-                'euro': "CurrentAggregator doesn't response",
-                'rub': "CurrentAggregator doesn't response",
-                'rsd': "CurrentAggregator doesn't response",
-                'answer': "CurrentAggregator doesn't response"}
-    finally:
-        await reply_queue.cancel(consumer_tag)
+    totals = (await get_incomes_totals_from_db(db, user.get('user_id'), 'current')
+              if settings.AGGREGATE_TOTALS_IN_DB else None)
+    summary = await currency_summary(raw_data, totals, current, 'quantity', rpc_incomes_request)
+    return {'incomes': raw_data} | summary
 
 
 @router.get('/incomes_last_month')
@@ -77,21 +61,11 @@ async def get_incomes_last_month(db: Annotated[AsyncSession, Depends(get_db)],
                                  current: str | None = None):
     if current not in ('EUR', 'RUB', 'RSD', None):
         raise HTTPException(status_code=422, detail="Currency error: choose only EUR/RUB/RSD or leave this field blank")
-    future = asyncio.get_running_loop().create_future()
     raw_data = await get_incomes_last_month_from_db(db, user.get('user_id'))
-    reply_queue, consumer_tag = await rpc_incomes_request(future, raw_data, current)
-
-    try:
-        response = json.loads(await asyncio.wait_for(future, timeout=10))
-        return {'incomes': raw_data} | response
-    except asyncio.TimeoutError:
-        return {'incomes': raw_data,
-                'euro': "CurrentAggregator doesn't response",
-                'rub': "CurrentAggregator doesn't response",
-                'rsd': "CurrentAggregator doesn't response",
-                'answer': "CurrentAggregator doesn't response"}
-    finally:
-        await reply_queue.cancel(consumer_tag)
+    totals = (await get_incomes_totals_from_db(db, user.get('user_id'), 'last month')
+              if settings.AGGREGATE_TOTALS_IN_DB else None)
+    summary = await currency_summary(raw_data, totals, current, 'quantity', rpc_incomes_request)
+    return {'incomes': raw_data} | summary
 
 
 @router.get('/incomes_limits')
@@ -101,23 +75,34 @@ async def get_incomes_in_time_limits(db: Annotated[AsyncSession, Depends(get_db)
                                      current: str | None = None):
     if current not in ('EUR', 'RUB', 'RSD', None):
         raise HTTPException(status_code=422, detail="Currency error: choose only EUR/RUB/RSD or leave this field blank")
-    future = asyncio.get_running_loop().create_future()
     raw_data = await get_incomes_in_time_limits_from_db(db, user.get('user_id'),
                                                        date_limits.start_date,
                                                        date_limits.end_date)
-    reply_queue, consumer_tag = await rpc_incomes_request(future, raw_data, current)
-
-    try:
-        response = json.loads(await asyncio.wait_for(future, timeout=10))
-        return {'incomes': raw_data} | response
-    except asyncio.TimeoutError:
-        return {'incomes': raw_data,
-                'euro': "CurrentAggregator doesn't response",
-                'rub': "CurrentAggregator doesn't response",
-                'rsd': "CurrentAggregator doesn't response",
-                'answer': "CurrentAggregator doesn't response"}
-    finally:
-        await reply_queue.cancel(consumer_tag)
+    totals = (await get_incomes_totals_from_db(db, user.get('user_id'), 'limits',
+                                               date_limits.start_date, date_limits.end_date)
+              if settings.AGGREGATE_TOTALS_IN_DB else None)
+    summary = await currency_summary(raw_data, totals, current, 'quantity', rpc_incomes_request)
+    return {'incomes': raw_data} | summary
+
+
+@router.get('/incomes_page')
+async def get_incomes_page(db: Annotated[AsyncSession, Depends(get_db)],
+                           user: Annotated[dict, Depends(get_current_user)],
+                           page: Annotated[KeysetPage, Depends()]):
+    data = await get_incomes_page_from_db(db, user.get('user_id'), page.after_date,
+                                          page.after_id, page.limit)
+    last = data[-1] if len(data) == page.limit else None  # неполная страница — дальше ничего нет
+    return {'incomes': data,
+            'next_after_date': last.created_at if last else None,
+            'next_after_id': last.id if last else None}
+
+
+@router.get('/incomes_stream')
+async def stream_incomes(user: Annotated[dict, Depends(get_current_user)]):
+    async def ndjson():
+        async for income in stream_incomes_from_db(user.get('user_id')):
+            yield json.dumps(income.to_dict()) + '\n'
+    return StreamingResponse(ndjson(), media_type='application/x-ndjson')
 
 
 @router.delete('/delete_incomes', status_code=status.HTTP_200_OK)
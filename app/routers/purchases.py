@@ -1,14 +1,20 @@
-from fastapi import APIRouter, Depends, status, HTTPException
-from typing import Annotated
+from fastapi import APIRouter, Depends, status, HTTPException, Request
+from typing import Annotated, Literal
 from app.database.db_depends import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.functions.auth_functions import get_current_user
-from app.schemas import PurchasesListCreate, PurchaseTimeLimits
+from app.schemas import PurchasesListCreate, PurchaseTimeLimits, KeysetPage
 from app.database.db_functions import (create_purchases_list_in_db, get_all_purchases_from_db,
                                 get_purchases_current_week_from_db, get_purchases_in_limits_from_db,
-                                       delete_purchases_from_db)
+                                       get_purchases_totals_from_db, get_purchases_page_from_db,
+                                       stream_purchases_from_db, delete_purchases_from_db,
+                                       copy_purchases_to_db, get_all_categories_from_db)
 from app.rabbitmq import rpc_purchases_request
-import asyncio, json
+from app.config import settings
+from app.functions.currency import currency_summary
+from app.functions.statement_import import ImportStats, purchase_records
+from starlette.responses import StreamingResponse
+import json
 
 
 router = APIRouter(prefix='/purchases', tags=['purchases'])
@@ -23,27 +29,38 @@ async def new_list_purchases(db: Annotated[AsyncSession, Depends(get_db)],
             'transaction': 'Purchase created successfully'}
 
 
+@router.post('/import_purchases', status_code=status.HTTP_201_CREATED)
+async def import_purchases(db: Annotated[AsyncSession, Depends(get_db)],
+                           user: Annotated[dict, Depends(get_current_user)],
+                           request: Request,
+                           statement_format: Literal['csv', 'bank'] = 'csv',
+                           category_id: int | None = None):
+    '''Тело запроса — сам файл (curl --data-binary @history.csv), читается потоком'''
+    if statement_format == 'bank' and category_id is None:
+        raise HTTPException(status_code=422, detail="Bank statement import needs category_id")
+    categories = await get_all_categories_from_db(db, user.get('user_id'))
+    stats = ImportStats()
+    records = purchase_records(request.stream(), user.get('user_id'),
+                               {category.id for category in categories}, stats,
+                               statement_format, category_id)
+    try:
+        await copy_purchases_to_db(db, user.get('user_id'), records)
+    except ValueError as error:  # заголовок не того формата — ничего не загружено
+        raise HTTPException(status_code=422, detail=str(error))
+    return {'status_code': status.HTTP_201_CREATED} | stats.to_dict()
+
+
 @router.get('/all_purchases')
 async def get_all_purchases(db: Annotated[AsyncSession, Depends(get_db)],
                             user: Annotated[dict, Depends(get_current_user)],
                             current: str | None = None):
     if current not in ('EUR', 'RUB', 'RSD', None):
         raise HTTPException(status_code=422, detail="Currency error: choose only EUR/RUB/RSD or leave this field blank")
-    future = asyncio.get_running_loop().create_future()
     raw_data = await get_all_purchases_from_db(db, user.get('user_id'))
-    reply_queue, consumer_tag = await rpc_purchases_request(future, raw_data, current)
-
-    try:
-        response = json.loads(await asyncio.wait_for(future, timeout=10))  # ждем ответа
-        return {'purchases': raw_data} | response
-    except asyncio.TimeoutError:
-        return {'purchases': raw_data,
-                'euro': "CurrentAggregator doesn't response",
-                'rub': "CurrentAggregator doesn't response",
-                'rsd': "CurrentAggregator doesn't response",
-                'answer': "CurrentAggregator doesn't response"}
-    finally:
-        await reply_queue.cancel(consumer_tag)  # сворачиваем канал
+    totals = (await get_purchases_totals_from_db(db, user.get('user_id'))
+              if settings.AGGREGATE_TOTALS_IN_DB else None)
+    summary = await currency_summary(raw_data, totals, current, 'price', rpc_purchases_request)
+    return {'purchases': raw_data} | summary
 
 
 
@@ -53,21 +70,11 @@ async def get_last_7_days_purchases(db: Annotated[AsyncSession, Depends(get_db)]
                                      current: str | None = None):
     if current not in ('EUR', 'RUB', 'RSD', None):
         raise HTTPException(status_code=422, detail="Currency error: choose only EUR/RUB/RSD or leave this field blank")
-    future = asyncio.get_running_loop().create_future()
     raw_data = await get_purchases_current_week_from_db(db, user.get('user_id'))
-    reply_queue, consumer_tag = await rpc_purchases_request(future, raw_data, current)
-
-    try:
-        response = json.loads(await asyncio.wait_for(future, timeout=10))  # ждем ответа
-        return {'purchases': raw_data} | response
-    except asyncio.TimeoutError:
-        return {'purchases': raw_data,
-                'euro': "CurrentAggregator doesn't response",
-                'rub': "CurrentAggregator doesn't response",
-                'rsd': "CurrentAggregator doesn't response",
-                'answer': "CurrentAggregator doesn't response"}
-    finally:
-        await reply_queue.cancel(consumer_tag)  # сворачиваем канал
+    totals = (await get_purchases_totals_from_db(db, user.get('user_id'), 'week')
+              if settings.AGGREGATE_TOTALS_IN_DB else None)
+    summary = await currency_summary(raw_data, totals, current, 'price', rpc_purchases_request)
+    return {'purchases': raw_data} | summary
 
 
 @router.get('/purchases_limits')
@@ -77,23 +84,34 @@ async def get_purchases_in_limits(db: Annotated[AsyncSession, Depends(get_db)],
                                   current: str | None = None):
     if current not in ('EUR', 'RUB', 'RSD', None):
         raise HTTPException(status_code=422, detail="Currency error: choose only EUR/RUB/RSD or leave this field blank")
-    future = asyncio.get_running_loop().create_future()
     raw_data = await get_purchases_in_limits_from_db(db, user.get('user_id'),
                                                    date_limits.start_date,
                                                    date_limits.end_date)
-    reply_queue, consumer_tag = await rpc_purchases_request(future, raw_data, current)
-
-    try:
-        response = json.loads(await asyncio.wait_for(future, timeout=10))  # ждем ответа
-        return {'purchases': raw_data} | response
-    except asyncio.TimeoutError:
-        return {'purchases': raw_data,
-                'euro': "CurrentAggregator doesn't response",
-                'rub': "CurrentAggregator doesn't response",
-                'rsd': "CurrentAggregator doesn't response",
-                'answer': "CurrentAggregator doesn't response"}
-    finally:
-        await reply_queue.cancel(consumer_tag)  # сворачиваем канал
+    totals = (await get_purchases_totals_from_db(db, user.get('user_id'), 'limits',
+                                                 date_limits.start_date, date_limits.end_date)
+              if settings.AGGREGATE_TOTALS_IN_DB else None)
+    summary = await currency_summary(raw_data, totals, current, 'price', rpc_purchases_request)
+    return {'purchases': raw_data} | summary
+
+
+@router.get('/purchases_page')
+async def get_purchases_page(db: Annotated[AsyncSession, Depends(get_db)],
+                             user: Annotated[dict, Depends(get_current_user)],
+                             page: Annotated[KeysetPage, Depends()]):
+    data = await get_purchases_page_from_db(db, user.get('user_id'), page.after_date,
+                                            page.after_id, page.limit)
+    last = data[-1] if len(data) == page.limit else None  # неполная страница — дальше ничего нет
+    return {'purchases': data,
+            'next_after_date': last.created_at if last else None,
+            'next_after_id': last.id if last else None}
+
+
+@router.get('/purchases_stream')
+async def stream_purchases(user: Annotated[dict, Depends(get_current_user)]):
+    async def ndjson():
+        async for purchase in stream_purchases_from_db(user.get('user_id')):
+            yield json.dumps(purchase.to_dict()) + '\n'
+    return StreamingResponse(ndjson(), media_type='application/x-ndjson')
 
 
 @router.delete('/delete_purchases', status_code=status.HTTP_200_OK)
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, status
 import uuid, asyncio, io, json
 from starlette.responses import StreamingResponse
 from app.rabbitmq import rpc_report_request
@@ -7,46 +7,85 @@ from app.schemas import PurchaseTimeLimits
 from app.database.db_depends import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.functions.auth_functions import get_current_user
-from app.database.db_functions import (get_purchases_in_limits_from_db,
-                                       get_incomes_in_time_limits_from_db,
-                                       get_all_categories_from_db)
+from app.functions.report_cache import ReportCache, report_key
+from app.config import settings
+from app.functions.report_jobs import ReportJobs
+from app.metrics import stage
+from app.database.db_functions import get_report_rows_from_db
+from app.functions.periods import resolve_period
 
 
 router = APIRouter(prefix='/reports', tags=['reports'])
 
 
-@router.get('/report_ask')
-async def get_rab_report(db: Annotated[AsyncSession, Depends(get_db)],
-                         user: Annotated[dict, Depends(get_current_user)],
-                         date_limits: Annotated[PurchaseTimeLimits, Depends()],
-                         current: str | None = 'EUR'):
+async def collect_report_data(db, user_id, date_limits, current) -> dict:
     if current not in ('EUR', 'RUB', 'RSD', None):
         raise HTTPException(status_code=400, detail="Currency error: choose only EUR/RUB/RSD or leave this field blank")
 
-    #достаем данные из бд
-    purchases = await get_purchases_in_limits_from_db(db, user.get('user_id'),
-                                                      date_limits.start_date,
-                                                      date_limits.end_date)
-    incomes = await get_incomes_in_time_limits_from_db(db, user.get('user_id'),
-                                                       date_limits.start_date,
-                                                       date_limits.end_date)
-    categories = await get_all_categories_from_db(db, user.get('user_id'))
+    #достаем данные из кеша или бд: все три выборки одним MGET
+    period = resolve_period('limits', start_date=date_limits.start_date, end_date=date_limits.end_date)
+    purchases, incomes, categories = await get_report_rows_from_db(db, user_id, period)
 
     #собираем данные в один dict для отправки
-    data = {'purchases': [item.to_dict() for item in purchases],
+    return {'purchases': [item.to_dict() for item in purchases],
             'incomes': [item.to_dict() for item in incomes],
             'categories': [item.to_dict() for item in categories],
             'current_currency': current}
 
-    future = asyncio.get_running_loop().create_future() # гтовим футура для ответа
-    reply_queue, consumer_tag = await rpc_report_request(future, data, current) # отправляем данные
-
-    try:
-        response = await asyncio.wait_for(future, timeout=60) #ждем ответа
-        #возвращаем ответ юзеру
-        return StreamingResponse(io.BytesIO(response), media_type='application/pdf', headers = {
-        "Content-Disposition": "attachment; filename=example.pdf"})
-    except asyncio.TimeoutError:
-        raise HTTPException(status_code=504, detail="Timeout") #если ответ не пришел выдаем таймаут
-    finally:
-        await reply_queue.cancel(consumer_tag) #сворачиваем канал
+
+@router.get('/report_ask')
+async def get_rab_report(db: Annotated[AsyncSession, Depends(get_db)],
+                         user: Annotated[dict, Depends(get_current_user)],
+                         date_limits: Annotated[PurchaseTimeLimits, Depends()],
+                         current: str | None = 'EUR'):
+    data = await collect_report_data(db, user.get('user_id'), date_limits, current)
+
+    #тот же payload уже собирали — отдаем готовый PDF без report_builder
+    key = report_key(data)
+    response = await ReportCache.get(key)
+    if response is None:
+        future = asyncio.get_running_loop().create_future() # гтовим футура для ответа
+        await rpc_report_request(future, data, current) # отправляем данные
+        try:
+            with stage('rpc'):
+                response = await asyncio.wait_for(future, timeout=settings.REPORT_RPC_TIMEOUT) #ждем ответа
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Timeout") #если ответ не пришел выдаем таймаут
+        await ReportCache.put(key, response)
+
+    #возвращаем ответ юзеру
+    return StreamingResponse(io.BytesIO(response), media_type='application/pdf', headers = {
+    "Content-Disposition": "attachment; filename=example.pdf"})
+
+
+@router.post('/jobs', status_code=status.HTTP_202_ACCEPTED)
+async def create_report_job(db: Annotated[AsyncSession, Depends(get_db)],
+                            user: Annotated[dict, Depends(get_current_user)],
+                            date_limits: Annotated[PurchaseTimeLimits, Depends()],
+                            current: str | None = 'EUR'):
+    data = await collect_report_data(db, user.get('user_id'), date_limits, current)
+    return await ReportJobs.submit(user.get('user_id'), data, current)
+
+
+@router.get('/jobs/{job_id}')
+async def get_report_job(job_id: str, user: Annotated[dict, Depends(get_current_user)]):
+    job_status = await ReportJobs.status(job_id, user.get('user_id'))
+    if job_status is None:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    return {'job_id': job_id, 'status': job_status}
+
+
+@router.get('/jobs/{job_id}/pdf')
+async def get_report_job_pdf(job_id: str, user: Annotated[dict, Depends(get_current_user)]):
+    job_status = await ReportJobs.status(job_id, user.get('user_id'))
+    if job_status is None:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    if job_status == 'pending':
+        raise HTTPException(status_code=409, detail="Report is not ready yet")
+    if job_status == 'failed':
+        raise HTTPException(status_code=504, detail="Timeout")
+    response = await ReportJobs.pdf(job_id)
+    if response is None:  # PDF истек раньше статуса
+        raise HTTPException(status_code=404, detail="Report job not found")
+    return StreamingResponse(io.BytesIO(response), media_type='application/pdf', headers = {
+    "Content-Disposition": "attachment; filename=example.pdf"})
@@ -1,4 +1,5 @@
-from pydantic import BaseModel, field_validator, PositiveFloat
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, field_validator, model_validator, PositiveFloat, Field
 from datetime import date
 from pydantic.v1 import root_validator, validator
 
@@ -47,6 +48,23 @@ class PurchaseTimeLimits(IncomeTimeLimits):
     pass
 
 
+class KeysetPage(BaseModel):
+    after_date: date | None = None
+    after_id: int | None = None
+    limit: int = Field(default=100, ge=1, le=1000)
+
+    @model_validator(mode='after')
+    def check_cursor(self):
+        '''Курсор — пара (after_date, after_id): половина пары молча вернула бы первую страницу.
+        RequestValidationError, а не ValueError: модель собирается в Depends, и ValueError дал бы 500'''
+        if (self.after_date is None) != (self.after_id is None):
+            missing = 'after_id' if self.after_id is None else 'after_date'
+            raise RequestValidationError([{'type': 'missing', 'loc': ('query', missing),
+                                           'msg': 'after_date and after_id must be sent together',
+                                           'input': None}])
+        return self
+
+
 class PurchaseBase(BaseModel):
     name: str
     description: str
@@ -54,6 +72,12 @@ class PurchaseBase(BaseModel):
     currency: str
     category_id: int
 
+    @field_validator('currency')
+    def check_currency(cls, value):
+        if value not in ('EUR', 'RUB', 'RSD'):
+            raise ValueError('Currency error: choose only EUR/RUB/RSD')
+        return value
+
 
 class PurchasesListCreate(BaseModel):
     purchases: list[PurchaseBase]
@@ -0,0 +1 @@
+'''Нагрузочный прогон API: приложение в процессе, Postgres и Redis настоящие (или fakeredis), AMQP — в памяти'''
@@ -0,0 +1,116 @@
+'''Нагрузочный прогон: python -m loadtest --users 20 --duration 60 --out before.json
+
+Postgres — база из POSTGRES_* (отдельная, с примененными миграциями): юзеры прогона создаются
+с уникальным префиксом, чужие данные не трогаются. Redis — --redis-url или fakeredis,
+RabbitMQ и оба воркера — в памяти процесса с задержкой из --rpc-latency / --report-latency'''
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+from sqlalchemy import insert, select
+from app.config import settings
+from app.database.engine import session_factory
+from app.database.models import User, Category
+from app.functions.hashing import pass_hasher
+from app.main import app
+from . import stubs
+from .report import Recorder
+from .scenarios import PASSWORD, SCENARIOS, VirtualUser, prepare, run_user
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m loadtest', description='Load test of the NMNH API')
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma-separated subset of: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=1, help='random seed of the scenario mix')
+    parser.add_argument('--batch', type=int, default=100, help='purchases per bulk insert')
+    parser.add_argument('--seed-purchases', type=int, default=1000, help='purchases per user before the run')
+    parser.add_argument('--seed-incomes', type=int, default=20, help='incomes per user before the run')
+    parser.add_argument('--redis-url', help='real Redis; fakeredis when omitted')
+    parser.add_argument('--rpc-latency', type=float, default=0.02, help='currency_aggregator reply delay, s')
+    parser.add_argument('--report-latency', type=float, default=0.3, help='report_builder reply delay, s')
+    parser.add_argument('--conversion', choices=('local', 'rpc'), default=settings.CURRENCY_CONVERSION)
+    parser.add_argument('--timeout', type=float, default=60, help='HTTP client timeout, s')
+    parser.add_argument('--out', help='JSON report path; stdout when omitted')
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios.split(',')) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+    return args
+
+
+async def seed_users(run_id: str, count: int) -> tuple[list[str], int]:
+    '''Юзеры прогона напрямую в базе: один argon2-хеш на всех, без внешней проверки email'''
+    hashed_password = await pass_hasher(PASSWORD)
+    usernames = [f'loadtest-{run_id}-{i}' for i in range(count)]
+    async with session_factory() as db:
+        await db.execute(insert(User), [{'firstname': 'Load', 'lastname': 'Test', 'username': username,
+                                         'email': f'{username}@loadtest.local',
+                                         'hashed_password': hashed_password} for username in usernames])
+        category_id = await db.scalar(select(Category.id).where(Category.is_root.is_(True)).limit(1))
+        if category_id is None:
+            category_id = await db.scalar(insert(Category).values(category_name='Loadtest', is_root=True)
+                                          .returning(Category.id))
+        await db.commit()
+    return usernames, category_id
+
+
+async def wait_ready(client, timeout: float) -> float:
+    '''Холодный старт: от входа в lifespan до первого 200 на /ready'''
+    start = time.monotonic()
+    while (await client.get('/ready')).status_code != 200:
+        if time.monotonic() - start > timeout:
+            raise SystemExit('The app did not become ready: check Postgres and Redis')
+        await asyncio.sleep(0.01)
+    return time.monotonic() - start
+
+
+async def run(args: argparse.Namespace) -> dict:
+    settings.CURRENCY_CONVERSION = args.conversion
+    run_id = uuid.uuid4().hex[:8]
+    started_at = datetime.now(timezone.utc).isoformat()
+    recorder = Recorder()
+    await stubs.install(args.redis_url, args.rpc_latency, args.report_latency)
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)  # падение — это 500 в отчете
+    # остановка lifespan закрывает пулы, каналы и процессы хеширования
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url='http://loadtest',
+                                     timeout=args.timeout) as client:
+            cold_start = await wait_ready(client, args.timeout)
+            usernames, category_id = await seed_users(run_id, args.users)
+            users = [VirtualUser(client, recorder, username, category_id,
+                                 random.Random(f'{args.seed}-{i}'), args.batch)
+                     for i, username in enumerate(usernames)]
+            recorder.enabled = False
+            await asyncio.gather(*(prepare(user, args.seed_purchases, args.seed_incomes) for user in users))
+            recorder.enabled = True
+            start = time.monotonic()
+            await asyncio.gather(*(run_user(user, args.scenarios.split(','), start + args.duration)
+                                   for user in users))
+            elapsed = time.monotonic() - start
+    config = {key: value for key, value in vars(args).items() if key not in ('out', 'redis_url')}
+    config['redis'] = 'redis' if args.redis_url else 'fakeredis'
+    return {'run_id': run_id, 'started_at': started_at, 'config': config,
+            'cold_start_s': round(cold_start, 3), **recorder.report(elapsed)}
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    result = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.out:
+        with open(args.out, 'w') as file:
+            file.write(result + '\n')
+    else:
+        sys.stdout.write(result + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+'''Сравнение двух отчетов: python -m loadtest.compare before.json after.json'''
+import json
+import sys
+from .report import compare
+
+
+def main(argv=None) -> None:
+    before_path, after_path = (argv or sys.argv[1:])[:2]
+    with open(before_path) as before, open(after_path) as after:
+        rows = compare(json.load(before), json.load(after))
+    print(f'{"endpoint":<36}{"rps":>20}{"p95 ms":>22}{"p95 Δ%":>10}')
+    for row in rows:
+        rps = f'{row["rps"][0]} -> {row["rps"][1]}'
+        p95 = f'{row["p95_ms"][0]} -> {row["p95_ms"][1]}'
+        change = '' if row['p95_change'] is None else f'{row["p95_change"]:+}'
+        print(f'{row["endpoint"]:<36}{rps:>20}{p95:>22}{change:>10}')
+
+
+if __name__ == '__main__':
+    main()
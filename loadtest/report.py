@@ -0,0 +1,58 @@
+import math
+from collections import defaultdict
+
+
+def percentile(samples: list[float], q: float) -> float:
+    '''Перцентиль по ближайшему рангу: на тех же замерах всегда одно и то же число'''
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+class Recorder:
+    '''Замеры по эндпоинтам: латентность каждого запроса и число ошибок'''
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.enabled = True
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        if not self.enabled:  # прогрев и наполнение базы в отчет не попадают
+            return
+        self.samples[endpoint].append(seconds)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            endpoints[endpoint] = {'requests': len(samples),
+                                   'errors': self.errors[endpoint],
+                                   'rps': round(len(samples) / elapsed, 2),
+                                   'mean_ms': round(sum(samples) / len(samples) * 1000, 2),
+                                   'p50_ms': round(percentile(samples, 50) * 1000, 2),
+                                   'p95_ms': round(percentile(samples, 95) * 1000, 2),
+                                   'p99_ms': round(percentile(samples, 99) * 1000, 2),
+                                   'max_ms': round(max(samples) * 1000, 2)}
+        total = sum(item['requests'] for item in endpoints.values())
+        return {'elapsed_s': round(elapsed, 2),
+                'requests': total,
+                'errors': sum(item['errors'] for item in endpoints.values()),
+                'rps': round(total / elapsed, 2) if elapsed else 0.0,
+                'endpoints': endpoints}
+
+
+def compare(before: dict, after: dict) -> list[dict]:
+    '''Две выгрузки отчета -> изменение rps и p95 по каждому эндпоинту, который есть в обеих'''
+    rows = []
+    for endpoint, old in before['endpoints'].items():
+        new = after['endpoints'].get(endpoint)
+        if new is None:
+            continue
+        rows.append({'endpoint': endpoint,
+                     'rps': (old['rps'], new['rps']),
+                     'p95_ms': (old['p95_ms'], new['p95_ms']),
+                     'p95_change': round((new['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100, 1)
+                     if old['p95_ms'] else None})
+    return rows
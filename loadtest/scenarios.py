@@ -0,0 +1,108 @@
+import time
+from datetime import date, timedelta
+from .report import Recorder
+
+
+PASSWORD = 'loadtest-password'
+CURRENCIES = ('EUR', 'RUB', 'RSD')
+
+
+class VirtualUser:
+    '''Один юзер нагрузки: свой токен и генератор случайных чисел, общие клиент и Recorder'''
+    def __init__(self, client, recorder: Recorder, username: str, category_id: int, rng, batch: int):
+        self.client = client
+        self.recorder = recorder
+        self.username = username
+        self.category_id = category_id
+        self.rng = rng
+        self.batch = batch
+        self.token = None
+
+    async def call(self, endpoint: str, method: str, url: str, **kwargs):
+        headers = {'Authorization': f'Bearer {self.token}'} if self.token else {}
+        start = time.perf_counter()
+        response = await self.client.request(method, url, headers=headers, **kwargs)
+        self.recorder.record(endpoint, time.perf_counter() - start, response.status_code < 400)
+        return response
+
+
+def month_limits() -> dict:
+    today = date.today()
+    return {'start_date': (today - timedelta(days=30)).isoformat(), 'end_date': today.isoformat()}
+
+
+async def login(user: VirtualUser) -> None:
+    response = await user.call('POST /auth/token', 'POST', '/auth/token',
+                               data={'username': user.username, 'password': PASSWORD})
+    if response.status_code == 200:
+        user.token = response.json()['access_token']
+
+
+async def bulk_insert(user: VirtualUser, size: int | None = None) -> None:
+    rng = user.rng
+    purchases = [{'name': f'item {rng.randrange(1000)}',
+                  'description': 'loadtest',
+                  'price': round(rng.uniform(1, 500), 2),
+                  'currency': rng.choice(CURRENCIES),
+                  'category_id': user.category_id} for _ in range(size or user.batch)]
+    await user.call('POST /purchases/new_purchases', 'POST', '/purchases/new_purchases',
+                    json={'purchases': purchases})
+
+
+async def new_income(user: VirtualUser) -> None:
+    await user.call('POST /incomes/new_income', 'POST', '/incomes/new_income',
+                    json={'description': 'salary',
+                          'quantity': round(user.rng.uniform(100, 5000), 2),
+                          'currency': user.rng.choice(CURRENCIES)})
+
+
+async def list_purchases(user: VirtualUser) -> None:
+    await user.call('GET /purchases/all_purchases', 'GET', '/purchases/all_purchases',
+                    params={'current': user.rng.choice(CURRENCIES)})
+
+
+async def list_incomes(user: VirtualUser) -> None:
+    await user.call('GET /incomes/all_your_incomes', 'GET', '/incomes/all_your_incomes',
+                    params={'current': user.rng.choice(CURRENCIES)})
+
+
+async def purchases_page(user: VirtualUser) -> None:
+    await user.call('GET /purchases/purchases_page', 'GET', '/purchases/purchases_page',
+                    params={'limit': 100})
+
+
+async def purchases_limits(user: VirtualUser) -> None:
+    await user.call('GET /purchases/purchases_limits', 'GET', '/purchases/purchases_limits',
+                    params=month_limits() | {'current': user.rng.choice(CURRENCIES)})
+
+
+async def report(user: VirtualUser) -> None:
+    await user.call('GET /reports/report_ask', 'GET', '/reports/report_ask', params=month_limits())
+
+
+# сценарий -> (вес, функция): в основном чтение списков, изредка запись, логин и отчет
+SCENARIOS = {'login': (2, login),
+             'bulk_insert': (5, bulk_insert),
+             'new_income': (3, new_income),
+             'list_purchases': (25, list_purchases),
+             'list_incomes': (20, list_incomes),
+             'purchases_page': (20, purchases_page),
+             'purchases_limits': (20, purchases_limits),
+             'report': (5, report)}
+
+
+async def prepare(user: VirtualUser, purchases: int, incomes: int) -> None:
+    '''Логин и стартовые данные юзера; Recorder в это время выключен'''
+    await login(user)
+    for start in range(0, purchases, user.batch):
+        await bulk_insert(user, min(user.batch, purchases - start))
+    for _ in range(incomes):
+        await new_income(user)
+
+
+async def run_user(user: VirtualUser, scenarios: list[str], deadline: float) -> None:
+    '''Сценарии подряд без пауз до дедлайна; порядок задается генератором юзера, а значит seed'''
+    weights = [SCENARIOS[name][0] for name in scenarios]
+    while time.monotonic() < deadline:
+        name = user.rng.choices(scenarios, weights=weights)[0]
+        await SCENARIOS[name][1](user)
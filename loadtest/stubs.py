@@ -0,0 +1,119 @@
+import asyncio
+import json
+import uuid
+from app.functions.currency import CurrencyRates, CURRENCY_FIELDS, RATES_KEY, convert_totals
+from app.rabbitmq import RabbitMQConnectionManager, RPCReplyConsumer
+from app.redis import Redis, TimedRedis
+
+
+RATES = {'EUR': 1.0, 'RUB': 95.0, 'RSD': 117.0}  # фиксированные курсы: прогоны сравнимы между собой
+
+
+def aggregate_currency(payload: dict) -> bytes:
+    '''Ответ как у currency_aggregator: сумма строк в EUR/RUB/RSD и в валюте запроса'''
+    if 'batch' in payload:  # RPC_BATCHING: ответ на каждый запрос пачки по его id
+        return json.dumps({'results': {item['id']: json.loads(aggregate_currency(item))
+                                       for item in payload['batch']}}).encode()
+    rows = payload.get('purchases') or payload.get('incomes') or []
+    amount_field = 'price' if 'purchases' in payload else 'quantity'
+    totals = dict.fromkeys(CURRENCY_FIELDS, 0.0)
+    for row in rows:
+        totals[row.get('currency') or 'EUR'] += row[amount_field] or 0
+    return json.dumps(convert_totals(totals, RATES, payload.get('current_currency'))).encode()
+
+
+def build_report(payload: dict) -> bytes:
+    '''Вместо report_builder — PDF-заглушка, размер которой растет с числом строк, как у настоящего'''
+    rows = len(payload['purchases']) + len(payload['incomes'])
+    return b'%PDF-1.4\n' + b'0' * (1024 + 64 * rows) + b'\n%%EOF\n'
+
+
+RESPONDERS = {'api_aggregation_queue': aggregate_currency,
+              'report_queue': build_report}
+
+
+class FakeIncomingMessage:
+    def __init__(self, body: bytes, correlation_id: str):
+        self.body = body
+        self.correlation_id = correlation_id
+
+    async def ack(self):
+        pass
+
+
+class FakeQueue:
+    def __init__(self, channel, name: str):
+        self.channel = channel
+        self.name = name
+
+    async def consume(self, callback):
+        self.channel.consumers[self.name] = callback
+        return f'ctag-{self.name}'
+
+
+class FakeExchange:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def publish(self, message, routing_key):
+        task = asyncio.create_task(self.channel.respond(routing_key, message))
+        self.channel.tasks.add(task)
+        task.add_done_callback(self.channel.tasks.discard)
+
+
+class FakeChannel:
+    '''Канал aio_pika в памяти: default exchange, очереди ответов и воркеры с заданной задержкой'''
+    def __init__(self, latency: dict[str, float]):
+        self.latency = latency
+        self.consumers = {}
+        self.tasks = set()
+        self.is_closed = False
+        self.default_exchange = FakeExchange(self)
+
+    async def declare_queue(self, name=None, **kwargs):
+        return FakeQueue(self, name or f'amq.gen-{uuid.uuid4()}')
+
+    async def respond(self, queue: str, message):
+        await asyncio.sleep(self.latency.get(queue, 0))
+        answer = RESPONDERS[queue](json.loads(message.body))
+        consumer = self.consumers.get(message.reply_to)
+        if consumer is not None:
+            await consumer(FakeIncomingMessage(answer, message.correlation_id))
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.is_closed = True
+
+
+async def connect_redis(redis_url: str | None) -> None:
+    '''Настоящий Redis по URL, иначе fakeredis — общий сервер для текстового и бинарного клиента'''
+    if redis_url:
+        Redis._redis = TimedRedis.from_url(redis_url, decode_responses=True)
+        Redis._binary_redis = TimedRedis.from_url(redis_url)
+        return
+    try:
+        from fakeredis import FakeServer
+        from fakeredis.aioredis import FakeRedis
+    except ImportError:
+        raise SystemExit('Redis is required: pass --redis-url or install fakeredis')
+    server = FakeServer()
+    Redis._redis = FakeRedis(server=server, decode_responses=True)
+    Redis._binary_redis = FakeRedis(server=server)
+
+
+async def install(redis_url: str | None, rpc_latency: float, report_latency: float) -> FakeChannel:
+    '''Подменяет внешние сервисы: Redis, RabbitMQ с обоими воркерами и API курсов валют'''
+    await connect_redis(redis_url)
+    channel = FakeChannel({'api_aggregation_queue': rpc_latency, 'report_queue': report_latency})
+    RPCReplyConsumer.reset()
+    for name in ('currency_aggregator', 'report_builder'):
+        RabbitMQConnectionManager._channels[name] = channel  # get_channel отдаст его, не подключаясь
+
+    async def open_channel():
+        return channel
+    RabbitMQConnectionManager.open_channel = open_channel  # и пул каналов для публикации тоже
+    redis = await Redis.get_redis()
+    await redis.set(RATES_KEY, json.dumps(RATES))  # CurrencyRates.load не пойдет во внешний API
+    CurrencyRates._rates = dict(RATES)
+    return channel
@@ -6,7 +6,7 @@ from sqlalchemy.ext.asyncio import async_engine_from_config
 from alembic import context
 from app.database.engine import Base
 from app.config import settings
-from app.database.models import Category, User, Purchase, Income
+from app.database.models import Category, User, Purchase, Income, MonthlyPurchaseTotal, MonthlyIncomeTotal
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -0,0 +1,52 @@
+"""owner created_at indexes
+
+Revision ID: 5e2c9a71d4b8
+Revises: 0b11dce8fe9c
+Create Date: 2026-10-18 12:04:31.522418
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e2c9a71d4b8'
+down_revision: Union[str, Sequence[str], None] = '0b11dce8fe9c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    with op.get_context().autocommit_block():
+        op.create_index('ix_purchases_owner_id_created_at', 'purchases',
+                        ['owner_id', 'created_at'], unique=False,
+                        postgresql_include=['price', 'currency'],
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_incomes_owner_id_created_at', 'incomes',
+                        ['owner_id', 'created_at'], unique=False,
+                        postgresql_include=['quantity', 'currency'],
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_categories_owner_id', 'categories',
+                        ['owner_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_categories_is_root', 'categories',
+                        ['is_root'], unique=False,
+                        postgresql_where=sa.text('is_root IS true'),
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_categories_is_root', table_name='categories',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_categories_owner_id', table_name='categories',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_incomes_owner_id_created_at', table_name='incomes',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_purchases_owner_id_created_at', table_name='purchases',
+                      postgresql_concurrently=True, if_exists=True)
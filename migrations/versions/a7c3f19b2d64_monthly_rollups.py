@@ -0,0 +1,64 @@
+"""monthly rollups
+
+Revision ID: a7c3f19b2d64
+Revises: 5e2c9a71d4b8
+Create Date: 2026-10-18 15:22:08.130944
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c3f19b2d64'
+down_revision: Union[str, Sequence[str], None] = '5e2c9a71d4b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('monthly_purchase_totals',
+                    sa.Column('owner_id', sa.Integer(), nullable=False),
+                    sa.Column('month', sa.Date(), nullable=False),
+                    sa.Column('category_id', sa.Integer(), nullable=False),
+                    sa.Column('currency', sa.String(), nullable=False),
+                    sa.Column('sum', sa.Float(), nullable=False),
+                    sa.Column('count', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ),
+                    sa.PrimaryKeyConstraint('owner_id', 'month', 'category_id', 'currency'))
+    op.create_table('monthly_income_totals',
+                    sa.Column('owner_id', sa.Integer(), nullable=False),
+                    sa.Column('month', sa.Date(), nullable=False),
+                    sa.Column('currency', sa.String(), nullable=False),
+                    sa.Column('sum', sa.Float(), nullable=False),
+                    sa.Column('count', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ),
+                    sa.PrimaryKeyConstraint('owner_id', 'month', 'currency'))
+
+    # backfill по всей истории; строки, записанные старым кодом после миграции,
+    # досчитывает python -m app.database.check_rollups --repair
+    op.execute("""
+        INSERT INTO monthly_purchase_totals (owner_id, month, category_id, currency, sum, count)
+        SELECT owner_id, date_trunc('month', created_at)::date, COALESCE(category_id, 0),
+               COALESCE(currency, 'EUR'), SUM(price), COUNT(*)
+        FROM purchases
+        WHERE owner_id IS NOT NULL AND created_at IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+    """)
+    op.execute("""
+        INSERT INTO monthly_income_totals (owner_id, month, currency, sum, count)
+        SELECT owner_id, date_trunc('month', created_at)::date, COALESCE(currency, 'EUR'),
+               SUM(quantity), COUNT(*)
+        FROM incomes
+        WHERE owner_id IS NOT NULL AND created_at IS NOT NULL
+        GROUP BY 1, 2, 3
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('monthly_income_totals')
+    op.drop_table('monthly_purchase_totals')
@@ -0,0 +1,47 @@
+"""users username unique
+
+Revision ID: c41e8a7f9b03
+Revises: a7c3f19b2d64
+Create Date: 2026-10-18 18:41:15.208734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41e8a7f9b03'
+down_revision: Union[str, Sequence[str], None] = 'a7c3f19b2d64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    duplicates = bind.execute(sa.text('SELECT username FROM users GROUP BY username '
+                                      'HAVING count(*) > 1 ORDER BY username LIMIT 10')).scalars().all()
+    if duplicates:
+        raise RuntimeError('users.username has duplicates, resolve them before this migration: '
+                           + ', '.join(duplicates))
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    with op.get_context().autocommit_block():
+        # упавшая сборка CONCURRENTLY оставляет INVALID индекс, который уникальность не проверяет:
+        # сносим его и строим заново, а не пропускаем через IF NOT EXISTS
+        invalid = bind.execute(sa.text("SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+                                       "WHERE pg_class.relname = 'ix_users_username' "
+                                       "AND NOT pg_index.indisvalid")).first()
+        if invalid is not None:
+            op.drop_index('ix_users_username', table_name='users', postgresql_concurrently=True)
+        op.create_index('ix_users_username', 'users',
+                        ['username'], unique=True,
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_users_username', table_name='users',
+                      postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,124 @@
+from datetime import timedelta
+
+import jwt
+import pytest
+from redis.crc import key_slot
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from unittest.mock import AsyncMock, Mock
+from app.config import settings
+from app.database.db_depends import get_db
+from app.database.db_functions import invalidate_user_claims
+from app.database.db_functions.db_user import user_claims_key
+from app.database.models import User
+from app.functions import auth_functions
+from app.functions.auth_functions import (ClaimsCache, create_access_token, get_current_user,
+                                          create_refresh_token, verify_refresh_token, refresh_token_key)
+from app.main import app
+
+
+@pytest.fixture(autouse=True)
+def clean_claims_cache():
+    ClaimsCache.clear()
+    yield
+    ClaimsCache.clear()
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_caches_claims(monkeypatch):
+    token = await create_access_token(123, 'test_username', 'test@gmail.com', False,
+                                      expires_delta=timedelta(minutes=20))
+    decode = Mock(wraps=jwt.decode)
+    monkeypatch.setattr(auth_functions.jwt, 'decode', decode)
+
+    first = await get_current_user(token)
+    second = await get_current_user(token)
+
+    assert first == second == {'user_id': 123,
+                               'username': 'test_username',
+                               'email': 'test@gmail.com',
+                               'is_admin': False,
+                               'expire': True}
+    assert decode.call_count == 1  # второй вызов без проверки подписи
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("token, detail", [
+    (jwt.encode({'user_id': 1, 'exp': 1}, settings.secret_key, algorithm=settings.algorithm), 'Token expired'),
+    (jwt.encode({'user_id': 1, 'exp': 2**40}, 'another_key', algorithm=settings.algorithm), 'Invalid token'),
+    ('not.a.token', 'Invalid token'),
+])
+async def test_get_current_user_rejects_bad_tokens(token, detail):
+    with pytest.raises(HTTPException) as error:
+        await get_current_user(token)
+    assert error.value.status_code == 401
+    assert error.value.detail == detail
+
+
+@pytest.mark.asyncio
+async def test_claims_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(settings, 'JWT_CLAIMS_CACHE_SIZE', 2)
+    for user_id in range(3):
+        token = await create_access_token(user_id, 'name', 'mail', False, expires_delta=timedelta(minutes=20))
+        await get_current_user(token)
+    assert len(ClaimsCache._claims) == 2
+
+
+@pytest.fixture
+def auth_client():
+    async def fake_db():
+        yield AsyncMock()
+    app.dependency_overrides[get_db] = fake_db
+    with TestClient(app) as client:
+        yield client
+    app.dependency_overrides = {}
+
+
+@pytest.mark.asyncio
+async def test_refresh_reads_claims_from_redis(fake_redis, monkeypatch, auth_client):
+    user = User(id=123, username='test_username', email='test@gmail.com', is_admin=False)
+    get_user = AsyncMock(return_value=user)
+    monkeypatch.setattr('app.database.db_functions.db_user.get_user', get_user)
+    refresh_token = await create_refresh_token('test_username')
+
+    first = auth_client.post('/auth/refresh', params={'refresh_token': refresh_token})
+    second = auth_client.post('/auth/refresh', params={'refresh_token': first.json()['refresh_token']})
+    await invalidate_user_claims('test_username')
+    third = auth_client.post('/auth/refresh', params={'refresh_token': second.json()['refresh_token']})
+
+    assert [response.status_code for response in (first, second, third)] == [200, 200, 200]
+    assert get_user.await_count == 2  # промах в самом начале и после инвалидации, второй refresh — только Redis
+    assert (await get_current_user(third.json()['access_token']))['user_id'] == 123
+
+
+@pytest.mark.asyncio
+async def test_verify_refresh_token_is_one_round_trip(fake_redis, monkeypatch):
+    refresh_token = await create_refresh_token('test_username')
+    mget = AsyncMock(wraps=fake_redis.mget)
+    get = AsyncMock(wraps=fake_redis.get)
+    monkeypatch.setattr(fake_redis, 'mget', mget)
+    monkeypatch.setattr(fake_redis, 'get', get)
+
+    assert await verify_refresh_token(refresh_token) == ('test_username', None)
+    assert await verify_refresh_token('not.a.token') == (None, None)
+    await fake_redis.delete(refresh_token_key('test_username', refresh_token))
+    assert await verify_refresh_token(refresh_token) == (None, None)  # отозванный токен
+    assert (mget.await_count, get.await_count) == (2, 1)  # GET — только поиск отозванного токена по старому ключу
+
+
+@pytest.mark.asyncio
+async def test_refresh_keys_share_cluster_slot(fake_redis):
+    refresh_token = await create_refresh_token('test_username')
+    keys = [refresh_token_key('test_username', refresh_token), user_claims_key('test_username')]
+
+    assert len({key_slot(key.encode()) for key in keys}) == 1  # иначе MGET в Redis Cluster — CROSSSLOT
+    assert keys[0] in fake_redis.data
+
+
+@pytest.mark.asyncio
+async def test_refresh_token_issued_before_hash_tag_still_works(fake_redis):
+    refresh_token = await create_refresh_token('test_username')
+    fake_redis.data[f'refresh_token: {refresh_token}'] = fake_redis.data.pop(refresh_token_key('test_username',
+                                                                                              refresh_token))
+
+    assert await verify_refresh_token(refresh_token) == ('test_username', None)
@@ -0,0 +1,347 @@
+import asyncio
+import json
+import os
+import time
+from datetime import date, timedelta
+
+import pytest
+import redis.asyncio as redis
+from unittest.mock import AsyncMock
+from app.config import settings
+from app.redis import Redis
+from app.database.db_functions.db_cache import (versioned_key, bump_generation, cached, cached_many,
+                                                cache_ttl, should_refresh, SingleFlight)
+from app.database.db_functions.db_codec import encode, decode
+from app.database.db_functions import (get_purchases_in_period_from_db, get_incomes_in_period_from_db,
+                                       get_all_categories_from_db, get_report_rows_from_db)
+from app.functions.periods import resolve_period
+from app.database.read_models import PurchaseRead, to_columns, from_columns
+from app.database.models import Purchase
+
+
+@pytest.mark.asyncio
+async def test_bump_generation_hides_old_keys(fake_redis):
+    old_key = await versioned_key(fake_redis, 123, 'incomes', 'all')
+    await fake_redis.set(old_key, 'cached')
+
+    await bump_generation(123, 'incomes')
+
+    new_key = await versioned_key(fake_redis, 123, 'incomes', 'all')
+    assert new_key != old_key
+    assert await fake_redis.get(new_key) is None
+    # кеш другой сущности и другого юзера не затронут
+    assert await versioned_key(fake_redis, 123, 'purchases', 'all') == '{123}: purchases: v0: all'
+    assert await versioned_key(fake_redis, 456, 'incomes', 'all') == '{456}: incomes: v0: all'
+
+
+def slow_loader(value, delay=0.05):
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return value
+    return load, calls
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_load_once(fake_redis):
+    load, calls = slow_loader([{'id': 1}])
+
+    results = await asyncio.gather(*(cached(123, 'incomes', 'all', load) for _ in range(50)))
+
+    assert calls == [1]
+    assert all(result == [{'id': 1}] for result in results)
+    assert await fake_redis.get('{123}: incomes: v0: all: lock') is None  # lock снят
+
+
+@pytest.mark.asyncio
+async def test_miss_waits_for_other_worker(fake_redis):
+    # lock держит другой воркер: ждем его значение, а не идем в базу
+    await fake_redis.set('{123}: incomes: v0: all: lock', 'other worker')
+    load, calls = slow_loader(['mine'])
+
+    async def other_worker():
+        await asyncio.sleep(0.1)
+        entry = {'value': ['theirs'], 'delta': 0.1, 'expiry': time.time() + 180}
+        await fake_redis.set('{123}: incomes: v0: all', encode(entry))
+
+    result, _ = await asyncio.gather(cached(123, 'incomes', 'all', load), other_worker())
+
+    assert result == ['theirs']
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_early_refresh_serves_stale_while_other_worker_refreshes(fake_redis, monkeypatch):
+    # розыгрыш XFetch фиксирован: пересчет всегда, тест не зависит от random
+    monkeypatch.setattr('app.database.db_functions.db_cache.should_refresh', lambda entry: True)
+    entry = {'value': ['old'], 'delta': 1.0, 'expiry': time.time() + 1}
+    await fake_redis.set('{123}: incomes: v0: all', encode(entry))
+    load, calls = slow_loader(['new'])
+
+    await fake_redis.set('{123}: incomes: v0: all: lock', 'other worker')
+    assert await cached(123, 'incomes', 'all', load) == ['old']
+    await fake_redis.delete('{123}: incomes: v0: all: lock')
+    assert await cached(123, 'incomes', 'all', load) == ['new']
+    assert calls == [1]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_batch_misses_share_single_flight(fake_redis, monkeypatch):
+    wait_for_value = AsyncMock()
+    monkeypatch.setattr('app.database.db_functions.db_cache.wait_for_value', wait_for_value)
+    purchases, purchase_calls = slow_loader(['purchases'])
+    incomes, income_calls = slow_loader(['incomes'])
+    items = [('purchases', 'all', purchases), ('incomes', 'all', incomes)]
+
+    results = await asyncio.gather(*(cached_many(123, items) for _ in range(5)))
+
+    assert results == [[['purchases'], ['incomes']]] * 5
+    assert (purchase_calls, income_calls) == ([1], [1])
+    wait_for_value.assert_not_awaited()  # ждали future в воркере, а не опрашивали Redis
+    assert SingleFlight._inflight == {}
+
+
+@pytest.mark.asyncio
+async def test_cached_many_mixes_hits_misses_and_foreign_locks(fake_redis):
+    entry = {'value': ['cached categories'], 'delta': 0.01, 'expiry': time.time() + 180}
+    await fake_redis.set('{123}: categories: v0: all', encode(entry))
+    await fake_redis.set('{123}: purchases: v0: all: lock', 'other worker')
+    incomes, income_calls = slow_loader(['loaded incomes'], delay=0)
+    purchases, purchase_calls = slow_loader(['mine'], delay=0)
+    categories, category_calls = slow_loader(['never'], delay=0)
+
+    async def other_worker():
+        await asyncio.sleep(0.1)
+        entry = {'value': ['their purchases'], 'delta': 0.1, 'expiry': time.time() + 180}
+        await fake_redis.set('{123}: purchases: v0: all', encode(entry))
+
+    values, _ = await asyncio.gather(
+        cached_many(123, [('purchases', 'all', purchases), ('incomes', 'all', incomes),
+                          ('categories', 'all', categories)]),
+        other_worker())
+
+    assert values == [['their purchases'], ['loaded incomes'], ['cached categories']]
+    assert (purchase_calls, income_calls, category_calls) == ([], [1], [])
+    assert decode(fake_redis.data['{123}: incomes: v0: all'])['value'] == ['loaded incomes']
+    assert fake_redis.data['{123}: purchases: v0: all: lock'] == 'other worker'  # чужой lock не трогаем
+
+
+class FakeSession:
+    def __init__(self, opened):
+        self.opened = opened
+
+    async def __aenter__(self):
+        self.opened.append(self)
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_sessions(monkeypatch):
+    '''Сессии, которые открывает get_report_rows_from_db под каждую выборку'''
+    opened = []
+    monkeypatch.setattr('app.database.db_functions.db_report.session_factory', lambda: FakeSession(opened))
+    return opened
+
+
+@pytest.mark.asyncio
+async def test_report_rows_load_concurrently(fake_redis, fake_sessions, monkeypatch):
+    async def slow_rows(db, query, model):
+        await asyncio.sleep(0.2)
+        return to_columns([], model)
+
+    for module in ('db_purchases', 'db_income', 'db_category'):
+        monkeypatch.setattr(f'app.database.db_functions.{module}.load_rows', slow_rows)
+    period = resolve_period('limits', start_date=date(2025, 1, 1), end_date=date(2025, 1, 31))
+
+    start = time.monotonic()
+    purchases, incomes, categories = await get_report_rows_from_db(None, 123, period)
+    elapsed = time.monotonic() - start
+
+    assert (purchases, incomes, categories) == ([], [], [])
+    assert elapsed < 0.4  # самая медленная выборка, а не сумма трех
+    assert len(set(map(id, fake_sessions))) == 3  # одна AsyncSession на выборку
+    assert not [key for key in fake_redis.data if key.endswith(': lock')]
+
+
+class CountingPipeline:
+    def __init__(self, pipeline, counter):
+        self.pipeline = pipeline
+        self.counter = counter
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            getattr(self.pipeline, name)(*args, **kwargs)
+            return self
+        return command
+
+    async def execute(self):
+        self.counter.round_trips += 1
+        return await self.pipeline.execute()
+
+
+class RoundTrips:
+    '''Прокси над FakeRedis: каждая команда и каждый pipeline.execute — один round trip'''
+    def __init__(self, fake):
+        self.fake = fake
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return CountingPipeline(self.fake.pipeline(transaction), self)
+
+    def __getattr__(self, name):
+        command = getattr(self.fake, name)
+
+        async def counted(*args, **kwargs):
+            self.round_trips += 1
+            return await command(*args, **kwargs)
+        return counted
+
+
+@pytest.mark.asyncio
+async def test_report_round_trips(fake_redis, fake_sessions, monkeypatch):
+    '''Бенчмарк round trip в Redis на данные одного отчета: три cached подряд против cached_many'''
+    counter = RoundTrips(fake_redis)
+    monkeypatch.setattr(Redis, '_redis', counter)
+    monkeypatch.setattr(Redis, '_binary_redis', counter)
+    for module in ('db_purchases', 'db_income', 'db_category'):
+        monkeypatch.setattr(f'app.database.db_functions.{module}.load_rows',
+                            AsyncMock(side_effect=lambda db, query, model: to_columns([], model)))
+    period = resolve_period('limits', start_date=date(2025, 1, 1), end_date=date(2025, 1, 31))
+
+    async def one_by_one():
+        await get_purchases_in_period_from_db(None, 1, period)
+        await get_incomes_in_period_from_db(None, 1, period)
+        await get_all_categories_from_db(None, 1)
+
+    round_trips = {}
+    for name, report in (('one by one', one_by_one),
+                         ('cached_many', lambda: get_report_rows_from_db(None, 2, period))):
+        for state in ('miss', 'hit'):
+            counter.round_trips = 0
+            await report()
+            round_trips[f'{name}, {state}'] = counter.round_trips
+    print(round_trips)
+
+    assert round_trips == {'one by one, miss': 18, 'one by one, hit': 6,
+                           'cached_many, miss': 6, 'cached_many, hit': 2}
+    assert not [key for key in fake_redis.data if key.endswith(': lock')]  # все lock сняты
+
+
+def test_ttl_jitter_and_refresh_probability(monkeypatch):
+    ttls = {cache_ttl() for _ in range(100)}
+    assert all(settings.CACHE_TTL <= ttl <= settings.CACHE_TTL * (1 + settings.CACHE_TTL_JITTER) for ttl in ttls)
+    assert len(ttls) > 1
+
+    fresh = {'delta': 0.01, 'expiry': time.time() + 150}
+    near_expiry = {'delta': 1.0, 'expiry': time.time() + 0.5}
+    assert not any(should_refresh(fresh) for _ in range(100))
+    assert sum(should_refresh(near_expiry) for _ in range(1000)) > 300
+    monkeypatch.setattr(settings, 'CACHE_EARLY_REFRESH_BETA', 0.0)
+    assert not any(should_refresh(near_expiry) for _ in range(100))
+
+
+def purchase_rows(count):
+    return [{'id': i, 'name': f'item {i}', 'description': 'Groceries', 'price': i % 500 + 0.99,
+             'currency': ('EUR', 'RUB', 'RSD')[i % 3], 'owner_id': 123, 'category_id': i % 12 + 1,
+             'created_at': (date(2023, 1, 1) + timedelta(days=i % 1000)).isoformat()} for i in range(count)]
+
+
+def test_codec_roundtrip_into_read_models(monkeypatch):
+    rows = purchase_rows(500)
+    entry = {'value': to_columns(rows, PurchaseRead), 'delta': 0.01, 'expiry': 1.0}
+
+    data = encode(entry)
+    small = encode({'value': to_columns(rows[:2], PurchaseRead), 'delta': 0.01, 'expiry': 1.0})
+
+    assert data[:1] == b'Z' and small[:1] == b'J'  # сжимаются только большие значения
+    assert len(data) * 5 < len(json.dumps(rows))
+    purchases = from_columns(decode(data)['value'], PurchaseRead)
+    assert [item.to_dict() for item in purchases] == rows
+    assert decode(json.dumps(rows).encode()) is None  # старый формат — промах
+
+
+# Микробенчмарк кодека, например:
+# BENCH_CODEC=1 pytest tests/test_cache.py -s -k codec_benchmark
+# С BENCH_REDIS_URL дополнительно печатает MEMORY USAGE ключа в живом Redis
+@pytest.mark.asyncio
+@pytest.mark.skipif(os.getenv('BENCH_CODEC') is None, reason='BENCH_CODEC is not set')
+@pytest.mark.parametrize('count', [1_000, 10_000, 100_000])
+async def test_codec_benchmark(count):
+    rows = purchase_rows(count)
+
+    def timed(func, repeat=5):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        return result, (time.perf_counter() - start) / repeat * 1000
+
+    old, old_encode = timed(lambda: json.dumps(rows))
+    _, old_decode = timed(lambda: [Purchase.from_json(item) for item in json.loads(old)])
+    entry = {'value': to_columns(rows, PurchaseRead), 'delta': 0.01, 'expiry': 1.0}
+    new, new_encode = timed(lambda: encode(entry))
+    _, new_decode = timed(lambda: from_columns(decode(new)['value'], PurchaseRead))
+
+    memory = {}
+    if BENCH_REDIS_URL is not None:
+        client = redis.from_url(BENCH_REDIS_URL)
+        try:
+            for name, value in (('json', old), ('codec', new)):
+                await client.set(f'bench: codec: {name}', value)
+                memory[name] = await client.memory_usage(f'bench: codec: {name}')
+            await client.delete('bench: codec: json', 'bench: codec: codec')
+        finally:
+            await client.aclose()
+
+    print(f'{count} rows: json+ORM {len(old) / 1024:,.0f} KiB, encode {old_encode:.1f} ms, '
+          f'decode {old_decode:.1f} ms | codec {len(new) / 1024:,.0f} KiB, encode {new_encode:.1f} ms, '
+          f'decode {new_decode:.1f} ms | redis memory {memory}')
+    assert len(new) < len(old)
+    assert new_decode < old_decode
+
+
+# Бенчмарк инвалидации против живого Redis, например:
+# BENCH_REDIS_URL=redis://:password@localhost:6379/15 pytest tests/test_cache.py -s
+BENCH_REDIS_URL = os.getenv('BENCH_REDIS_URL')
+UNRELATED_KEYS = 1_000_000
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(BENCH_REDIS_URL is None, reason='BENCH_REDIS_URL is not set')
+async def test_write_invalidation_latency_with_1m_keys(monkeypatch):
+    client = redis.from_url(BENCH_REDIS_URL, decode_responses=True)
+    monkeypatch.setattr(Redis, '_redis', client)
+    try:
+        for start in range(0, UNRELATED_KEYS, 10_000):
+            await client.mset({f'bench: unrelated: {i}': 'x' for i in range(start, start + 10_000)})
+        await client.set('{bench}: incomes: v0: all', 'cached')
+
+        async def scan_unlink():
+            async for key in client.scan_iter('{bench}: incomes:*'):
+                await client.unlink(key)
+
+        timings = {}
+        for name, invalidate in (('scan + unlink', scan_unlink),
+                                 ('generation incr', lambda: bump_generation('bench', 'incomes'))):
+            start = time.perf_counter()
+            for _ in range(10):
+                await invalidate()
+            timings[name] = (time.perf_counter() - start) / 10
+        print({name: f'{seconds * 1000:.2f} ms' for name, seconds in timings.items()})
+
+        assert timings['generation incr'] * 10 < timings['scan + unlink']
+    finally:
+        for pattern in ('bench:*', '{bench}:*'):
+            async for key in client.scan_iter(pattern, count=10_000):
+                await client.unlink(key)
+        await client.aclose()
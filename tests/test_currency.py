@@ -0,0 +1,95 @@
+import pytest
+import pytest_asyncio
+from unittest.mock import AsyncMock
+from app.database.models import Income
+from app.functions.currency import (CurrencyRates, parse_rates, sum_by_currency,
+                                    convert_totals, currency_summary)
+
+
+RATES = {'EUR': 1.0, 'RUB': 100.0, 'RSD': 117.0}
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def clean_rates():
+    CurrencyRates._rates = {}
+    yield
+    await CurrencyRates.stop()
+    CurrencyRates._rates = {}
+
+
+def test_parse_rates_rebases_to_euro():
+    assert parse_rates({'base': 'USD', 'rates': {'EUR': 0.5, 'RUB': 50, 'RSD': 58.5, 'GBP': 0.4}}) == RATES
+    assert parse_rates({'rates': {'RUB': 100, 'RSD': 117}}) == RATES
+
+
+@pytest.mark.parametrize("data, message", [
+    ({'base': 'USD', 'rates': {'RUB': 50, 'RSD': 58.5}}, 'no rate for EUR'),
+    ({'rates': {'RUB': 100}}, 'no rate for RSD'),
+    ({'error': 'quota exceeded'}, 'no rates'),
+])
+def test_parse_rates_rejects_incomplete_response(data, message):
+    with pytest.raises(ValueError, match=message):
+        parse_rates(data)
+
+
+def test_convert_rows_locally():
+    rows = [Income(quantity=100, currency='EUR'),
+            Income(quantity=1000, currency='RUB'),
+            Income(quantity=1170, currency='RSD')]
+    totals = sum_by_currency(rows, 'quantity')
+    assert totals == {'EUR': 100, 'RUB': 1000, 'RSD': 1170}
+    assert convert_totals(totals, RATES, 'RUB') == {'euro': 120.0, 'rub': 12000.0,
+                                                    'rsd': 14040.0, 'answer': 12000.0}
+    assert convert_totals(totals, RATES, None)['answer'] == 120.0
+
+
+def test_unknown_and_null_currencies_do_not_break_conversion():
+    rows = [Income(quantity=100, currency='EUR'),
+            Income(quantity=50, currency=None),
+            Income(quantity=5, currency='usd')]
+    totals = sum_by_currency(rows, 'quantity')
+    assert totals == {'EUR': 150, 'RUB': 0, 'RSD': 0}  # NULL — EUR, usd не входит
+    assert convert_totals({'EUR': 100.0, 'usd': 5.0, None: 50.0}, RATES, 'EUR')['answer'] == 150.0
+
+
+@pytest.mark.asyncio
+async def test_rates_fetched_once_and_shared_through_redis(fake_redis, monkeypatch):
+    fetch = AsyncMock(return_value=RATES)
+    monkeypatch.setattr(CurrencyRates, 'fetch', fetch)
+
+    assert await CurrencyRates.get_rates() == RATES
+    CurrencyRates._rates = {}  # другой воркер: в памяти пусто, в Redis уже есть
+    assert await CurrencyRates.get_rates() == RATES
+    fetch.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_summary_when_rates_unavailable(fake_redis, monkeypatch):
+    monkeypatch.setattr(CurrencyRates, 'fetch', AsyncMock(side_effect=OSError('rate api down')))
+    summary = await currency_summary([], {'EUR': 1.0}, 'EUR', 'quantity', AsyncMock())
+    assert summary['answer'] == 'Currency rates are unavailable'
+
+
+@pytest.mark.asyncio
+async def test_rate_api_failures_are_backed_off(fake_redis, monkeypatch):
+    fetch = AsyncMock(side_effect=OSError('rate api down'))
+    monkeypatch.setattr(CurrencyRates, 'fetch', fetch)
+    for _ in range(5):
+        summary = await currency_summary([], {'EUR': 1.0}, 'EUR', 'quantity', AsyncMock())
+        assert summary['answer'] == 'Currency rates are unavailable'
+    assert fetch.await_count == 1  # остальные запросы в паузе после неудачи в API не ходят
+
+    CurrencyRates._retry_at = 0.0  # пауза истекла
+    fetch.side_effect = None
+    fetch.return_value = RATES
+    assert await CurrencyRates.get_rates() == RATES
+    assert (fetch.await_count, CurrencyRates._failures) == (2, 0)
+
+
+@pytest.mark.asyncio
+async def test_refresh_keeps_last_good_rates(fake_redis, monkeypatch):
+    CurrencyRates._rates = dict(RATES)
+    monkeypatch.setattr(CurrencyRates, 'fetch', AsyncMock(side_effect=ValueError('Rate API response has no rates')))
+    with pytest.raises(ValueError):
+        await CurrencyRates.load()
+    assert await CurrencyRates.get_rates() == RATES
@@ -0,0 +1,75 @@
+import asyncio
+
+import httpx
+import pytest
+from email_validator import EmailUndeliverableError
+from app.config import settings
+from app.functions.email_validation import EmailProvider, email_validation, address_key, domain_key
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    '''Abstract API на httpx.MockTransport: ответ задается тестом, запросы считаются'''
+    state = {'calls': 0, 'answer': {'deliverability': 'DELIVERABLE'}, 'delay': 0}
+
+    async def handler(request):
+        state['calls'] += 1
+        await asyncio.sleep(state['delay'])
+        return httpx.Response(200, json=state['answer'])
+
+    monkeypatch.setattr(EmailProvider, '_client', httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(EmailProvider, '_failures', 0)
+    monkeypatch.setattr(EmailProvider, '_open_until', 0.0)
+    monkeypatch.setattr('app.functions.email_validation.validate_email_deliverability',
+                        lambda domain, domain_i18n, timeout: {'mx': [(10, f'mx.{domain}')]})
+    return state
+
+
+@pytest.mark.asyncio
+async def test_bad_syntax_never_leaves_process(fake_redis, provider):
+    assert await email_validation('not an email') is False
+    assert await email_validation('user@@gmail.com') is False
+    assert provider['calls'] == 0
+
+
+@pytest.mark.asyncio
+async def test_provider_verdict_is_cached(fake_redis, provider):
+    assert await email_validation('Test@Gmail.com') is True
+    assert await email_validation('Test@gmail.com') is True  # домен нормализуется, ключ тот же
+
+    assert provider['calls'] == 1
+    assert fake_redis.data[address_key('Test@gmail.com')] == '1'
+    assert fake_redis.data[domain_key('gmail.com')] == '1'
+
+
+@pytest.mark.asyncio
+async def test_domain_without_mail_is_rejected_locally(fake_redis, provider, monkeypatch):
+    def no_mx(domain, domain_i18n, timeout):
+        raise EmailUndeliverableError(f'The domain name {domain} does not accept email.')
+
+    monkeypatch.setattr('app.functions.email_validation.validate_email_deliverability', no_mx)
+
+    assert await email_validation('user@no-mail-here.com') is False
+    assert provider['calls'] == 0
+    assert fake_redis.data[domain_key('no-mail-here.com')] == '0'
+
+
+@pytest.mark.asyncio
+async def test_broken_answer_fails_open_without_cache(fake_redis, provider):
+    provider['answer'] = {'error': 'quota exceeded'}  # раньше тут падал KeyError и 500 на регистрации
+
+    assert await email_validation('test@gmail.com') is True
+    assert address_key('test@gmail.com') not in fake_redis.data
+
+
+@pytest.mark.asyncio
+async def test_slow_provider_opens_breaker(fake_redis, provider, monkeypatch):
+    monkeypatch.setattr(settings, 'EMAIL_VALIDATION_TIMEOUT', 0.01)
+    monkeypatch.setattr(settings, 'EMAIL_BREAKER_FAILURES', 2)
+    provider['delay'] = 0.1
+
+    results = [await email_validation(f'user{i}@gmail.com') for i in range(5)]
+
+    assert results == [True] * 5
+    assert provider['calls'] == 2  # после двух таймаутов провайдера больше не ждем
+    assert EmailProvider.is_open()
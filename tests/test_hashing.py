@@ -0,0 +1,27 @@
+import pytest
+from fastapi import HTTPException
+from app.config import settings
+from app.functions.hashing import HashingPool, pass_hasher, pass_verify
+
+
+@pytest.fixture(scope='module', autouse=True)
+def hashing_pool():
+    yield
+    HashingPool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_hash_and_verify_in_pool():
+    hash_str = await pass_hasher('secret')
+    assert await pass_verify(hash_str, 'secret') is True
+    assert await pass_verify(hash_str, 'wrong') is False
+    assert HashingPool._backlog == 0
+
+
+@pytest.mark.asyncio
+async def test_backlog_overflow_returns_503(monkeypatch):
+    monkeypatch.setattr(settings, 'HASH_MAX_BACKLOG', 0)
+    with pytest.raises(HTTPException) as error:
+        await pass_hasher('secret')
+    assert error.value.status_code == 503
+    assert HashingPool._backlog == 0
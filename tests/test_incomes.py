@@ -1,9 +1,14 @@
+import json
+from datetime import date
+
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, ANY
 from app.database.db_depends import get_db
 from app.functions.auth_functions import get_current_user
 from app.main import app
+from app.config import settings
+from app.database.models import Income
 
 
 client = TestClient(app)
@@ -27,6 +32,12 @@ def override_get_current_user():
     return fake_user
 
 
+@pytest.fixture(autouse=True)
+def rpc_conversion(monkeypatch):
+    # Большинство тестов проверяют путь через currency_aggregator
+    monkeypatch.setattr(settings, 'CURRENCY_CONVERSION', 'rpc')
+
+
 @pytest.fixture
 def client_with_overrides(override_get_db, override_get_current_user):
     app.dependency_overrides[get_db] = override_get_db
@@ -106,11 +117,13 @@ fake_result = [{ # Объект для замены результата ДБе
                 }]
 
 
-async def mock_rpc_request(future, raw_data, current):
+async def mock_rpc_request(future, raw_data, current, totals=None):
     '''Мок RPC функции'''
     future.set_result('{"euro": 100, "rub": 10000, "rsd": 11700, "answer": 300}')
-    mock_queue = AsyncMock()
-    return mock_queue, "consumer_tag"
+    return 'correlation_id'
+
+
+mock_get_totals = AsyncMock(return_value={'EUR': 1600.0, 'RUB': 0.0, 'RSD': 0.0})
 
 
 @pytest.mark.asyncio
@@ -121,6 +134,7 @@ async def test_get_all_incomes_success(monkeypatch, client_with_overrides):
     # patch dependencies
     monkeypatch.setattr("app.routers.incomes.get_all_incomes_from_db", mock_get_all_incomes_from_db)
     monkeypatch.setattr("app.routers.incomes.rpc_incomes_request", mock_rpc_request)
+    monkeypatch.setattr("app.routers.incomes.get_incomes_totals_from_db", mock_get_totals)
 
     # Запрос
     response = client_with_overrides.get("/incomes/all_your_incomes")
@@ -154,6 +168,7 @@ async def test_incomes_current_month(monkeypatch, client_with_overrides):
     # Заменяем запвисимости
     monkeypatch.setattr('app.routers.incomes.get_incomes_current_from_db', mock_get_incomes_current_from_db)
     monkeypatch.setattr('app.routers.incomes.rpc_incomes_request', mock_rpc_request)
+    monkeypatch.setattr('app.routers.incomes.get_incomes_totals_from_db', mock_get_totals)
 
     # Запрос
     response = client_with_overrides.get("/incomes/incomes_current_month")
@@ -187,6 +202,7 @@ async def test_get_incomes_in_time_limits(monkeypatch, client_with_overrides):
     # Заменяем запвисимости
     monkeypatch.setattr('app.routers.incomes.get_incomes_in_time_limits_from_db', mock_get_incomes_in_time_limits)
     monkeypatch.setattr('app.routers.incomes.rpc_incomes_request', mock_rpc_request)
+    monkeypatch.setattr('app.routers.incomes.get_incomes_totals_from_db', mock_get_totals)
 
     # Запрос
     response = client_with_overrides.get("/incomes/incomes_limits")
@@ -216,3 +232,92 @@ async def test_get_incomes_in_time_limits_validation(start_date, end_date, curre
     response = client_with_overrides.get("/incomes/incomes_limits",
                                          params={"current": current, "start_date": start_date, "end_date": end_date})
     assert response.status_code == expected_status
+
+
+@pytest.mark.asyncio
+async def test_get_incomes_page(monkeypatch, client_with_overrides):
+    # Полная страница — отдаем курсор на следующую
+    mock_get_page = AsyncMock(return_value=[Income.from_json(item) for item in fake_result])
+    monkeypatch.setattr('app.routers.incomes.get_incomes_page_from_db', mock_get_page)
+
+    response = client_with_overrides.get("/incomes/incomes_page",
+                                         params={"after_date": "2025-01-01", "after_id": 7, "limit": 3})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["id"] for item in data["incomes"]] == [item["id"] for item in fake_result]
+    assert data["next_after_date"] == fake_result[-1]["created_at"]
+    assert data["next_after_id"] == fake_result[-1]["id"]
+    mock_get_page.assert_awaited_once_with(ANY, 123, date(2025, 1, 1), 7, 3)
+
+
+@pytest.mark.asyncio
+async def test_get_incomes_last_page(monkeypatch, client_with_overrides):
+    # Неполная страница — курсора нет
+    mock_get_page = AsyncMock(return_value=[Income.from_json(fake_result[0])])
+    monkeypatch.setattr('app.routers.incomes.get_incomes_page_from_db', mock_get_page)
+
+    response = client_with_overrides.get("/incomes/incomes_page")
+
+    assert response.status_code == 200
+    assert response.json()["next_after_id"] is None
+    mock_get_page.assert_awaited_once_with(ANY, 123, None, None, 100)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("limit, expected_status", [
+    (0, 422),
+    (1001, 422),
+])
+async def test_get_incomes_page_validation(limit, expected_status, client_with_overrides):
+    response = client_with_overrides.get("/incomes/incomes_page", params={"limit": limit})
+    assert response.status_code == expected_status
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("params", [{"after_id": 7}, {"after_date": "2025-01-01"}])
+async def test_get_incomes_page_needs_full_cursor(params, monkeypatch, client_with_overrides):
+    # половина курсора — 422, а не первая страница заново
+    mock_get_page = AsyncMock(return_value=[])
+    monkeypatch.setattr('app.routers.incomes.get_incomes_page_from_db', mock_get_page)
+
+    response = client_with_overrides.get("/incomes/incomes_page", params=params)
+
+    assert response.status_code == 422
+    mock_get_page.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_stream_incomes(monkeypatch, client_with_overrides):
+    async def fake_stream(owner_id):
+        for item in fake_result:
+            yield Income.from_json(item)
+    monkeypatch.setattr('app.routers.incomes.stream_incomes_from_db', fake_stream)
+
+    response = client_with_overrides.get("/incomes/incomes_stream")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == fake_result
+
+
+@pytest.mark.asyncio
+async def test_get_all_incomes_local_conversion(monkeypatch, client_with_overrides):
+    monkeypatch.setattr(settings, 'CURRENCY_CONVERSION', 'local')
+    monkeypatch.setattr(settings, 'AGGREGATE_TOTALS_IN_DB', False)
+    monkeypatch.setattr('app.routers.incomes.get_all_incomes_from_db',
+                        AsyncMock(return_value=[Income.from_json(item) for item in fake_result]))
+    monkeypatch.setattr('app.functions.currency.CurrencyRates.get_rates',
+                        AsyncMock(return_value={'EUR': 1.0, 'RUB': 100.0, 'RSD': 117.0}))
+    mock_rpc = AsyncMock()
+    monkeypatch.setattr('app.routers.incomes.rpc_incomes_request', mock_rpc)
+
+    response = client_with_overrides.get("/incomes/all_your_incomes", params={"current": "RSD"})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["euro"] == 1600
+    assert data["rub"] == 160000
+    assert data["rsd"] == data["answer"] == 187200
+    mock_rpc.assert_not_awaited()  # без похода в брокер
@@ -0,0 +1,72 @@
+import time
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from app import lifespan
+from app.lifespan import Readiness
+from app.main import app
+
+
+@pytest.fixture
+def services(monkeypatch):
+    '''Прогрев и остановка без настоящих Postgres, Redis и RabbitMQ'''
+    warmups = {name: AsyncMock() for name in lifespan.WARMUP_STEPS}
+    closers = [(name, AsyncMock()) for name, _ in lifespan.SHUTDOWN_STEPS]
+    for name, step in warmups.items():
+        monkeypatch.setitem(lifespan.WARMUP_STEPS, name, step)
+    monkeypatch.setattr(lifespan, 'SHUTDOWN_STEPS', tuple(closers))
+    monkeypatch.setattr(Readiness, '_first_response', False)
+    return warmups, dict(closers)
+
+
+def wait_ready(client, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = client.get('/ready')
+        if response.status_code == 200:
+            return response
+        time.sleep(0.01)
+    return response
+
+
+def test_ready_after_warm_up_and_clean_shutdown(services):
+    warmups, closers = services
+
+    with TestClient(app) as client:
+        response = wait_ready(client)
+
+    assert response.json() == {'ready': True,
+                               'dependencies': {'database': 'ok', 'redis': 'ok', 'rabbitmq': 'ok'}}
+    for step in warmups.values():
+        step.assert_awaited_once()
+    for step in closers.values():
+        step.assert_awaited_once()
+    assert not Readiness.is_ready()
+    assert REGISTRY.get_sample_value('app_cold_start_seconds') > 0
+
+
+def test_not_ready_until_failed_dependency_recovers(services):
+    warmups, _ = services
+    warmups['redis'].side_effect = [ConnectionError('redis is down'), None]
+
+    with TestClient(app) as client:
+        first = client.get('/ready')
+        recovered = wait_ready(client)
+
+    assert first.status_code == 503
+    assert first.json()['dependencies']['redis'] == 'pending'
+    assert recovered.status_code == 200
+    assert warmups['redis'].await_count == 2
+
+
+def test_failed_shutdown_step_does_not_skip_the_rest(services):
+    _, closers = services
+    closers['rabbitmq'].side_effect = RuntimeError('channel is gone')
+
+    with TestClient(app) as client:
+        wait_ready(client)
+
+    assert closers['redis'].await_count == 1
+    assert closers['database'].await_count == 1
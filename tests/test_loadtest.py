@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+import pytest
+from unittest.mock import AsyncMock
+from app.rabbitmq import RabbitMQConnectionManager, RPCReplyConsumer, rpc_purchases_request, rpc_report_request
+from loadtest.report import Recorder, percentile, compare
+from loadtest.stubs import FakeChannel, aggregate_currency
+
+
+def test_percentile_nearest_rank():
+    samples = [i / 1000 for i in range(1, 101)]  # 1..100 мс
+
+    assert percentile(samples[::-1], 50) == 0.05
+    assert percentile(samples, 99) == 0.099
+    assert percentile(samples, 100) == 0.1
+    assert percentile([], 95) == 0.0
+
+
+def test_recorder_report_and_compare():
+    recorder = Recorder()
+    recorder.enabled = False
+    recorder.record('POST /auth/token', 1.0, True)  # прогрев не считается
+    recorder.enabled = True
+    for seconds in (0.01, 0.02, 0.03, 0.04):
+        recorder.record('GET /purchases/all_purchases', seconds, True)
+    recorder.record('GET /purchases/all_purchases', 0.5, False)
+
+    before = recorder.report(elapsed=2)
+    after = json.loads(json.dumps(before))
+    after['endpoints']['GET /purchases/all_purchases']['p95_ms'] = 250.0
+
+    assert list(before['endpoints']) == ['GET /purchases/all_purchases']
+    assert before['endpoints']['GET /purchases/all_purchases'] == {
+        'requests': 5, 'errors': 1, 'rps': 2.5, 'mean_ms': 120.0,
+        'p50_ms': 30.0, 'p95_ms': 500.0, 'p99_ms': 500.0, 'max_ms': 500.0}
+    assert compare(before, after)[0]['p95_change'] == -50.0
+
+
+@pytest.fixture
+def fake_workers(monkeypatch):
+    channel = FakeChannel({'api_aggregation_queue': 0.01, 'report_queue': 0.01})
+    RPCReplyConsumer.reset()
+    monkeypatch.setattr(RabbitMQConnectionManager, '_channels',
+                        {'currency_aggregator': channel, 'report_builder': channel})
+    monkeypatch.setattr(RabbitMQConnectionManager, 'open_channel', AsyncMock(return_value=channel))
+    monkeypatch.setattr(RabbitMQConnectionManager, '_pool', [])
+    monkeypatch.setattr(RabbitMQConnectionManager, '_pool_slots', None)
+    yield channel
+    RPCReplyConsumer.reset()
+
+
+@pytest.mark.asyncio
+async def test_fake_workers_answer_like_real_ones(fake_workers):
+    loop = asyncio.get_running_loop()
+    totals, report = loop.create_future(), loop.create_future()
+
+    await rpc_purchases_request(totals, None, 'RUB', {'EUR': 10.0, 'RUB': 950.0, 'RSD': 0.0})
+    await rpc_report_request(report, {'purchases': [{}] * 3, 'incomes': []}, 'EUR')
+
+    assert json.loads(await asyncio.wait_for(totals, 1)) == {'euro': 20.0, 'rub': 1900.0,
+                                                             'rsd': 2340.0, 'answer': 1900.0}
+    assert (await asyncio.wait_for(report, 1)).startswith(b'%PDF')
+
+
+def test_fake_aggregator_answers_batches():
+    item = {'purchases': [{'price': 10.0, 'currency': 'EUR'}], 'current_currency': 'EUR'}
+
+    answer = json.loads(aggregate_currency({'batch': [item | {'id': 'a'}, item | {'id': 'b'}]}))
+
+    assert answer['results']['a'] == answer['results']['b'] == json.loads(aggregate_currency(item))
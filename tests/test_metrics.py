@@ -0,0 +1,59 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from redis.asyncio.client import Pipeline
+from app.main import app
+from app.functions.auth_functions import create_access_token
+from app.functions.report_jobs import ReportJobs
+from app.metrics import request_stages
+from app.redis import make_client
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.mark.asyncio
+async def test_metrics_use_route_template_and_stages(fake_redis):
+    template = '/reports/jobs/{job_id}'
+    token = await create_access_token(123, 'test_username', 'test@gmail.com', False, timedelta(minutes=5))
+    await ReportJobs.save('job_1', 123, 'pending')
+    before = {'count': sample('http_requests_total', method='GET', path=template, status='200'),
+              'auth': sample('http_request_stage_duration_seconds_count', path=template, stage='auth'),
+              'serialize': sample('http_request_stage_duration_seconds_count', path=template, stage='serialize')}
+
+    with TestClient(app) as client:
+        for job_id in ('job_1', 'job_1'):
+            response = client.get(f'/reports/jobs/{job_id}', headers={'Authorization': f'Bearer {token}'})
+            assert response.status_code == 200
+        client.get('/no/such/path')
+
+    assert sample('http_requests_total', method='GET', path=template, status='200') == before['count'] + 2
+    # сырой путь с id не становится отдельной серией
+    assert sample('http_requests_total', method='GET', path='/reports/jobs/job_1', status='200') == 0
+    assert sample('http_requests_total', method='GET', path='unmatched', status='404') >= 1
+    assert sample('http_request_stage_duration_seconds_count', path=template, stage='auth') == before['auth'] + 2
+    assert sample('http_request_stage_duration_seconds_count', path=template, stage='serialize') == before['serialize'] + 2
+
+
+@pytest.mark.asyncio
+async def test_redis_pipeline_counts_toward_cache_stage(monkeypatch):
+    async def slow_execute(self, raise_on_error=True):
+        await asyncio.sleep(0.05)
+        return []
+    monkeypatch.setattr(Pipeline, 'execute', slow_execute)
+    client = make_client()
+    stages = {}
+    token = request_stages.set(stages)
+    try:
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.get('key')
+            await pipe.execute()
+    finally:
+        request_stages.reset(token)
+        await client.aclose()
+
+    assert stages['cache'] >= 0.05  # MGET/SET пачкой тоже время Redis
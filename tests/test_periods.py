@@ -0,0 +1,71 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from app.database.db_functions.db_income import incomes_conditions
+from app.functions.periods import (Period, NAMED_PERIODS, resolve_period, month_period, quarter_period,
+                                   year_period, week_period, rolling_days, date_limits, period_key)
+
+
+def every_day(start=date(2019, 12, 1), end=date(2027, 2, 1)):
+    '''Все дни нескольких лет подряд: високосный 2020/2024 и переходы через Новый год'''
+    day = start
+    while day < end:
+        yield day
+        day += timedelta(days=1)
+
+
+@pytest.mark.parametrize('spec', sorted(NAMED_PERIODS) + ['last 30 days'])
+def test_periods_are_half_open_and_deterministic(spec):
+    for today in every_day():
+        period = resolve_period(spec, today)
+        assert period.start < period.end
+        assert period == resolve_period(spec, today)  # тот же день — тот же ключ кеша
+        if spec.startswith('last ') and spec != 'last 30 days':
+            assert period.end <= today  # прошлый период целиком позади
+        else:
+            assert period.start <= today < period.end
+
+
+def test_previous_period_ends_where_current_starts():
+    for today in every_day():
+        for period in (month_period, quarter_period, year_period, week_period):
+            assert period(today, -1).end == period(today).start
+            assert period(today, 1).start == period(today).end
+
+
+def test_calendar_shapes():
+    for today in every_day():
+        month = month_period(today)
+        assert month.start.day == 1 and month.end.day == 1
+        assert (month.start.year, month.start.month) == (today.year, today.month)
+        assert quarter_period(today).start.month in (1, 4, 7, 10)
+        assert year_period(today).start == date(today.year, 1, 1)
+        week = week_period(today)
+        assert week.start.weekday() == 0 and week.end - week.start == timedelta(days=7)
+        assert rolling_days(today, 7).end - rolling_days(today, 7).start == timedelta(days=8)
+
+
+def test_last_month_across_new_year():
+    # раньше в январе "прошлый месяц" был месяцем номер 0
+    assert month_period(date(2025, 1, 15), -1) == Period(date(2024, 12, 1), date(2025, 1, 1))
+    assert quarter_period(date(2025, 2, 1), -1) == Period(date(2024, 10, 1), date(2025, 1, 1))
+    assert week_period(date(2025, 1, 1)) == Period(date(2024, 12, 30), date(2025, 1, 6))
+    assert month_period(date(2024, 2, 29)).last_day == date(2024, 2, 29)
+
+
+def test_keys_and_sargable_conditions():
+    period = date_limits(date(2025, 1, 1), date(2025, 1, 31))
+    assert period.key == '2025-01-01..2025-02-01'
+    assert period_key(None) == 'all'
+    assert resolve_period('all') is None
+    with pytest.raises(ValueError):
+        resolve_period('fortnight')
+
+    sql = str(incomes_conditions(7, period)[1].compile(dialect=postgresql.dialect(),
+                                                       compile_kwargs={'literal_binds': True}))
+    sql_end = str(incomes_conditions(7, period)[2].compile(dialect=postgresql.dialect(),
+                                                           compile_kwargs={'literal_binds': True}))
+    # голая колонка слева: условие может идти по индексу (owner_id, created_at)
+    assert sql == "incomes.created_at >= '2025-01-01'"
+    assert sql_end == "incomes.created_at < '2025-02-01'"
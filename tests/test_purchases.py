@@ -1,9 +1,16 @@
+import json
+from datetime import date
+
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import AsyncMock, ANY
+from unittest.mock import AsyncMock, ANY, Mock
+from sqlalchemy.dialects import postgresql
 from app.database.db_depends import get_db
 from app.functions.auth_functions import get_current_user
 from app.main import app
+from app.config import settings
+from app.database.models import Purchase
+from app.database.db_functions import get_purchases_totals_from_db
 
 
 client = TestClient(app)
@@ -27,6 +34,12 @@ def override_get_current_user():
     return fake_user
 
 
+@pytest.fixture(autouse=True)
+def rpc_conversion(monkeypatch):
+    # Большинство тестов проверяют путь через currency_aggregator
+    monkeypatch.setattr(settings, 'CURRENCY_CONVERSION', 'rpc')
+
+
 @pytest.fixture
 def client_with_overrides(override_get_db, override_get_current_user):
     app.dependency_overrides[get_db] = override_get_db
@@ -36,11 +49,13 @@ def client_with_overrides(override_get_db, override_get_current_user):
     app.dependency_overrides = {}  # сбросить после теста
 
 
-async def mock_rpc_request(future, raw_data, current):
+async def mock_rpc_request(future, raw_data, current, totals=None):
     '''Мок RPC функции'''
     future.set_result('{"euro": 100, "rub": 10000, "rsd": 11700, "answer": 300}')
-    mock_queue = AsyncMock()
-    return mock_queue, "consumer_tag"
+    return 'correlation_id'
+
+
+mock_get_totals = AsyncMock(return_value={'EUR': 1600.0, 'RUB': 0.0, 'RSD': 0.0})
 
 
 fake_result = [{ # Объект для замены результата ДБешных функций
@@ -88,21 +103,21 @@ async def test_new_list_purchases(monkeypatch, client_with_overrides):
                         "name": "string",
                         "description": "string",
                         "price": 0,
-                        "currency": "string",
+                        "currency": "EUR",
                         "category_id": 0
                     },
                     {
                         "name": "string",
                         "description": "string",
                         "price": 0,
-                        "currency": "string",
+                        "currency": "EUR",
                         "category_id": 0
                     },
                     {
                         "name": "string",
                         "description": "string",
                         "price": 0,
-                        "currency": "string",
+                        "currency": "EUR",
                         "category_id": 0
                     }
                 ]
@@ -127,6 +142,7 @@ async def test_get_all_purchases(monkeypatch, client_with_overrides):
     # patch dependencies
     monkeypatch.setattr("app.routers.purchases.get_all_purchases_from_db", mock_get_all_purchases_from_db)
     monkeypatch.setattr("app.routers.purchases.rpc_purchases_request", mock_rpc_request)
+    monkeypatch.setattr("app.routers.purchases.get_purchases_totals_from_db", mock_get_totals)
 
     # Запрос
     response = client_with_overrides.get("/purchases/all_purchases")
@@ -160,6 +176,7 @@ async def test_get_last_7_days_purchases(monkeypatch, client_with_overrides):
     # patch dependencies
     monkeypatch.setattr("app.routers.purchases.get_purchases_current_week_from_db", mock_get_purchases_current_week_from_db)
     monkeypatch.setattr("app.routers.purchases.rpc_purchases_request", mock_rpc_request)
+    monkeypatch.setattr("app.routers.purchases.get_purchases_totals_from_db", mock_get_totals)
 
     # Запрос
     response = client_with_overrides.get("/purchases/last_7_days_purchases")
@@ -193,6 +210,7 @@ async def test_get_purchases_in_limits(monkeypatch, client_with_overrides):
     # patch dependencies
     monkeypatch.setattr("app.routers.purchases.get_purchases_in_limits_from_db", mock_get_purchases_in_limits_from_db)
     monkeypatch.setattr("app.routers.purchases.rpc_purchases_request", mock_rpc_request)
+    monkeypatch.setattr("app.routers.purchases.get_purchases_totals_from_db", mock_get_totals)
 
     # Запрос
     response = client_with_overrides.get("/purchases/purchases_limits")
@@ -216,3 +234,115 @@ async def test_get_purchases_in_limits(monkeypatch, client_with_overrides):
 async def test_get_purchases_in_limits_validation(current, expected_status, client_with_overrides):
     response = client_with_overrides.get("/purchases/purchases_limits", params={"current": current})
     assert response.status_code == expected_status
+
+
+@pytest.mark.asyncio
+async def test_get_purchases_page(monkeypatch, client_with_overrides):
+    # Полная страница — отдаем курсор на следующую
+    mock_get_page = AsyncMock(return_value=[Purchase.from_json(item) for item in fake_result])
+    monkeypatch.setattr('app.routers.purchases.get_purchases_page_from_db', mock_get_page)
+
+    response = client_with_overrides.get("/purchases/purchases_page",
+                                         params={"after_date": "2025-01-01", "after_id": 7, "limit": 3})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["id"] for item in data["purchases"]] == [item["id"] for item in fake_result]
+    assert data["next_after_date"] == fake_result[-1]["created_at"]
+    assert data["next_after_id"] == fake_result[-1]["id"]
+    mock_get_page.assert_awaited_once_with(ANY, 123, date(2025, 1, 1), 7, 3)
+
+
+@pytest.mark.asyncio
+async def test_get_purchases_last_page(monkeypatch, client_with_overrides):
+    # Неполная страница — курсора нет
+    mock_get_page = AsyncMock(return_value=[Purchase.from_json(fake_result[0])])
+    monkeypatch.setattr('app.routers.purchases.get_purchases_page_from_db', mock_get_page)
+
+    response = client_with_overrides.get("/purchases/purchases_page")
+
+    assert response.status_code == 200
+    assert response.json()["next_after_id"] is None
+    mock_get_page.assert_awaited_once_with(ANY, 123, None, None, 100)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("limit, expected_status", [
+    (0, 422),
+    (1001, 422),
+])
+async def test_get_purchases_page_validation(limit, expected_status, client_with_overrides):
+    response = client_with_overrides.get("/purchases/purchases_page", params={"limit": limit})
+    assert response.status_code == expected_status
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("params", [{"after_id": 7}, {"after_date": "2025-01-01"}])
+async def test_get_purchases_page_needs_full_cursor(params, monkeypatch, client_with_overrides):
+    # половина курсора — 422, а не первая страница заново
+    mock_get_page = AsyncMock(return_value=[])
+    monkeypatch.setattr('app.routers.purchases.get_purchases_page_from_db', mock_get_page)
+
+    response = client_with_overrides.get("/purchases/purchases_page", params=params)
+
+    assert response.status_code == 422
+    mock_get_page.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_stream_purchases(monkeypatch, client_with_overrides):
+    async def fake_stream(owner_id):
+        for item in fake_result:
+            yield Purchase.from_json(item)
+    monkeypatch.setattr('app.routers.purchases.stream_purchases_from_db', fake_stream)
+
+    response = client_with_overrides.get("/purchases/purchases_stream")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == fake_result
+
+
+@pytest.mark.asyncio
+async def test_get_all_purchases_local_conversion(monkeypatch, client_with_overrides):
+    monkeypatch.setattr(settings, 'CURRENCY_CONVERSION', 'local')
+    monkeypatch.setattr(settings, 'AGGREGATE_TOTALS_IN_DB', False)
+    monkeypatch.setattr('app.routers.purchases.get_all_purchases_from_db',
+                        AsyncMock(return_value=[Purchase.from_json(item) for item in fake_result]))
+    monkeypatch.setattr('app.functions.currency.CurrencyRates.get_rates',
+                        AsyncMock(return_value={'EUR': 1.0, 'RUB': 100.0, 'RSD': 117.0}))
+    mock_rpc = AsyncMock()
+    monkeypatch.setattr('app.routers.purchases.rpc_purchases_request', mock_rpc)
+
+    response = client_with_overrides.get("/purchases/all_purchases", params={"current": "RSD"})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["euro"] == 2500
+    assert data["rub"] == 250000
+    assert data["rsd"] == data["answer"] == 292500
+    mock_rpc.assert_not_awaited()  # без похода в брокер
+
+
+def test_create_purchases_rejects_unknown_currency(client_with_overrides):
+    payload = {"purchases": [{"name": "Coffee", "description": "Cafe", "price": 3,
+                              "currency": "usd", "category_id": 1}]}
+
+    response = client_with_overrides.post("/purchases/new_purchases", json=payload)
+
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_purchases_totals_skip_unknown_and_null_currency(monkeypatch, fake_redis):
+    monkeypatch.setattr(settings, 'USE_MONTHLY_ROLLUPS', False)
+    db = AsyncMock()
+    # NULL Postgres уже свернул в EUR, 'usd' и None сюда попадать не должны
+    db.execute.return_value = Mock(all=Mock(return_value=[('EUR', 10.0), ('usd', 5.0), (None, 1.0)]))
+
+    totals = await get_purchases_totals_from_db(db, 123)
+
+    assert totals == {'EUR': 10.0, 'RUB': 0.0, 'RSD': 0.0}
+    query = str(db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert 'coalesce(purchases.currency' in query
@@ -0,0 +1,285 @@
+import asyncio
+import gc
+import json
+import os
+import time
+import uuid
+
+import pytest
+from unittest.mock import AsyncMock
+from prometheus_client import REGISTRY
+from app.config import settings
+from app.rabbitmq import (RabbitMQConnectionManager, RPCReplyConsumer, RPCBatcher,
+                          declare_topology, rpc_incomes_request, rpc_purchases_request)
+
+
+class FakeIncomingMessage:
+    def __init__(self, body, correlation_id):
+        self.body = body
+        self.correlation_id = correlation_id
+
+    async def ack(self):
+        pass
+
+
+class FakeQueue:
+    def __init__(self, broker, channel, name):
+        self.broker = broker
+        self.channel = channel
+        self.name = name
+
+    async def consume(self, callback):
+        self.broker.consumers[self.name] = callback
+        return f'ctag-{self.name}'
+
+
+class FakeExchange:
+    def __init__(self, broker):
+        self.broker = broker
+
+    async def publish(self, message, routing_key):
+        self.broker.published += 1
+        self.broker.last_body = message.body
+        asyncio.create_task(self.broker.respond(message))
+
+
+class FakeChannel:
+    '''Минимальная замена канала aio_pika: эмулирует брокер и currency_aggregator в памяти'''
+    def __init__(self, latency=0.01, reply=True):
+        self.is_closed = False
+        self.latency = latency
+        self.reply = reply
+        self.lost = 0
+        self.declared = 0
+        self.consumers = {}
+        self.published = 0
+        self.deliveries = 0
+        self.default_exchange = FakeExchange(self)
+
+    async def declare_queue(self, name=None, **kwargs):
+        self.declared += 1
+        return FakeQueue(self, self, name or f'amq.gen-{uuid.uuid4()}')
+
+    async def respond(self, message):
+        await asyncio.sleep(self.latency)
+        if not self.reply:
+            return
+        answer = {'euro': 100, 'rub': 10000, 'rsd': 11700, 'answer': 300}
+        payload = json.loads(message.body)
+        if 'batch' in payload:  # пачка: ответ на каждый id, первые self.lost агрегатор "теряет"
+            answer = {'results': {item['id']: answer | {'answer': item['current_currency']}
+                                  for item in payload['batch'][self.lost:]}}
+        answer = json.dumps(answer).encode()
+        self.deliveries += 1
+        await self.consumers[message.reply_to](FakeIncomingMessage(answer, message.correlation_id))
+
+
+@pytest.fixture
+def fake_channel(monkeypatch):
+    channel = FakeChannel()
+    RPCReplyConsumer.reset()
+    monkeypatch.setattr(RabbitMQConnectionManager, 'get_channel', AsyncMock(return_value=channel))
+    monkeypatch.setattr(RabbitMQConnectionManager, 'open_channel', AsyncMock(return_value=channel))
+    monkeypatch.setattr(RabbitMQConnectionManager, '_pool', [])
+    monkeypatch.setattr(RabbitMQConnectionManager, '_pool_slots', None)
+    yield channel
+    RPCReplyConsumer.reset()
+
+
+async def timed_rpc_call():
+    future = asyncio.get_running_loop().create_future()
+    start = time.perf_counter()
+    await rpc_incomes_request(future, [], 'EUR')
+    await asyncio.wait_for(future, timeout=5)
+    return time.perf_counter() - start
+
+
+def p99(samples):
+    samples = sorted(samples)
+    return samples[max(0, int(len(samples) * 0.99) - 1)]
+
+
+@pytest.mark.asyncio
+async def test_rpc_replies_delivered_once_under_concurrency(fake_channel):
+    total = 0
+    for concurrency in (1, 10, 50, 200):
+        await asyncio.gather(*(timed_rpc_call() for _ in range(concurrency)))
+        total += concurrency
+
+    # каждый ответ доставлен ровно один раз — никакого requeue по кругу
+    assert fake_channel.deliveries == total
+    assert fake_channel.published == total
+    assert len(fake_channel.consumers) == 1
+    assert RPCReplyConsumer.pending() == 0
+
+
+# Бенчмарк задержки RPC, в обычный прогон не входит:
+# BENCH_RPC=1 pytest tests/test_rabbitmq.py -s -k latency
+@pytest.mark.asyncio
+@pytest.mark.skipif(os.getenv('BENCH_RPC') is None, reason='BENCH_RPC is not set')
+async def test_rpc_latency_flat_under_concurrency(fake_channel):
+    '''p99 при 200 одновременных запросах не растет относительно одиночного'''
+    results = {}
+    gc.collect()
+    gc.freeze()  # паузы GC на куче, оставшейся от других тестов, к RPC не относятся
+    try:
+        for concurrency in (1, 10, 50, 200):
+            samples = await asyncio.gather(*(timed_rpc_call() for _ in range(concurrency)))
+            results[concurrency] = p99(samples)
+    finally:
+        gc.unfreeze()
+    print(results)
+
+    assert results[200] < results[1] * 3 + 0.05, results
+
+
+@pytest.mark.asyncio
+async def test_rpc_declares_queues_once(fake_channel):
+    await asyncio.gather(*(timed_rpc_call() for _ in range(10)))
+
+    assert fake_channel.declared == 2  # reply-очередь и очередь запросов, а не по две на вызов
+
+
+@pytest.mark.asyncio
+async def test_declare_topology_prepares_every_rpc_channel(fake_channel):
+    await declare_topology()
+    await timed_rpc_call()
+
+    assert fake_channel.declared == 4  # два канала по reply-очереди и очереди запросов
+    assert len(fake_channel.consumers) == 2
+
+
+@pytest.mark.asyncio
+async def test_rpc_timeout_cleans_registry(fake_channel):
+    fake_channel.reply = False
+    future = asyncio.get_running_loop().create_future()
+    await rpc_incomes_request(future, [], 'EUR')
+    assert RPCReplyConsumer.pending() == 1
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(future, timeout=0.05)
+
+    assert RPCReplyConsumer.pending() == 0
+
+
+@pytest.mark.asyncio
+async def test_rpc_late_reply_is_dropped(fake_channel):
+    fake_channel.latency = 0.05
+    future = asyncio.get_running_loop().create_future()
+    await rpc_incomes_request(future, [], 'EUR')
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(future, timeout=0.01)
+    await asyncio.sleep(0.1)  # ответ приходит после таймаута
+
+    assert fake_channel.deliveries == 1
+    assert RPCReplyConsumer.pending() == 0
+
+
+@pytest.mark.asyncio
+async def test_rpc_sends_only_currency_totals(fake_channel):
+    future = asyncio.get_running_loop().create_future()
+    rows = [AsyncMock() for _ in range(1000)]  # строки в режиме итогов не сериализуются
+    await rpc_incomes_request(future, rows, 'EUR', {'EUR': 1500.0, 'RUB': 0.0, 'RSD': 200.0})
+    await asyncio.wait_for(future, timeout=5)
+
+    payload = json.loads(fake_channel.last_body)
+    assert payload['incomes'] == [{'quantity': 1500.0, 'currency': 'EUR'},
+                                  {'quantity': 0.0, 'currency': 'RUB'},
+                                  {'quantity': 200.0, 'currency': 'RSD'}]
+    assert payload['content'] == 'Incomes'
+
+
+@pytest.fixture
+def batching(monkeypatch, fake_channel):
+    monkeypatch.setattr(settings, 'RPC_BATCHING', True)
+    monkeypatch.setattr(settings, 'RPC_BATCH_WINDOW', 0.005)
+    monkeypatch.setattr(settings, 'RPC_BATCH_MAX', 64)
+    RPCBatcher.reset()
+    yield fake_channel
+    RPCBatcher.reset()
+
+
+async def batched_call(current):
+    future = asyncio.get_running_loop().create_future()
+    await rpc_purchases_request(future, None, current, {'EUR': 10.0, 'RUB': 0.0, 'RSD': 0.0})
+    return json.loads(await asyncio.wait_for(future, timeout=1))
+
+
+@pytest.mark.asyncio
+async def test_rpc_batching_one_message_per_window(batching):
+    batches = REGISTRY.get_sample_value('rpc_batch_size_count') or 0
+    currencies = ['EUR', 'RUB', 'RSD'] * 10
+
+    answers = await asyncio.gather(*(batched_call(current) for current in currencies))
+
+    payload = json.loads(batching.last_body)
+    assert batching.published == 1
+    assert len(payload['batch']) == 30
+    assert payload['batch'][0]['content'] == 'Purchases'
+    # ответ пачки разложен по своим запросам, а не перемешан
+    assert [answer['answer'] for answer in answers] == currencies
+    assert REGISTRY.get_sample_value('rpc_batch_size_count') == batches + 1
+    assert RPCReplyConsumer.pending() == 0
+
+
+@pytest.mark.asyncio
+async def test_rpc_batch_sent_when_full(batching, monkeypatch):
+    monkeypatch.setattr(settings, 'RPC_BATCH_WINDOW', 60)  # отправить может только заполнение пачки
+
+    answers = await asyncio.gather(*(batched_call('EUR') for _ in range(128)))
+
+    assert batching.published == 2
+    assert len(answers) == 128
+
+
+@pytest.mark.asyncio
+async def test_rpc_batch_item_missing_in_reply(batching):
+    batching.lost = 1
+
+    lost, answered = await asyncio.gather(batched_call('RUB'), batched_call('RSD'))
+
+    assert lost['answer'] == 'CurrentAggregator lost the request'
+    assert answered['answer'] == 'RSD'
+
+
+@pytest.mark.asyncio
+async def test_channel_pool_is_bounded_and_reused(fake_channel, monkeypatch):
+    monkeypatch.setattr(settings, 'RABBITMQ_CHANNEL_POOL_SIZE', 2)
+    opened = []
+    monkeypatch.setattr(RabbitMQConnectionManager, 'open_channel',
+                        AsyncMock(side_effect=lambda: opened.append(FakeChannel()) or opened[-1]))
+    waits = REGISTRY.get_sample_value('rabbitmq_channel_wait_seconds_count') or 0
+    in_use = []
+
+    async def publish():
+        async with RabbitMQConnectionManager.acquire() as channel:
+            in_use.append(channel)
+            assert len(in_use) <= 2
+            await asyncio.sleep(0.01)
+            in_use.remove(channel)
+
+    await asyncio.gather(*(publish() for _ in range(10)))
+    opened[0].is_closed = True  # канал закрыл брокер — из пула он больше не выдается
+    async with RabbitMQConnectionManager.acquire() as channel:
+        assert channel is opened[1]
+
+    assert len(opened) == 2
+    assert REGISTRY.get_sample_value('rabbitmq_channel_wait_seconds_count') == waits + 11
+    assert REGISTRY.get_sample_value('rabbitmq_channels_in_use') == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_publish_cleans_registry(fake_channel, monkeypatch):
+    async def broken_publish(message, routing_key):
+        raise ConnectionError('channel is closed')
+
+    monkeypatch.setattr(fake_channel.default_exchange, 'publish', broken_publish)
+    future = asyncio.get_running_loop().create_future()
+
+    with pytest.raises(ConnectionError):
+        await rpc_incomes_request(future, [], 'EUR')
+    await asyncio.sleep(0)  # колбэки футуры выполняются на следующей итерации цикла
+
+    assert future.cancelled()
+    assert RPCReplyConsumer.pending() == 0
@@ -1,4 +1,7 @@
+import asyncio
 import io
+import os
+import time
 
 import pytest
 from fastapi.testclient import TestClient
@@ -6,6 +9,9 @@ from unittest.mock import AsyncMock, ANY, Mock
 from app.database.db_depends import get_db
 from app.functions.auth_functions import get_current_user
 from app.main import app
+from app.config import settings
+from app.functions.report_cache import ReportCache
+from app.functions.report_jobs import ReportJobs
 from app.database.models import Purchase, Income, Category
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
@@ -32,6 +38,12 @@ def override_get_current_user():
     return fake_user
 
 
+@pytest.fixture(autouse=True)
+def report_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, 'REPORT_CACHE_DIR', str(tmp_path))
+    return tmp_path
+
+
 @pytest.fixture
 def client_with_overrides(override_get_db, override_get_current_user):
     app.dependency_overrides[get_db] = override_get_db
@@ -44,8 +56,7 @@ def client_with_overrides(override_get_db, override_get_current_user):
 async def mock_rpc_request(future, raw_data, current):
     '''Мок RPC функции'''
     future.set_result('{"euro": 100, "rub": 10000, "rsd": 11700, "answer": 300}')
-    mock_queue = AsyncMock()
-    return mock_queue, "consumer_tag"
+    return 'correlation_id'
 
 
 fake_result_purchases = [Purchase.from_json({ # Объект для замены результата ДБешных функций
@@ -133,21 +144,17 @@ async def mock_rpc_report_request(future, raw_data, current):
     pdf_buf.seek(0)
     pdf_bytes = pdf_buf.getvalue()
     future.set_result(pdf_bytes)
-    mock_queue = AsyncMock()
-    return mock_queue, "consumer_tag"
+    return 'correlation_id'
 
 
 @pytest.mark.asyncio
 async def test_get_rab_report(monkeypatch, client_with_overrides):
     # mock DB dependency
-    mock_get_purchases_in_limits_from_db = AsyncMock(return_value=fake_result_purchases)
-    mock_get_incomes_in_time_limits_from_db = AsyncMock(return_value=fake_result_incomes)
-    mock_get_all_categories_from_db = AsyncMock(return_value=fake_result_categories)
+    mock_get_report_rows_from_db = AsyncMock(return_value=(fake_result_purchases, fake_result_incomes,
+                                                           fake_result_categories))
 
     # patch dependencies
-    monkeypatch.setattr("app.routers.reports.get_purchases_in_limits_from_db", mock_get_purchases_in_limits_from_db)
-    monkeypatch.setattr("app.routers.reports.get_incomes_in_time_limits_from_db", mock_get_incomes_in_time_limits_from_db)
-    monkeypatch.setattr("app.routers.reports.get_all_categories_from_db", mock_get_all_categories_from_db)
+    monkeypatch.setattr("app.routers.reports.get_report_rows_from_db", mock_get_report_rows_from_db)
     monkeypatch.setattr("app.routers.reports.rpc_report_request", mock_rpc_report_request)
 
     # Запрос
@@ -156,6 +163,143 @@ async def test_get_rab_report(monkeypatch, client_with_overrides):
     # Ожидаемые ответы
     assert response.status_code == 200
 
-    mock_get_purchases_in_limits_from_db.assert_awaited_once_with(ANY, 123, ANY, ANY)
-    mock_get_incomes_in_time_limits_from_db.assert_awaited_once_with(ANY, 123, ANY, ANY)
-    mock_get_all_categories_from_db.assert_awaited_once_with(ANY, 123)
+    mock_get_report_rows_from_db.assert_awaited_once_with(ANY, 123, ANY)
+
+
+@pytest.mark.asyncio
+async def test_get_rab_report_cached(monkeypatch, client_with_overrides):
+    monkeypatch.setattr("app.routers.reports.get_report_rows_from_db",
+                        AsyncMock(return_value=(fake_result_purchases, fake_result_incomes, fake_result_categories)))
+    mock_rpc = AsyncMock(side_effect=mock_rpc_report_request)
+    monkeypatch.setattr("app.routers.reports.rpc_report_request", mock_rpc)
+
+    first = client_with_overrides.get("/reports/report_ask")
+    second = client_with_overrides.get("/reports/report_ask")  # те же данные — тот же PDF из кеша
+    third = client_with_overrides.get("/reports/report_ask", params={"current": "RSD"})
+
+    assert first.status_code == second.status_code == third.status_code == 200
+    assert first.content == second.content
+    assert mock_rpc.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_report_cache_lru_eviction(monkeypatch, report_cache_dir):
+    monkeypatch.setattr(settings, 'REPORT_CACHE_MAX_BYTES', 250)
+    await ReportCache.put('old', b'x' * 100)
+    await ReportCache.put('used', b'y' * 100)
+    os.utime(report_cache_dir / 'old.pdf', (1, 1))
+    os.utime(report_cache_dir / 'used.pdf', (2, 2))
+    assert await ReportCache.get('used') == b'y' * 100  # обращение освежает запись
+
+    await ReportCache.put('new', b'z' * 100)
+
+    assert await ReportCache.get('old') is None
+    assert await ReportCache.get('used') is not None
+    assert await ReportCache.get('new') is not None
+
+
+@pytest.mark.asyncio
+async def test_report_cache_concurrent_writes_of_same_report(report_cache_dir):
+    await asyncio.gather(*(ReportCache.put('same', b'pdf') for _ in range(20)))
+
+    assert await ReportCache.get('same') == b'pdf'
+    assert [path.name for path in report_cache_dir.iterdir()] == ['same.pdf']  # временных файлов не осталось
+
+
+@pytest.mark.asyncio
+async def test_report_cache_removes_temp_file_on_error(monkeypatch, report_cache_dir):
+    monkeypatch.setattr('app.functions.report_cache.os.replace', Mock(side_effect=OSError('disk full')))
+
+    with pytest.raises(OSError):
+        await ReportCache.put('broken', b'pdf')
+    assert list(report_cache_dir.iterdir()) == []
+
+
+def patch_report_data(monkeypatch):
+    monkeypatch.setattr("app.routers.reports.get_report_rows_from_db",
+                        AsyncMock(return_value=(fake_result_purchases, fake_result_incomes, fake_result_categories)))
+
+
+@pytest.mark.asyncio
+async def test_report_job_submit_poll_download(monkeypatch, client_with_overrides, fake_redis):
+    patch_report_data(monkeypatch)
+    mock_rpc = AsyncMock(side_effect=mock_rpc_report_request)
+    monkeypatch.setattr("app.functions.report_jobs.rpc_report_request", mock_rpc)
+
+    response = client_with_overrides.post("/reports/jobs")
+    assert response.status_code == 202
+    job_id = response.json()['job_id']
+
+    # ответ RPC дожидается фоновая задача — опрашиваем статус
+    for _ in range(50):
+        job = client_with_overrides.get(f"/reports/jobs/{job_id}").json()
+        if job['status'] != 'pending':
+            break
+        time.sleep(0.01)
+    assert job == {'job_id': job_id, 'status': 'done'}
+
+    pdf = client_with_overrides.get(f"/reports/jobs/{job_id}/pdf")
+    assert pdf.status_code == 200
+    assert pdf.headers['content-type'] == 'application/pdf'
+
+    # повторный запрос с теми же данными берет PDF из кеша без RPC
+    again = client_with_overrides.post("/reports/jobs")
+    assert again.json()['status'] == 'done'
+    assert mock_rpc.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_report_job_fails_when_reply_is_cancelled(fake_redis, caplog):
+    future = asyncio.get_running_loop().create_future()
+    future.cancel()  # как RPCReplyConsumer.reset() при остановке
+
+    await ReportJobs.wait_report('cancelled_job', 123, 'key', future)
+
+    assert await ReportJobs.status('cancelled_job', 123) == 'failed'
+    assert 'Report job cancelled_job failed' in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_report_jobs_stop_marks_waiting_jobs_failed(monkeypatch, fake_redis):
+    monkeypatch.setattr("app.functions.report_jobs.rpc_report_request", AsyncMock())
+    job = await ReportJobs.submit(123, {'purchases': []}, 'EUR')
+    await asyncio.sleep(0)  # задача уже ждет ответа
+
+    await ReportJobs.stop()
+
+    assert ReportJobs._tasks == set()
+    assert await ReportJobs.status(job['job_id'], 123) == 'failed'
+
+
+@pytest.mark.asyncio
+async def test_report_job_fails_when_cache_write_fails(monkeypatch, fake_redis, caplog):
+    monkeypatch.setattr(ReportCache, 'put', AsyncMock(side_effect=OSError('disk full')))
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(b'%PDF')
+
+    await ReportJobs.wait_report('broken_job', 123, 'key', future)
+
+    assert await ReportJobs.status('broken_job', 123) == 'failed'
+    assert 'disk full' in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_report_job_timeout_from_settings(monkeypatch, fake_redis):
+    monkeypatch.setattr(settings, 'REPORT_RPC_TIMEOUT', 0.01)
+    future = asyncio.get_running_loop().create_future()
+
+    await ReportJobs.wait_report('slow_job', 123, 'key', future)
+
+    assert await ReportJobs.status('slow_job', 123) == 'failed'
+
+
+@pytest.mark.asyncio
+async def test_report_job_pending_and_foreign(client_with_overrides, fake_redis):
+    await ReportJobs.save('pending_job', 123, 'pending')
+    await ReportJobs.save('foreign_job', 456, 'done')
+
+    assert client_with_overrides.get("/reports/jobs/pending_job/pdf").status_code == 409
+    # чужая задача для юзера не существует
+    assert client_with_overrides.get("/reports/jobs/foreign_job").status_code == 404
+    assert client_with_overrides.get("/reports/jobs/foreign_job/pdf").status_code == 404
+    assert client_with_overrides.get("/reports/jobs/missing").status_code == 404